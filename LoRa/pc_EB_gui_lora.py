@@ -1,7 +1,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
-import json, threading, time
+import json, os, sys, threading, time
 from sx126x import sx126x  # Tu clase LoRa
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "v1"))
+from NodoLoRa.HeaderCodec import decode_legacy, encode_legacy  # cabecera de 6 bytes de lora_to_robot.py
 import requests
 
 # ==== Configuración LoRa ====
@@ -155,14 +157,7 @@ class RobotGUI:
     def send_cmd(self, cmd):
         # Enviar por LoRa
         message = json.dumps(cmd)
-        packet = bytes([
-            DEST_ADDRESS >> 8,
-            DEST_ADDRESS & 0xFF,
-            NODE_ADDRESS >> 8,
-            NODE_ADDRESS & 0xFF,
-            RELAY_BIT | (TYPE_MSG & 0x7F),
-            ID_MSG & 0xFF
-        ]) + message.encode()
+        packet = encode_legacy(DEST_ADDRESS, NODE_ADDRESS, RELAY_BIT | (TYPE_MSG & 0x7F), ID_MSG, message.encode())
         self.lora.send(packet)
         self._append_output(f"📡 LoRa sent: {message}")
 
@@ -241,10 +236,9 @@ class RobotGUI:
             if self.lora.ser.in_waiting > 0:
                 data = self.lora.ser.read(self.lora.ser.in_waiting)
                 if len(data) >= 8:
-                    src = (data[2] << 8) | data[3]
-                    body = data[6:]
+                    _, src, _, _, body = decode_legacy(data)
                     try:
-                        msg_part = body.decode('utf-8', errors='ignore')
+                        msg_part = str(body, 'utf-8', 'ignore')
                         buffer += msg_part  # acumulamos el fragmento recibido
 
                         # Mientras haya un JSON completo en el buffer
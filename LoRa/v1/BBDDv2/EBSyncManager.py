@@ -1,7 +1,10 @@
 import json
+from collections import OrderedDict
 from datetime import datetime
 import os
 
+from BBDDv2.SyncCodec import decode_packet, is_binary_packet
+
 class BaseStationSyncManager:
     def __init__(self, media_folder="media", db=None):
         """
@@ -11,11 +14,18 @@ class BaseStationSyncManager:
         self.media_folder = media_folder
         os.makedirs(media_folder, exist_ok=True)
         self.db = db
+        # ACKs de los últimos paquetes procesados, por (robot_id, packet_id): si el
+        # nodo retransmite un paquete cuyo ACK se perdió, se repite el ACK sin
+        # volver a procesarlo. Es sólo un atajo en memoria: lo que evita guardar
+        # dos veces un registro (p. ej. tras reiniciar la EB) es la clave única
+        # (robot, id local, timestamp) de BaseStationDatabase
+        self.recent_acks = OrderedDict()
+        self.max_recent = 256
 
-    def process_packet(self, packet_json: str) -> dict:
+    def process_packet(self, packet_json) -> dict:
         """
-        Procesa un paquete JSON recibido desde un robot.
-        packet_json: string JSON con formato:
+        Procesa un paquete recibido desde un robot: binario (SyncCodec) si llega
+        como bytes, o JSON si llega como string, con formato:
         {
             "packet_id": "...",
             "entries": [
@@ -24,11 +34,19 @@ class BaseStationSyncManager:
                 {"table":"media", "id":3, "data": {...}}
             ]
         }
-        Devuelve un dict tipo ACK con los registros guardados.
+        Devuelve un dict tipo ACK con los registros guardados ({"table", "id"});
+        los ids insertados en Mongo no se devuelven porque el nodo no los usa.
         """
-        packet = json.loads(packet_json)
+        if is_binary_packet(packet_json):
+            packet = decode_packet(packet_json)
+        else:
+            packet = json.loads(packet_json)
         packet_id = packet.get("packet_id")
         entries = packet.get("entries", [])
+        key = (entries[0].get("data", {}).get("robot_id") if entries else None, packet_id)
+        if key in self.recent_acks:
+            print(f"Paquete {packet_id} repetido, se reenvía su ACK")
+            return self.recent_acks[key]
 
         ack = {
             "packet_id": packet_id,
@@ -47,14 +65,16 @@ class BaseStationSyncManager:
                     robot_id=robot_id,
                     temp=data.get("temp"),
                     hum=data.get("hum"),
-                    timestamp=timestamp
+                    timestamp=timestamp,
+                    local_id=e.get("id")
                 )
             elif table == "robot_movimiento":
                 inserted_id = self.db.insert_movimiento(
                     robot_id=robot_id,
                     L=data.get("L"),
                     R=data.get("R"),
-                    timestamp=timestamp
+                    timestamp=timestamp,
+                    local_id=e.get("id")
                 )
             elif table == "media":
                 path = data.get("path")
@@ -65,19 +85,21 @@ class BaseStationSyncManager:
                     path=path,
                     es_video=data.get("es_video", False),
                     checksum=data.get("checksum"),
-                    timestamp=timestamp
+                    timestamp=timestamp,
+                    local_id=e.get("id")
                 )
             else:
                 continue
 
             ack["saved"].append({
                 "table": table,
-                "robot_id": robot_id,
-                "id": e.get("id"),
-                "inserted_id": inserted_id
+                "id": e.get("id")
             })
 
         print(f"Se guardaron {len(ack['saved'])} registros del paquete {packet_id}")
+        self.recent_acks[key] = ack
+        while len(self.recent_acks) > self.max_recent:
+            self.recent_acks.popitem(last=False)
 
         return ack
     
\ No newline at end of file
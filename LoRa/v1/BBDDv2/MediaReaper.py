@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+
+class MediaReaper:
+    """
+    Borra en segundo plano los ficheros de la media ya sincronizada.
+
+    Trabaja por tandas de 'batch' registros: fetch(batch) devuelve
+    [(id, path)] de media sincronizada, se borran sus ficheros fuera de
+    cualquier transacción y después forget(ids) elimina esas filas de una vez.
+    Así una fila sólo desaparece cuando su fichero ya no está, y si el nodo se
+    apaga a medias la tanda se repite (un fichero que ya no existe no es error).
+
+    wake() pide una pasada (delete_synced_entries la pide cada vez); entre
+    tandas se cede 'pause' segundos para no acaparar la SD.
+    """
+    def __init__(self, fetch, forget, batch=50, pause=0.05):
+        self.fetch = fetch
+        self.forget = forget
+        self.batch = batch
+        self.pause = pause
+        self.event = threading.Event()
+        self.running = True
+        self.removed = 0
+        self.errors = 0
+        threading.Thread(target=self._reap_loop, name="media-reaper", daemon=True).start()
+
+    def wake(self):
+        self.event.set()
+
+    def reap_once(self) -> int:
+        """Una tanda: borra hasta 'batch' ficheros y sus filas. Devuelve cuántas filas se han eliminado."""
+        items = self.fetch(self.batch)
+        if not items:
+            return 0
+        done = []
+        for record_id, path in items:
+            try:
+                if path and os.path.exists(path):
+                    os.remove(path)
+                    self.removed += 1
+                done.append(record_id)
+            except OSError as e:
+                # Se deja la fila para reintentarlo en la próxima pasada
+                self.errors += 1
+                print(f"[{time.strftime('%H:%M:%S')}] Error borrando {path}: {e}")
+        if done:
+            self.forget(done)
+        return len(done)
+
+    def _reap_loop(self):
+        while self.running:
+            self.event.wait()
+            self.event.clear()
+            while self.running:
+                try:
+                    if self.reap_once() < self.batch:
+                        break
+                except Exception as e:
+                    print(f"[{time.strftime('%H:%M:%S')}] Error en el borrado de media: {e}")
+                    break
+                time.sleep(self.pause)
+
+    def stats(self) -> dict:
+        return {"removed": self.removed, "errors": self.errors}
+
+    def stop(self):
+        self.running = False
+        self.event.set()
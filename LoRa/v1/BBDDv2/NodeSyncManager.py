@@ -1,15 +1,45 @@
+import itertools
 import json
+import random
+import threading
+import time
 from re import S
-import uuid
+
+from BBDDv2.SyncCodec import SyncEncoder, decode_ack, is_binary_ack
+
+# Espacio útil para un paquete: MTU del módulo (240) - cabecera LoRa (7)
+BINARY_MAX_BYTES = 233
+# Tamaño del envoltorio JSON del paquete sin registros y separador entre registros
+JSON_OVERHEAD = len(json.dumps({"packet_id": 0xFFFF, "entries": []}))
+JSON_SEPARATOR = ", "
+
+# Tablas que se sincronizan, en el orden en que se alternan
+SYNC_TABLES = ("sensores", "robot_movimiento", "media")
+
+# IDs de paquete de 16 bits; sin estado guardado se empieza en un valor
+# aleatorio para no repetir los de una ejecución anterior
+_packet_ids = itertools.count(random.randrange(0x10000))
+
+
+def new_packet_id() -> int:
+    return next(_packet_ids) & 0xFFFF
+
 
 class SyncPacket:
-    def __init__(self, entries):
+    def __init__(self, entries, robot_id=0, payload=None, packet_id=None):
         """
         entries: lista de diccionarios, cada uno con un registro de sensor, movimiento o media
+        payload: paquete binario ya codificado (None = formato JSON)
         """
-        self.packet_id = str(uuid.uuid4())  # ID único para ACK
+        self.packet_id = new_packet_id() if packet_id is None else packet_id  # ID único para ACK
         self.entries = entries
-        self.length = len(self.to_json().encode('utf-8'))
+        self.robot_id = robot_id
+        self.payload = payload
+        self.length = len(payload) if payload is not None else len(self.to_json().encode('utf-8'))
+
+    def encode(self):
+        """Lo que se envía por LoRa: bytes en formato binario o str en JSON."""
+        return self.payload if self.payload is not None else self.to_json()
 
     def to_json(self) -> str:
         """
@@ -21,132 +51,307 @@ class SyncPacket:
         })
 
 
+class InFlight:
+    """Paquete enviado y pendiente de ACK."""
+    def __init__(self, packet, rto):
+        self.packet = packet
+        self.sent_at = time.monotonic()
+        self.deadline = self.sent_at + rto
+        self.attempts = 1
+
+
 class NodeSyncManager:
-    def __init__(self, db, r_id=0, max_bytes=240) -> list[SyncPacket]:
+    def __init__(self, db, r_id=0, max_bytes=BINARY_MAX_BYTES, codec="binary", window=4, rto=10.0, max_rto=120.0, batch=64) -> list[SyncPacket]:
         """
         db: instancia de RobotDatabase
-        max_bytes: tamaño máximo del paquete en bytes
+        max_bytes: tamaño máximo del paquete JSON completo en bytes
+        codec: "binary" (SyncCodec) o "json" (formato anterior)
+        window: paquetes enviados sin ACK como máximo
+        rto: espera inicial antes de retransmitir un paquete (se dobla en cada reintento hasta max_rto)
+        batch: registros leídos de cada tabla por consulta
+
+        El cursor, el siguiente packet_id y los paquetes en vuelo se guardan en
+        la BBDD (RobotDatabase.save_packet) antes de enviar cada paquete nuevo,
+        así que tras un reinicio se retoma donde se quedó: los paquetes en vuelo
+        se reconstruyen con su mismo packet_id (la EB los reconoce como repetidos
+        si ya los guardó) y no se vuelve a enviar nada anterior al cursor.
         """
         self.db = db
         self.max_bytes = max_bytes
         self.robot_id = r_id
+        self.codec = codec
+        self.window = window
+        self.rto = rto
+        self.max_rto = max_rto
+        self.batch = batch
+        self.cond = threading.Condition()
+        self.in_flight = {}         # packet_id -> InFlight
+        self.cursor = {}            # tabla -> último id ya metido en un paquete
+        self.stream = None          # generador de paquetes nuevos
+        self.retransmissions = 0
+        self.acked = 0
+        self.last_ack = None
+        self.packet_ids = _packet_ids
+        if hasattr(db, "load_sync_state"):
+            self._resume(db.load_sync_state())
+
+    def _next_packet_id(self) -> int:
+        return next(self.packet_ids) & 0xFFFF
+
+    def _resume(self, state):
+        """Recupera el cursor, los packet_id y los paquetes en vuelo de la ejecución anterior."""
+        self.cursor = {table: int(i) for table, i in state["cursor"].items()}
+        self.last_ack = state["last_ack"]
+        if state["next_packet_id"] is not None:
+            self.packet_ids = itertools.count(state["next_packet_id"])
+        now = time.monotonic()
+        for packet_id, keys in state["in_flight"]:
+            pkt = self._rebuild(packet_id, keys)
+            if pkt is None:
+                self.db.drop_packet(packet_id)
+                continue
+            f = InFlight(pkt, self.rto)
+            f.deadline = now            # se reenvía en el primer poll
+            self.in_flight[packet_id] = f
+        # El cursor guardado puede haber quedado por delante de pendientes con ids
+        # reutilizados (BBDD de antes de AUTOINCREMENT)
+        self._rewind()
+        if self.in_flight or self.cursor:
+            print(f"Sincronización retomada: {len(self.in_flight)} paquetes en vuelo, cursor {self.cursor}")
+
+    def _rebuild(self, packet_id, keys):
+        """Vuelve a codificar un paquete en vuelo con los registros que siguen pendientes."""
+        by_table = {}
+        for table, record_id in keys:
+            by_table.setdefault(table, []).append(record_id)
+        entries = [e for table in SYNC_TABLES if table in by_table
+                   for e in self.db.get_entries(table, by_table[table])]
+        if not entries:
+            return None
+        if self.codec == "binary":
+            enc = SyncEncoder(packet_id, self.robot_id, BINARY_MAX_BYTES)
+            for entry in entries:
+                enc.try_add(entry)      # cabían en el paquete original
+            return SyncPacket(enc.entries, self.robot_id, enc.to_bytes(), packet_id)
+        for entry in entries:
+            entry["data"]["robot_id"] = self.robot_id
+        return SyncPacket(entries, packet_id=packet_id)
 
     # ---------------------------
-    # Preparar paquetes JSON
+    # Empaquetado
     # ---------------------------
-    def prepare_packets_sensors(self):
+    def iter_packets(self, unsynced):
         """
-        Lee registros pendientes de sincronización y los divide en paquetes ≤ max_bytes
-        Devuelve lista de SyncPacket, listos para serializar a JSON.
+        Empaquetador voraz único para cualquier fuente de registros (sensores,
+        movimientos, media o combinados) y ambos codecs. Cada registro se
+        codifica una sola vez y su tamaño se suma al del paquete en curso, que
+        se cierra cuando el siguiente ya no cabe. Es un generador: 'unsynced'
+        puede ser otro generador y los paquetes se construyen según se piden.
         """
-        unsynced = self.db.get_unsynced_sensors()  # lista de dicts por tabla
-        packets = []
-        current_entries = []
+        if self.codec == "binary":
+            return self._iter_binary(unsynced)
+        return self._iter_json(unsynced)
 
+    def _iter_binary(self, unsynced):
+        enc = SyncEncoder(self._next_packet_id(), self.robot_id, BINARY_MAX_BYTES)
         for entry in unsynced:
-            entry["data"]["robot_id"] = self.robot_id
-            current_entries.append(entry)
-            packet_size = len(json.dumps(current_entries).encode('utf-8'))
-            if packet_size > self.max_bytes:
-                current_entries.pop()  # quitar último registro
-                if current_entries:
-                    packets.append(SyncPacket(current_entries))
-                current_entries = [entry]  # empezar nuevo paquete
-
-        if current_entries:
-            packets.append(SyncPacket(current_entries))
+            if not enc.try_add(entry):
+                yield SyncPacket(enc.entries, self.robot_id, enc.to_bytes(), enc.packet_id)
+                enc = SyncEncoder(self._next_packet_id(), self.robot_id, BINARY_MAX_BYTES)
+                enc.try_add(entry)
+        if enc.entries:
+            yield SyncPacket(enc.entries, self.robot_id, enc.to_bytes(), enc.packet_id)
 
-        return packets
-    
-    def prepare_packets_movs(self):
-        """
-        Lee registros pendientes de sincronización y los divide en paquetes ≤ max_bytes
-        Devuelve lista de SyncPacket, listos para serializar a JSON.
-        """
-        unsynced = self.db.get_unsynced_movimientos()  # lista de dicts por tabla
-        packets = []
+    def _iter_json(self, unsynced):
         current_entries = []
-
+        size = JSON_OVERHEAD
         for entry in unsynced:
             entry["data"]["robot_id"] = self.robot_id
+            entry_size = len(json.dumps(entry).encode('utf-8'))
+            sep = len(JSON_SEPARATOR) if current_entries else 0
+            if current_entries and size + sep + entry_size > self.max_bytes:
+                yield SyncPacket(current_entries, packet_id=self._next_packet_id())
+                current_entries = []
+                size = JSON_OVERHEAD
+                sep = 0
             current_entries.append(entry)
-            packet_size = len(json.dumps(current_entries).encode('utf-8'))
-            if packet_size > self.max_bytes:
-                current_entries.pop()  # quitar último registro
-                if current_entries:
-                    packets.append(SyncPacket(current_entries))
-                current_entries = [entry]  # empezar nuevo paquete
-
+            size += sep + entry_size
         if current_entries:
-            packets.append(SyncPacket(current_entries))
+            yield SyncPacket(current_entries, packet_id=self._next_packet_id())
 
-        return packets
-    
-    def prepare_packets_media(self):
+    def prepare_packets(self, unsynced) -> list:
+        return list(self.iter_packets(unsynced))
+
+    # ---------------------------
+    # Ventana de sincronización
+    # ---------------------------
+    def _pending_entries(self):
         """
-        Lee registros pendientes de sincronización y los divide en paquetes ≤ max_bytes
-        Devuelve lista de SyncPacket, listos para serializar a JSON.
+        Registros pendientes a partir del cursor de cada tabla (su marca de agua:
+        el último id ya metido en un paquete), leídos por páginas con el índice
+        de pendientes. Sensores, movimientos y media se alternan página a página
+        para compartir la ventana. Sólo se convierte a diccionario lo que llega
+        al empaquetador, así que el coste de cada ciclo depende de lo que se
+        envía y no de cuántos registros haya pendientes.
         """
-        unsynced = self.db.get_unsynced_media()  # lista de dicts por tabla
-        packets = []
-        current_entries = []
+        # Cada generador lleva su propio cursor de lectura: puede ir por delante
+        # de self.cursor mientras el empaquetador tiene registros a medio paquete
+        scans = {table: self.db.iter_unsynced(table, self.cursor.get(table, 0), page=self.batch)
+                 for table in SYNC_TABLES}
+        # Tras retroceder el cursor (_rewind) no se repite lo que ya va en vuelo
+        sent = self._in_flight_keys()
+        while scans:
+            for table in list(scans):
+                rows = list(itertools.islice(scans[table], self.batch))
+                if not rows:
+                    del scans[table]
+                for row in rows:
+                    if (table, row[0]) not in sent:
+                        yield self.db.to_entry(table, row)
 
-        for entry in unsynced:
-            entry["data"]["robot_id"] = self.robot_id
-            current_entries.append(entry)
-            packet_size = len(json.dumps(current_entries).encode('utf-8'))
-            if packet_size > self.max_bytes:
-                current_entries.pop()  # quitar último registro
-                if current_entries:
-                    packets.append(SyncPacket(current_entries))
-                current_entries = [entry]  # empezar nuevo paquete
+    def _in_flight_keys(self) -> set:
+        return {(e["table"], e["id"]) for f in self.in_flight.values() for e in f.packet.entries}
 
-        if current_entries:
-            packets.append(SyncPacket(current_entries))
+    def _rewind(self) -> bool:
+        """
+        Retrocede el cursor de cada tabla si quedan pendientes por detrás de él
+        que no van en ningún paquete en vuelo: ids reutilizados en una BBDD sin
+        AUTOINCREMENT, o registros que la EB no confirmó en su ACK. Se comprueba
+        con el índice de pendientes cuando ya no queda nada nuevo que enviar.
+        """
+        if not hasattr(self.db, "first_unsynced"):
+            return False
+        sent = self._in_flight_keys()
+        moved = False
+        for table, cursor in list(self.cursor.items()):
+            first = self.db.first_unsynced(table, cursor, [i for t, i in sent if t == table])
+            if first is not None:
+                print(f"Sincronización: pendientes de {table} desde el id {first}, por detrás del cursor ({cursor})")
+                self.cursor[table] = first - 1
+                moved = True
+        return moved
 
-        return packets
-    
-    def prepare_packets_all(self):
+    def _new_packet(self):
+        """Siguiente paquete nuevo, construido sobre la marcha desde el cursor."""
+        if self.stream is None:
+            self.stream = self.iter_packets(self._pending_entries())
+        pkt = next(self.stream, None)
+        if pkt is None:
+            self.stream = None
+            if not self._rewind():
+                return None
+            self.stream = self.iter_packets(self._pending_entries())
+            pkt = next(self.stream, None)
+            if pkt is None:
+                self.stream = None
+                return None
+        for entry in pkt.entries:
+            self.cursor[entry["table"]] = max(self.cursor.get(entry["table"], 0), entry["id"])
+        if hasattr(self.db, "save_packet"):
+            # Guardado antes de enviarlo: un reinicio no lo pierde ni lo duplica
+            next_id = next(self.packet_ids)
+            self.packet_ids = itertools.count(next_id)
+            self.db.save_packet(pkt.packet_id, [(e["table"], e["id"]) for e in pkt.entries],
+                                self.cursor, next_id & 0xFFFF)
+        return pkt
+
+    def poll(self) -> list:
         """
-        Lee registros pendientes de sincronización y los divide en paquetes ≤ max_bytes
-        Devuelve lista de SyncPacket, listos para serializar a JSON.
+        Paquetes a enviar ahora: retransmisiones vencidas y paquetes nuevos hasta
+        llenar la ventana. Se llama en bucle junto con wait().
         """
-        unsynced = self.db.get_unsynced_entries()  # lista de dicts por tabla
-        packets = []
-        current_entries = []
+        to_send = []
+        with self.cond:
+            now = time.monotonic()
+            for f in self.in_flight.values():
+                if f.deadline <= now:
+                    f.attempts += 1
+                    f.sent_at = now
+                    f.deadline = now + min(self.max_rto, self.rto * 2 ** (f.attempts - 1))
+                    self.retransmissions += 1
+                    to_send.append(f.packet)
+            while len(self.in_flight) < self.window:
+                pkt = self._new_packet()
+                if pkt is None:
+                    break
+                self.in_flight[pkt.packet_id] = InFlight(pkt, self.rto)
+                to_send.append(pkt)
+        return to_send
 
-        for entry in unsynced:
-            entry["data"]["robot_id"] = self.robot_id
-            current_entries.append(entry)
-            packet_size = len(json.dumps(current_entries).encode('utf-8'))
-            if packet_size > self.max_bytes:
-                current_entries.pop()  # quitar último registro
-                if current_entries:
-                    packets.append(SyncPacket(current_entries))
-                current_entries = [entry]  # empezar nuevo paquete
+    def next_timeout(self, idle=20.0) -> float:
+        """Segundos hasta el próximo vencimiento o, sin nada en vuelo, 'idle'."""
+        with self.cond:
+            if not self.in_flight:
+                return idle
+            next_deadline = min(f.deadline for f in self.in_flight.values())
+            return min(idle, max(0.0, next_deadline - time.monotonic()))
 
-        if current_entries:
-            packets.append(SyncPacket(current_entries))
+    def wait(self, idle=20.0):
+        """Espera a un ACK, al próximo vencimiento o, sin nada en vuelo, hasta 'idle' segundos."""
+        with self.cond:
+            timeout = self.next_timeout(idle)
+            if timeout > 0:
+                self.cond.wait(timeout)
+
+    def window_stats(self) -> dict:
+        with self.cond:
+            return {
+                "in_flight": len(self.in_flight),
+                "window": self.window,
+                "acked": self.acked,
+                "last_ack": self.last_ack,
+                "retransmissions": self.retransmissions,
+                "cursor": dict(self.cursor),
+            }
 
-        return packets
+    # ---------------------------
+    # Preparar paquetes
+    # ---------------------------
+    def prepare_packets_sensors(self):
+        """Registros de sensores pendientes, divididos en paquetes ≤ max_bytes."""
+        return self.prepare_packets(self.db.get_unsynced_sensors())
+
+    def prepare_packets_movs(self):
+        """Registros de movimiento pendientes, divididos en paquetes ≤ max_bytes."""
+        return self.prepare_packets(self.db.get_unsynced_movimientos())
+
+    def prepare_packets_media(self):
+        """Registros de media pendientes, divididos en paquetes ≤ max_bytes."""
+        return self.prepare_packets(self.db.get_unsynced_media())
+
+    def prepare_packets_all(self):
+        """Registros pendientes de todas las tablas, divididos en paquetes ≤ max_bytes."""
+        return self.prepare_packets(self.db.get_unsynced_entries())
 
     # ---------------------------
     # Marcar registros como sincronizados
     # ---------------------------
-    def handle_ack(self, ack_json: str):
+    def handle_ack(self, ack_json):
         """
-        ack_json: string JSON recibido que contiene la lista de registros confirmados
-        Ejemplo:
-        '{"entries": [{"table": "sensores", "id": 1, "inserted_id": 10}, {"table": "media", "id": 3, "inserted_id": 5}]}'
+        ack_json: ACK binario por rangos (bytes, ver SyncCodec) o string JSON
+        con la lista de registros confirmados. Ejemplo JSON:
+        '{"packet_id": 12, "saved": [{"table": "sensores", "id": 1}, {"table": "media", "id": 3}]}'
+        Marca los registros confirmados con un UPDATE por tabla (por rangos si el ACK es binario).
+        Devuelve el packet_id confirmado (None si el ACK no es válido).
         """
-        print(f"Procesando ACK de sincronización de {ack_json}...")
         try:
-            data = json.loads(ack_json)
-            entries = data.get("saved", [])
-            if entries:
-                self.db.mark_as_synced(entries)
+            if is_binary_ack(ack_json):
+                ack = decode_ack(ack_json)
+                self.db.mark_ranges_synced(ack["ranges"], packet_id=ack.get("packet_id"))
+            else:
+                ack = json.loads(ack_json)
+                self.db.mark_as_synced(ack.get("saved", []), packet_id=ack.get("packet_id"))
+            self.last_ack = ack.get("packet_id")
+            print(f"ACK de sincronización del paquete {ack.get('packet_id')} procesado.")
+            with self.cond:
+                # El ACK libera su hueco en la ventana y despierta al bucle de envío
+                if self.in_flight.pop(ack.get("packet_id"), None) is not None:
+                    self.acked += 1
+                self.cond.notify_all()
+            return ack.get("packet_id")
         except Exception as e:
             print(f"Error procesando ACK: {e}")
+            return None
 
 # Ejemplo de uso:
 # sync = SyncManager(db)
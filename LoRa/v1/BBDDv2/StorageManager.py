@@ -0,0 +1,292 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from BBDDv2.db_SQLite import file_checksum
+
+try:
+    import cv2
+except ImportError:     # sin OpenCV las fotos no se reducen, sólo se desalojan
+    cv2 = None
+
+MB = 1024 * 1024
+
+# Presupuesto por defecto de cada categoría, en bytes
+DEFAULT_BUDGETS = {"photos": 500 * MB, "videos": 2000 * MB, "db": 200 * MB}
+# Orden en que se recupera espacio cuando falta en el disco: primero lo que más ocupa
+EVICTION_ORDER = ("videos", "photos", "db")
+# Registros que se conservan como mínimo al recortar la BBDD por presupuesto
+MIN_DB_ROWS = 1000
+# Segundos que un fichero recién escrito (add) no cuenta como huérfano: su
+# registro se inserta después de enviarlo por WiFi, y el envío puede tardar
+ORPHAN_GRACE = 3600
+
+
+class StorageManager:
+    """
+    Presupuesto de disco del robot por categoría: fotos, vídeos y BBDD.
+
+    Un hilo revisa el uso cada 'period' segundos (o cuando lo pide admit/add)
+    y, en cada categoría de media que pasa de su presupuesto, recupera espacio
+    de los ficheros más antiguos primero (por fecha de modificación), en este
+    orden de prioridad:
+
+      1. ficheros sin registro o ya sincronizados (el MediaReaper los borraría);
+         los registrados con add() no son huérfanos hasta que llega su registro
+         o pasan ORPHAN_GRACE segundos;
+      2. reducir los pendientes: fotos a mitad de resolución y JPEG de menor
+         calidad (cv2), vídeos recodificados a menor resolución y bitrate
+         (ffmpeg); cada fichero se reduce una sola vez y se actualiza su checksum;
+      3. desalojar los pendientes: se borra el fichero y su registro.
+
+    La BBDD (robot_data.db y su WAL) se recorta con la retención de
+    RobotDatabase, dejando menos registros.
+
+    Además se mantiene libre al menos 'min_free' en el sistema de ficheros,
+    recuperando espacio en el orden de EVICTION_ORDER. La ruta de escritura
+    no espera nunca a todo esto: admit() sólo compara contadores en memoria y
+    el espacio libre, avisa al hilo y rechaza la escritura si el disco está
+    lleno en lugar de bloquearse.
+    """
+    def __init__(self, db, dirs: dict, db_path=None, budgets=None, min_free=100 * MB, period=60.0):
+        """
+        db: RobotDatabase
+        dirs: {"photos": carpeta, "videos": carpeta} (las que existan en este robot)
+        budgets: bytes por categoría; lo que no se dé se toma de DEFAULT_BUDGETS
+        """
+        self.db = db
+        self.dirs = {cat: d for cat, d in dirs.items() if d}
+        self.db_path = db_path
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+        self.min_free = min_free
+        self.period = period
+        self.lock = threading.Lock()
+        self.usage = {cat: 0 for cat in self.budgets}
+        self.degraded = set()           # ficheros ya reducidos
+        self.fresh = {}                 # path -> instante de add(), aún sin registro en la BBDD
+        self.evicted = 0
+        self.reduced = 0
+        self.can_reduce = {"photos": cv2 is not None, "videos": shutil.which("ffmpeg") is not None}
+        self.event = threading.Event()
+        self.running = True
+        self._measure()
+        threading.Thread(target=self._enforce_loop, name="lora-storage", daemon=True).start()
+
+    # ---------------------------
+    # RUTA DE ESCRITURA
+    # ---------------------------
+    def admit(self, category: str, size_hint=0) -> bool:
+        """
+        ¿Se puede escribir ahora un fichero de 'category'? No bloquea: si pasa
+        del presupuesto se avisa al hilo, y sólo se rechaza con el disco lleno.
+        """
+        free = self._free()
+        with self.lock:
+            over = self.usage.get(category, 0) + size_hint > self.budgets.get(category, float("inf"))
+        if over or free < self.min_free + size_hint:
+            self.event.set()
+        return free >= size_hint + self.min_free // 2
+
+    def add(self, path, category: str):
+        """Registra un fichero recién escrito."""
+        try:
+            size = os.path.getsize(path)
+        except (OSError, TypeError):
+            return
+        with self.lock:
+            self.fresh[path] = time.monotonic()
+            self.usage[category] = self.usage.get(category, 0) + size
+            over = self.usage[category] > self.budgets.get(category, float("inf"))
+        if over:
+            self.event.set()
+
+    # ---------------------------
+    # USO
+    # ---------------------------
+    def _free(self) -> int:
+        path = self.db_path or next(iter(self.dirs.values()), ".")
+        try:
+            return shutil.disk_usage(os.path.dirname(os.path.abspath(path))).free
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _files(directory) -> list:
+        """[(mtime, size, path)] de la carpeta, del más antiguo al más reciente."""
+        files = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file():
+                        st = entry.stat()
+                        files.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass
+        files.sort()
+        return files
+
+    def _db_size(self) -> int:
+        if not self.db_path:
+            return 0
+        return sum(os.path.getsize(p) for p in (self.db_path, self.db_path + "-wal") if os.path.exists(p))
+
+    def _measure(self) -> dict:
+        """Recalcula el uso desde el disco (los ficheros que borra el MediaReaper incluidos)."""
+        usage = {cat: sum(size for _, size, _ in self._files(d)) for cat, d in self.dirs.items()}
+        usage["db"] = self._db_size()
+        with self.lock:
+            self.usage.update(usage)
+        return usage
+
+    def summary(self) -> str:
+        """Uso en MB para el comando de estado: 'photos 12/500MB videos 340/2000MB db 3/200MB free 5120MB'"""
+        with self.lock:
+            usage = dict(self.usage)
+        parts = [f"{cat} {usage.get(cat, 0) // MB}/{self.budgets[cat] // MB}MB"
+                 for cat in ("photos", "videos", "db") if cat in self.dirs or cat == "db"]
+        parts.append(f"free {self._free() // MB}MB")
+        return " ".join(parts)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"usage": dict(self.usage), "budgets": dict(self.budgets),
+                    "evicted": self.evicted, "reduced": self.reduced, "free": self._free()}
+
+    # ---------------------------
+    # APLICACIÓN DEL PRESUPUESTO
+    # ---------------------------
+    def _enforce_loop(self):
+        while self.running:
+            self.event.wait(self.period)
+            self.event.clear()
+            if not self.running:
+                break
+            try:
+                self.enforce()
+            except Exception as e:
+                print(f"[{time.strftime('%H:%M:%S')}] Error aplicando el presupuesto de disco: {e}")
+
+    def enforce(self):
+        usage = self._measure()
+        for cat in EVICTION_ORDER:
+            excess = usage.get(cat, 0) - self.budgets[cat]
+            short = self.min_free - self._free()
+            if excess > 0 or short > 0:
+                self._reclaim(cat, max(excess, short))
+        self._measure()
+
+    def _reclaim(self, category, needed) -> int:
+        if category == "db":
+            return self._trim_db(needed)
+        if category not in self.dirs:
+            return 0
+        files = self._files(self.dirs[category])
+        records = self.db.media_files(es_video=(category == "videos"))
+        protected = self._protected(records)
+        freed = 0
+        # 1. Sin registro o ya sincronizados
+        for _, size, path in files:
+            if freed >= needed:
+                return freed
+            record = records.get(path)
+            if (record is None and path not in protected) or (record is not None and record[1]):
+                freed += self._remove(path, record)
+        # 2. Reducir los pendientes más antiguos
+        for _, size, path in files:
+            if freed >= needed or not self.can_reduce[category]:
+                break
+            if path in records and os.path.exists(path) and path not in self.degraded:
+                freed += self._reduce(path, records[path][0], category)
+        # 3. Desalojar los pendientes más antiguos
+        for _, size, path in files:
+            if freed >= needed:
+                return freed
+            if path in records and os.path.exists(path):
+                freed += self._remove(path, records[path])
+        return freed
+
+    def _protected(self, records) -> set:
+        """Ficheros de add() cuyo registro aún no está en la BBDD (y dentro del plazo)."""
+        now = time.monotonic()
+        with self.lock:
+            for path in [p for p, t in self.fresh.items() if p in records or now - t > ORPHAN_GRACE]:
+                del self.fresh[path]
+            return set(self.fresh)
+
+    def _remove(self, path, record) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        if record is not None:
+            self.db.forget_media([record[0]])
+            if not record[1]:
+                print(f"[{time.strftime('%H:%M:%S')}] Presupuesto de disco: desalojado {path} sin sincronizar")
+        self.degraded.discard(path)
+        self.evicted += 1
+        return size
+
+    def _reduce(self, path, record_id, category) -> int:
+        """Reduce el fichero en su sitio. Devuelve los bytes ahorrados."""
+        before = os.path.getsize(path)
+        tmp = path + ".tmp" + os.path.splitext(path)[1]
+        try:
+            ok = self._reduce_photo(path, tmp) if category == "photos" else self._reduce_video(path, tmp)
+            if not ok or os.path.getsize(tmp) >= before:
+                return 0
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"[{time.strftime('%H:%M:%S')}] No se pudo reducir {path}: {e}")
+            return 0
+        finally:
+            self.degraded.add(path)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.db.update_media_checksum(record_id, file_checksum(path))
+        self.reduced += 1
+        return before - os.path.getsize(path)
+
+    @staticmethod
+    def _reduce_photo(path, tmp) -> bool:
+        img = cv2.imread(path)
+        if img is None:
+            return False
+        h, w = img.shape[:2]
+        if max(h, w) > 320:
+            img = cv2.resize(img, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+        return cv2.imwrite(tmp, img, [cv2.IMWRITE_JPEG_QUALITY, 60])
+
+    @staticmethod
+    def _reduce_video(path, tmp) -> bool:
+        result = subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", "-i", path, "-vf", "scale=trunc(iw/4)*2:-2",
+             "-c:v", "libx264", "-preset", "veryfast", "-crf", "32", "-an", tmp],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=300)
+        return result.returncode == 0
+
+    def _trim_db(self, needed) -> int:
+        size = self._db_size()
+        # Primero las páginas libres: una BBDD migrada sin auto_vacuum incremental
+        # no encoge al borrar, y recortar registros no serviría de nada
+        if self.db.free_bytes():
+            self.db.vacuum()
+            freed = size - self._db_size()
+            if freed >= needed:
+                return freed
+            needed -= freed
+            size = self._db_size()
+        counts = self.db.row_counts()
+        rows = max(counts.values(), default=0)
+        if not size or rows <= MIN_DB_ROWS:
+            return 0
+        # Registros a conservar en proporción a los bytes que hay que liberar
+        keep = max(MIN_DB_ROWS, int(rows * max(0.0, 1 - needed / size) * 0.9))
+        self.db.apply_retention(max_rows=keep)
+        return max(0, size - self._db_size())
+
+    def stop(self):
+        self.running = False
+        self.event.set()
@@ -0,0 +1,250 @@
+"""
+Codec binario de paquetes de sincronización (versión 1).
+
+Cabecera (9 bytes):
+    versión (1) | packet_id (2) | robot_id (2) | timestamp base, epoch en s (4)
+Registros, uno tras otro:
+    tabla (1) | id (varint zigzag, delta respecto al id anterior de la misma tabla)
+    | timestamp (varint zigzag, segundos respecto al timestamp base) | campos
+Campos por tabla:
+    sensores          temp int16 (x100), hum uint16 (x100)
+    robot_movimiento  L int16 (x1000), R int16 (x1000)
+    media             flags (1: bit0 es_video, bit1 checksum) | nombre (varint len + utf-8)
+                      | checksum sha256 (32, si bit1)
+
+ACK binario (msg 0/21):
+    ACK_VERSION (1) | packet_id (2) | por tabla: tabla (1) | nº de rangos (varint)
+    | rangos: inicio (varint, delta respecto al final del rango anterior) | longitud - 1 (varint)
+"""
+
+import os
+import struct
+from datetime import datetime
+
+VERSION = 1
+HEADER = struct.Struct(">BHHI")
+ACK_VERSION = 0x81
+ACK_HEADER = struct.Struct(">BH")
+
+TABLE_TAGS = {"sensores": 1, "robot_movimiento": 2, "media": 3}
+TAG_TABLES = {v: k for k, v in TABLE_TAGS.items()}
+
+SENSOR_FIELDS = struct.Struct(">hH")
+MOV_FIELDS = struct.Struct(">hh")
+
+
+# ---------------------------
+# VARINTS
+# ---------------------------
+def write_varint(buf: bytearray, value: int):
+    """Varint sin signo (LEB128)."""
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def read_varint(data, pos: int) -> tuple:
+    value = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return value, pos
+        shift += 7
+
+
+def zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def unzigzag(n: int) -> int:
+    return (n >> 1) ^ -(n & 1)
+
+
+def _clamp(value, lo, hi):
+    return max(lo, min(hi, value))
+
+
+def _epoch(ts) -> int:
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    return int(ts.timestamp())
+
+
+# ---------------------------
+# CODIFICADOR
+# ---------------------------
+class SyncEncoder:
+    """
+    Construye un paquete binario registro a registro, llevando la cuenta del
+    tamaño para no pasar de max_bytes. El timestamp base es el del primer
+    registro añadido.
+    """
+    def __init__(self, packet_id: int, robot_id: int, max_bytes: int):
+        self.packet_id = packet_id & 0xFFFF
+        self.robot_id = robot_id & 0xFFFF
+        self.max_bytes = max_bytes
+        self.base_ts = None
+        self.last_ids = {}
+        self.body = bytearray()
+        self.entries = []
+
+    def encode_entry(self, entry: dict) -> bytes:
+        table = entry["table"]
+        data = entry["data"]
+        ts = _epoch(data["timestamp"])
+        base_ts = ts if self.base_ts is None else self.base_ts
+        rec = bytearray([TABLE_TAGS[table]])
+        write_varint(rec, zigzag(entry["id"] - self.last_ids.get(table, 0)))
+        write_varint(rec, zigzag(ts - base_ts))
+        if table == "sensores":
+            rec += SENSOR_FIELDS.pack(_clamp(round(data["temp"] * 100), -32768, 32767),
+                                      _clamp(round(data["hum"] * 100), 0, 65535))
+        elif table == "robot_movimiento":
+            rec += MOV_FIELDS.pack(_clamp(round(data["L"] * 1000), -32768, 32767),
+                                   _clamp(round(data["R"] * 1000), -32768, 32767))
+        else:
+            checksum = data.get("checksum")
+            name = os.path.basename(data.get("path") or "").encode("utf-8")[:64]
+            rec.append((1 if data.get("es_video") else 0) | (2 if checksum else 0))
+            write_varint(rec, len(name))
+            rec += name
+            if checksum:
+                rec += bytes.fromhex(checksum)
+        return bytes(rec)
+
+    def try_add(self, entry: dict) -> bool:
+        """Añade el registro si cabe. Devuelve False (sin añadirlo) si no cabe."""
+        rec = self.encode_entry(entry)
+        if HEADER.size + len(self.body) + len(rec) > self.max_bytes and self.entries:
+            return False
+        if self.base_ts is None:
+            self.base_ts = _epoch(entry["data"]["timestamp"])
+        self.last_ids[entry["table"]] = entry["id"]
+        self.body += rec
+        self.entries.append(entry)
+        return True
+
+    def size(self) -> int:
+        return HEADER.size + len(self.body)
+
+    def to_bytes(self) -> bytes:
+        return HEADER.pack(VERSION, self.packet_id, self.robot_id, self.base_ts or 0) + self.body
+
+
+def encode_packet(packet_id: int, robot_id: int, entries: list) -> bytes:
+    enc = SyncEncoder(packet_id, robot_id, max_bytes=1 << 30)
+    for entry in entries:
+        enc.try_add(entry)
+    return enc.to_bytes()
+
+
+# ---------------------------
+# DECODIFICADOR
+# ---------------------------
+def is_binary_packet(payload) -> bool:
+    return isinstance(payload, (bytes, bytearray, memoryview)) and len(payload) >= HEADER.size and payload[0] == VERSION
+
+
+def decode_packet(payload) -> dict:
+    """
+    Decodifica un paquete binario al mismo formato que el JSON:
+    {"packet_id": ..., "entries": [{"table", "id", "data": {...}}]}
+    """
+    version, packet_id, robot_id, base_ts = HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError(f"Versión de paquete de sincronización no soportada: {version}")
+    entries = []
+    last_ids = {}
+    pos = HEADER.size
+    while pos < len(payload):
+        table = TAG_TABLES[payload[pos]]
+        pos += 1
+        delta, pos = read_varint(payload, pos)
+        record_id = last_ids.get(table, 0) + unzigzag(delta)
+        last_ids[table] = record_id
+        dts, pos = read_varint(payload, pos)
+        data = {
+            "timestamp": datetime.fromtimestamp(base_ts + unzigzag(dts)).isoformat(),
+            "robot_id": robot_id,
+        }
+        if table == "sensores":
+            temp, hum = SENSOR_FIELDS.unpack_from(payload, pos)
+            pos += SENSOR_FIELDS.size
+            data["temp"] = temp / 100
+            data["hum"] = hum / 100
+        elif table == "robot_movimiento":
+            L, R = MOV_FIELDS.unpack_from(payload, pos)
+            pos += MOV_FIELDS.size
+            data["L"] = L / 1000
+            data["R"] = R / 1000
+        else:
+            flags = payload[pos]
+            pos += 1
+            name_len, pos = read_varint(payload, pos)
+            data["path"] = bytes(payload[pos:pos + name_len]).decode("utf-8", errors="ignore")
+            pos += name_len
+            data["es_video"] = bool(flags & 1)
+            data["checksum"] = None
+            if flags & 2:
+                data["checksum"] = bytes(payload[pos:pos + 32]).hex()
+                pos += 32
+        entries.append({"table": table, "id": record_id, "data": data})
+    return {"packet_id": packet_id, "entries": entries}
+
+
+# ---------------------------
+# ACK POR RANGOS
+# ---------------------------
+def id_ranges(ids) -> list:
+    """Convierte ids en una lista ordenada de rangos [(inicio, fin)] inclusivos."""
+    ranges = []
+    for i in sorted(set(ids)):
+        if ranges and i == ranges[-1][1] + 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return [tuple(r) for r in ranges]
+
+
+def encode_ack(packet_id: int, saved: list) -> bytes:
+    """saved: lista de {"table", "id"} guardados. Devuelve el ACK binario por rangos."""
+    by_table = {}
+    for e in saved:
+        by_table.setdefault(e["table"], []).append(e["id"])
+    buf = bytearray(ACK_HEADER.pack(ACK_VERSION, packet_id & 0xFFFF))
+    for table, ids in by_table.items():
+        ranges = id_ranges(ids)
+        buf.append(TABLE_TAGS[table])
+        write_varint(buf, len(ranges))
+        prev_end = 0
+        for start, end in ranges:
+            write_varint(buf, start - prev_end)
+            write_varint(buf, end - start)
+            prev_end = end
+    return bytes(buf)
+
+
+def is_binary_ack(payload) -> bool:
+    return isinstance(payload, (bytes, bytearray, memoryview)) and len(payload) >= ACK_HEADER.size and payload[0] == ACK_VERSION
+
+
+def decode_ack(payload) -> dict:
+    """Devuelve {"packet_id": ..., "ranges": {tabla: [(inicio, fin), ...]}}."""
+    _, packet_id = ACK_HEADER.unpack_from(payload)
+    ranges = {}
+    pos = ACK_HEADER.size
+    while pos < len(payload):
+        table = TAG_TABLES[payload[pos]]
+        n, pos = read_varint(payload, pos + 1)
+        prev_end = 0
+        table_ranges = ranges.setdefault(table, [])
+        for _ in range(n):
+            delta, pos = read_varint(payload, pos)
+            length, pos = read_varint(payload, pos)
+            start = prev_end + delta
+            prev_end = start + length
+            table_ranges.append((start, prev_end))
+    return {"packet_id": packet_id, "ranges": ranges}
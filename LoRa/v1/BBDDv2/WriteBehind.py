@@ -0,0 +1,143 @@
+import atexit
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class WriteBehind:
+    """
+    Escritura diferida de las inserciones de RobotDatabase.
+
+    insert() deja la fila en una cola en memoria y vuelve enseguida con un
+    Future que se completa con su id. Un único hilo escritor vacía la cola en
+    transacciones por lotes (un executemany por tabla): escribe cuando la fila
+    más antigua lleva 'max_latency' segundos esperando o cuando se juntan
+    'max_batch' filas, lo que antes ocurra. Así cada commit (un fsync en la SD
+    de la Raspberry) cubre muchas filas y quien inserta no lo espera.
+
+    prepare(table, row): si se da, se llama en el hilo escritor justo antes de
+    escribir cada fila (p. ej. para calcular el checksum de un fichero).
+
+    close() deja de aceptar filas, escribe las pendientes y espera al hilo; se
+    registra también con atexit para no perder la cola si no se llama.
+    """
+    def __init__(self, engine, max_latency=0.5, max_batch=256, max_queue=10000, prepare=None):
+        self.engine = engine
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.prepare = prepare
+        self.cond = threading.Condition()
+        self.queue = deque()            # (tabla, fila, Future, instante de entrada)
+        self.busy = False               # hay un lote escribiéndose
+        self.running = True
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # ---------------------------
+    # API
+    # ---------------------------
+    def insert(self, table, row: dict) -> Future:
+        """Encola una fila para 'table' (sqlalchemy.Table); el Future da su id."""
+        future = Future()
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("WriteBehind cerrado")
+            # Cola llena: se espera a que el escritor libere sitio
+            while len(self.queue) >= self.max_queue and self.running:
+                self.cond.wait(self.max_latency)
+            self.queue.append((table, row, future, time.monotonic()))
+            if len(self.queue) == 1 or len(self.queue) >= self.max_batch:
+                self.cond.notify_all()
+        return future
+
+    def flush(self, timeout=None) -> bool:
+        """Espera a que se escriba todo lo encolado hasta ahora. False si vence el plazo."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            self.cond.notify_all()
+            while self.queue or self.busy:
+                wait = None if deadline is None else deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    return False
+                self.cond.wait(wait)
+        return True
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "queued": len(self.queue),
+                "batches": self.batches,
+                "rows": self.rows,
+                "errors": self.errors,
+            }
+
+    def close(self, timeout=10.0):
+        with self.cond:
+            if not self.running:
+                return
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    # ---------------------------
+    # ESCRITOR
+    # ---------------------------
+    def _writer_loop(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                # Se espera a completar el lote o a que venza la fila más antigua
+                while self.running and len(self.queue) < self.max_batch:
+                    wait = self.queue[0][3] + self.max_latency - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                if not self.queue:
+                    return              # cerrado y sin nada pendiente
+                batch = [self.queue.popleft() for _ in range(min(self.max_batch, len(self.queue)))]
+                self.busy = True
+                self.cond.notify_all()  # hay sitio en la cola
+            try:
+                self._write(batch)
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+
+    def _write(self, batch):
+        # Filas agrupadas por tabla, en el orden en que llegaron
+        groups = {}
+        for table, row, future, _ in batch:
+            groups.setdefault(table, []).append((row, future))
+        try:
+            if self.prepare is not None:
+                for table, items in groups.items():
+                    for row, _ in items:
+                        self.prepare(table, row)
+            ids = {}
+            with self.engine.begin() as conn:
+                for table, items in groups.items():
+                    conn.execute(table.insert(), [row for row, _ in items])
+                    # Con un único escritor los rowid del lote son consecutivos
+                    last = conn.exec_driver_sql("SELECT last_insert_rowid()").scalar()
+                    ids[table] = range(last - len(items) + 1, last + 1)
+        except Exception as e:
+            with self.cond:
+                self.errors += 1
+            print(f"[{time.strftime('%H:%M:%S')}] Error escribiendo lote de {len(batch)} filas: {e}")
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+        with self.cond:
+            self.batches += 1
+            self.rows += len(batch)
+        for table, items in groups.items():
+            for (_, future), row_id in zip(items, ids[table]):
+                future.set_result(row_id)
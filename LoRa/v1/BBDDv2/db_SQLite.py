@@ -1,10 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, Boolean
+from sqlalchemy import create_engine, event, func, inspect, select, update, delete, or_, text, Column, Index, Integer, Float, String, DateTime, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, timedelta
+from itertools import islice
 import hashlib
+import json
 import os
 
+from BBDDv2.MediaReaper import MediaReaper
+from BBDDv2.WriteBehind import WriteBehind
+
 Base = declarative_base()
 
 
@@ -21,6 +26,13 @@ class SensorData(Base):
     hum = Column(Float, nullable=False)
     sinc = Column(Boolean, default=False)
 
+    # Pendientes de sincronizar en orden de id sin recorrer la tabla. Índice
+    # parcial: al marcar un registro como sincronizado sólo se borra su entrada.
+    # AUTOINCREMENT: los ids no se reutilizan al borrar los ya sincronizados, así
+    # que el cursor de NodeSyncManager sólo avanza
+    __table_args__ = (Index("ix_sensores_unsinc", "id", sqlite_where=text("sinc = 0")),
+                      {"sqlite_autoincrement": True})
+
 
 class RobotMovimiento(Base):
     __tablename__ = "robot_movimiento"
@@ -31,6 +43,9 @@ class RobotMovimiento(Base):
     R = Column(Float, nullable=False)
     sinc = Column(Boolean, default=False)
 
+    __table_args__ = (Index("ix_robot_movimiento_unsinc", "id", sqlite_where=text("sinc = 0")),
+                      {"sqlite_autoincrement": True})
+
 
 class Media(Base):
     __tablename__ = "media"
@@ -42,14 +57,98 @@ class Media(Base):
     checksum = Column(String, nullable=True)
     sinc = Column(Boolean, default=False)
 
+    __table_args__ = (Index("ix_media_unsinc", "id", sqlite_where=text("sinc = 0")),
+                      {"sqlite_autoincrement": True})
+
     def generar_checksum(self):
         """Calcula SHA256 del archivo"""
-        try:
-            with open(self.path, "rb") as f:
-                data = f.read()
-                self.checksum = hashlib.sha256(data).hexdigest()
-        except Exception:
-            self.checksum = None
+        self.checksum = file_checksum(self.path)
+
+
+class SyncState(Base):
+    """Estado de la sincronización LoRa que sobrevive a un reinicio (valores en JSON)"""
+    __tablename__ = "sync_state"
+
+    key = Column(String, primary_key=True)      # cursor, next_packet_id, last_ack
+    value = Column(String, nullable=False)
+
+
+class SyncInFlight(Base):
+    """Paquete de sincronización enviado y aún sin ACK"""
+    __tablename__ = "sync_inflight"
+
+    packet_id = Column(Integer, primary_key=True)
+    entries = Column(String, nullable=False)    # JSON [[tabla, id], ...]
+    sent_at = Column(DateTime, default=datetime.now)
+
+
+# ---------------------------
+# ESQUEMA Y MIGRACIONES
+# ---------------------------
+# La versión se guarda en PRAGMA user_version. Una BBDD sin versión pero con
+# tablas es de antes de versionar el esquema (versión 1: sólo las tres tablas
+# de datos). Cada migración lleva de la versión anterior a la suya.
+
+SCHEMA_VERSION = 4
+
+
+def _migrate_v2(conn):
+    """Índices parciales de registros pendientes de sincronizar"""
+    for table in ("sensores", "robot_movimiento", "media"):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_{table}_sinc_id")
+    for model in (SensorData, RobotMovimiento, Media):
+        for index in model.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _migrate_v3(conn):
+    """Estado de la sincronización persistente"""
+    Base.metadata.create_all(conn, tables=[SyncState.__table__, SyncInFlight.__table__])
+
+
+def _migrate_v4(conn):
+    """Tablas de datos con AUTOINCREMENT (los ids no se reutilizan)"""
+    row = conn.exec_driver_sql("SELECT value FROM sync_state WHERE key = 'cursor'").scalar()
+    cursor = json.loads(row) if row else {}
+    for model in (SensorData, RobotMovimiento, Media):
+        t = model.__table__
+        old = f"_{t.name}_v3"
+        for index in t.indexes:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+        conn.exec_driver_sql(f"ALTER TABLE {t.name} RENAME TO {old}")
+        t.create(conn)
+        cols = ", ".join(f'"{c.name}"' for c in t.columns)
+        conn.exec_driver_sql(f"INSERT INTO {t.name} ({cols}) SELECT {cols} FROM {old}")
+        conn.exec_driver_sql(f"DROP TABLE {old}")
+        # Los ids nuevos empiezan por encima del cursor guardado: lo que ya se
+        # envió con ids después borrados no se vuelve a asignar
+        top = max(int(cursor.get(t.name, 0)),
+                  conn.exec_driver_sql(f"SELECT coalesce(max(id), 0) FROM {t.name}").scalar())
+        conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = ?", (t.name,))
+        conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (t.name, top))
+
+
+MIGRATIONS = {2: _migrate_v2, 3: _migrate_v3, 4: _migrate_v4}
+
+
+# Ids o rangos por sentencia: por debajo del límite de parámetros de SQLite (999 en versiones antiguas)
+MAX_SQL_PARAMS = 900
+
+# Campos que viajan en la sincronización, en el orden de las tuplas de iter_unsynced
+SYNC_COLUMNS = {
+    "sensores": ("temp", "hum"),
+    "robot_movimiento": ("L", "R"),
+    "media": ("es_video", "path", "checksum"),
+}
+
+
+def file_checksum(path):
+    """SHA256 del archivo en hexadecimal (None si no se puede leer)"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except Exception:
+        return None
 
 
 # ---------------------------
@@ -57,11 +156,70 @@ class Media(Base):
 # ---------------------------
 
 class RobotDatabase:
-    def __init__(self, db_path="robot.db"):
+    def __init__(self, db_path="robot.db", write_behind=False, max_latency=0.5, max_batch=256, max_rows=200000):
+        """
+        La BBDD es persistente: si ya existe se abre y se migra a SCHEMA_VERSION.
+
+        write_behind: las inserciones se encolan y un hilo las escribe por lotes
+                      (WriteBehind); insert_* devuelve entonces un Future con el ID.
+                      La BBDD pasa a modo WAL con synchronous=NORMAL.
+        max_latency, max_batch: cuándo se escribe un lote (lo que antes ocurra)
+        max_rows: registros como máximo en sensores y en robot_movimiento; al
+                  limpiar se descartan los más antiguos que sobren (apply_retention)
+        """
         os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.max_rows = max_rows
         self.engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
-        Base.metadata.create_all(self.engine)
+        event.listen(self.engine, "connect", self._set_pragmas if write_behind else self._set_auto_vacuum)
+        self.schema_version = self._upgrade_schema()
         self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehind(self.engine, max_latency=max_latency, max_batch=max_batch,
+                                      prepare=self._prepare_row)
+        # Ficheros de la media sincronizada: se borran en segundo plano, por tandas
+        self.reaper = MediaReaper(self._synced_media, self._forget_media)
+
+    def _upgrade_schema(self) -> int:
+        """Crea el esquema o aplica las migraciones pendientes. Devuelve la versión de partida."""
+        with self.engine.begin() as conn:
+            version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+            if not inspect(conn).has_table("sensores"):
+                Base.metadata.create_all(conn)
+                start = SCHEMA_VERSION
+            else:
+                start = version or 1
+                if start > SCHEMA_VERSION:
+                    raise RuntimeError(f"BBDD con esquema {start}, más nuevo que el soportado ({SCHEMA_VERSION})")
+                for v in range(start + 1, SCHEMA_VERSION + 1):
+                    print(f"Migrando BBDD SQLite a la versión {v}: {MIGRATIONS[v].__doc__}")
+                    MIGRATIONS[v](conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return start
+
+    @staticmethod
+    def _set_auto_vacuum(dbapi_conn, _record):
+        # Sólo tiene efecto en una BBDD aún vacía: el espacio que libera la
+        # retención se puede devolver al disco con incremental_vacuum
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cur.close()
+
+    @classmethod
+    def _set_pragmas(cls, dbapi_conn, record):
+        # WAL: las lecturas no bloquean al escritor y cada commit no reescribe la BBDD;
+        # con NORMAL sólo se hace fsync en los checkpoints
+        cls._set_auto_vacuum(dbapi_conn, record)
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.close()
+
+    @staticmethod
+    def _prepare_row(table, row):
+        # El checksum de la media se calcula en el hilo escritor, no en el que inserta
+        if table is Media.__table__ and row.pop("generar_checksum", False):
+            row["checksum"] = file_checksum(row["path"])
 
     # ---------------------------
     # SESIÓN
@@ -69,11 +227,25 @@ class RobotDatabase:
     def new_session(self):
         return self.Session()
 
+    def flush(self, timeout=None) -> bool:
+        """Espera a que se escriban las inserciones encoladas (modo write_behind)."""
+        return self.writer.flush(timeout) if self.writer is not None else True
+
+    def close(self):
+        """Escribe lo pendiente y libera las conexiones."""
+        if self.writer is not None:
+            self.writer.close()
+        self.reaper.stop()
+        self.engine.dispose()
+
     # ---------------------------
     # INSERTAR DATOS
     # ---------------------------
     def insert_sensor(self, temp, hum, timestamp=None) -> int:
-        """Inserta una lectura de sensor y devuelve su ID"""
+        """Inserta una lectura de sensor y devuelve su ID (un Future con él si write_behind)"""
+        if self.writer is not None:
+            return self.writer.insert(SensorData.__table__, {
+                "temp": temp, "hum": hum, "timestamp": timestamp or datetime.now(), "sinc": False})
         s = self.new_session()
         lectura = SensorData(temp=temp, hum=hum, timestamp=timestamp or datetime.now())
         s.add(lectura)
@@ -82,7 +254,10 @@ class RobotDatabase:
         return lectura.id
 
     def insert_movimiento(self, L, R, timestamp=None) -> int:
-        """Inserta un registro de movimiento y devuelve su ID"""
+        """Inserta un registro de movimiento y devuelve su ID (un Future con él si write_behind)"""
+        if self.writer is not None:
+            return self.writer.insert(RobotMovimiento.__table__, {
+                "L": L, "R": R, "timestamp": timestamp or datetime.now(), "sinc": False})
         s = self.new_session()
         mov = RobotMovimiento(L=L, R=R, timestamp=timestamp or datetime.now())
         s.add(mov)
@@ -91,7 +266,11 @@ class RobotDatabase:
         return mov.id
 
     def insert_media(self, path, es_video=False, generar_checksum=True, sinc=False, timestamp=None) -> int:
-        """Inserta un registro de media y devuelve su ID"""
+        """Inserta un registro de media y devuelve su ID (un Future con él si write_behind)"""
+        if self.writer is not None:
+            return self.writer.insert(Media.__table__, {
+                "path": path, "es_video": es_video, "sinc": sinc, "checksum": None,
+                "timestamp": timestamp or datetime.now(), "generar_checksum": generar_checksum})
         s = self.new_session()
         media = Media(path=path, es_video=es_video, sinc=sinc, timestamp=timestamp or datetime.now())
         if generar_checksum:
@@ -258,74 +437,79 @@ class RobotDatabase:
     # FUNCIONES GET UNSYNC
     # ---------------------------
 
-    def get_unsynced_sensors(self, limit=None) -> list:
+    def iter_unsynced(self, table: str, after_id=0, page=256):
+        """
+        Generador de los registros de 'table' pendientes de sincronizar con id
+        posterior a after_id, en orden de id. Cada registro es una tupla
+        (id, timestamp, *SYNC_COLUMNS[table]). Se lee por páginas de 'page'
+        filas con el índice parcial de pendientes, cada una en su propia conexión, así que
+        sólo se consulta lo que realmente se consume.
+        """
+        t = Base.metadata.tables[table]
+        query = select(t.c.id, t.c.timestamp, *(t.c[name] for name in SYNC_COLUMNS[table]))\
+            .where(t.c.sinc == False).order_by(t.c.id).limit(page)
+        while True:
+            with self.engine.connect() as conn:
+                rows = conn.execute(query.where(t.c.id > after_id)).all()
+            yield from rows
+            if len(rows) < page:
+                return
+            after_id = rows[-1][0]
+
+    @staticmethod
+    def to_entry(table: str, row) -> dict:
+        """Tupla de iter_unsynced -> registro {"table", "id", "data"} para el empaquetador."""
+        data = {"timestamp": row[1].isoformat()}
+        data.update(zip(SYNC_COLUMNS[table], row[2:]))
+        return {"table": table, "id": row[0], "data": data}
+
+    def first_unsynced(self, table: str, upto: int, exclude=()):
+        """
+        Menor id pendiente de 'table' que no pase de 'upto' y no esté en
+        'exclude' (p. ej. los que ya van en un paquete en vuelo), o None.
+        """
+        t = Base.metadata.tables[table]
+        query = select(func.min(t.c.id)).where(t.c.sinc == False, t.c.id <= upto)
+        exclude = list(exclude)[:MAX_SQL_PARAMS]
+        if exclude:
+            query = query.where(t.c.id.not_in(exclude))
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar()
+
+    def get_unsynced(self, table: str, limit=None, after_id=None) -> list:
+        """Registros de 'table' pendientes de sincronizar (a partir de after_id si se da)"""
+        rows = self.iter_unsynced(table, after_id or 0, page=min(limit or 256, 256))
+        return [self.to_entry(table, r) for r in islice(rows, limit)]
+
+    def get_entries(self, table: str, ids) -> list:
+        """Registros de 'table' con esos ids que siguen pendientes, en orden de id"""
+        t = Base.metadata.tables[table]
+        ids = list(ids)
+        rows = []
+        with self.engine.connect() as conn:
+            for i in range(0, len(ids), MAX_SQL_PARAMS):
+                query = select(t.c.id, t.c.timestamp, *(t.c[name] for name in SYNC_COLUMNS[table]))\
+                    .where(t.c.sinc == False, t.c.id.in_(ids[i:i + MAX_SQL_PARAMS]))
+                rows += conn.execute(query).all()
+        return [self.to_entry(table, r) for r in sorted(rows, key=lambda r: r[0])]
+
+    def get_unsynced_sensors(self, limit=None, after_id=None) -> list:
         """Devuelve registros de sensores pendientes de sincronizar"""
-        s = self.new_session()
-        query = s.query(SensorData).filter_by(sinc=False).order_by(SensorData.timestamp.asc())
-        if limit:
-            query = query.limit(limit)
-        results = query.all()
-        s.close()
-        return [
-            {
-                "table": "sensores",
-                "id": d.id,
-                "data": {
-                    "timestamp": d.timestamp.isoformat(),
-                    "temp": d.temp,
-                    "hum": d.hum
-                }
-            } for d in results
-        ]
-
+        return self.get_unsynced("sensores", limit, after_id)
 
-    def get_unsynced_movimientos(self, limit=None) -> list:
+    def get_unsynced_movimientos(self, limit=None, after_id=None) -> list:
         """Devuelve registros de movimientos pendientes de sincronizar"""
-        s = self.new_session()
-        query = s.query(RobotMovimiento).filter_by(sinc=False).order_by(RobotMovimiento.timestamp.asc())
-        if limit:
-            query = query.limit(limit)
-        results = query.all()
-        s.close()
-        return [
-            {
-                "table": "robot_movimiento",
-                "id": d.id,
-                "data": {
-                    "timestamp": d.timestamp.isoformat(),
-                    "L": d.L,
-                    "R": d.R
-                }
-            } for d in results
-        ]
+        return self.get_unsynced("robot_movimiento", limit, after_id)
 
-
-    def get_unsynced_media(self, limit=None) -> list:
+    def get_unsynced_media(self, limit=None, after_id=None) -> list:
         """Devuelve registros de multimedia pendientes de sincronizar"""
-        s = self.new_session()
-        query = s.query(Media).filter_by(sinc=False).order_by(Media.timestamp.asc())
-        if limit:
-            query = query.limit(limit)
-        results = query.all()
-        s.close()
-        return [
-            {
-                "table": "media",
-                "id": d.id,
-                "data": {
-                    "timestamp": d.timestamp.isoformat(),
-                    "es_video": d.es_video,
-                    "path": d.path,
-                    "checksum": d.checksum
-                }
-            } for d in results
-        ]
+        return self.get_unsynced("media", limit, after_id)
 
 
     def get_unsynced_entries(self, limit=None) -> list:
         """
         Devuelve registros pendientes de sincronizar de todas las tablas
-        de forma combinada. Se respeta el orden temporal dentro de cada tabla.
+        de forma combinada. Se respeta el orden de inserción dentro de cada tabla.
         El límite aplica al total combinado.
         """
         sensors = self.get_unsynced_sensors(limit)
@@ -360,46 +544,179 @@ class RobotDatabase:
         s.commit()
         s.close()
 
-    def mark_as_synced(self, packet_entries):
-        """Marca los registros indicados como sincronizados"""
-        s = self.new_session()
-
+    def mark_as_synced(self, packet_entries, packet_id=None):
+        """
+        Marca los registros indicados como sincronizados: un UPDATE ... WHERE id IN (...) por tabla.
+        packet_id: paquete LoRa confirmado; deja de estar en vuelo en la misma transacción.
+        """
+        by_table = {}
         for entry in packet_entries:
-            print(f"Marcando como sincronizado: {entry}")
-            table_name = entry["table"]
-            record_id = entry["id"]
-
-            if table_name == "sensores":
-                s.query(SensorData).filter(SensorData.id == record_id).update({"sinc": True})
-            elif table_name == "robot_movimiento":
-                s.query(RobotMovimiento).filter(RobotMovimiento.id == record_id).update({"sinc": True})
-            elif table_name == "media":
-                s.query(Media).filter(Media.id == record_id).update({"sinc": True})
-
-        s.commit()
-        s.close()
+            by_table.setdefault(entry["table"], []).append(entry["id"])
+        with self.engine.begin() as conn:
+            if packet_id is not None:
+                self._ack_packet(conn, packet_id)
+            for table_name, ids in by_table.items():
+                t = Base.metadata.tables[table_name]
+                for i in range(0, len(ids), MAX_SQL_PARAMS):
+                    conn.execute(update(t).where(t.c.id.in_(ids[i:i + MAX_SQL_PARAMS])).values(sinc=True))
+
+    def mark_ranges_synced(self, ranges: dict, packet_id=None):
+        """
+        ranges: {tabla: [(inicio, fin), ...]} inclusivos, como los del ACK binario
+        (SyncCodec.decode_ack). Un UPDATE por tabla con id BETWEEN por rango, sin
+        expandir los ids. packet_id: como en mark_as_synced.
+        """
+        with self.engine.begin() as conn:
+            if packet_id is not None:
+                self._ack_packet(conn, packet_id)
+            for table_name, table_ranges in ranges.items():
+                t = Base.metadata.tables[table_name]
+                step = MAX_SQL_PARAMS // 2
+                for i in range(0, len(table_ranges), step):
+                    chunk = table_ranges[i:i + step]
+                    conn.execute(update(t).where(or_(*(t.c.id.between(a, b) for a, b in chunk))).values(sinc=True))
 
     def delete_synced_entries(self):
-        """Elimina todos los registros que ya están sincronizados (sinc = True)"""
-        s = self.new_session()
+        """
+        Elimina los registros ya sincronizados (sinc = True) y aplica la
+        retención. Los de media los borra el MediaReaper en segundo plano,
+        junto con sus ficheros.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(delete(SensorData.__table__).where(SensorData.__table__.c.sinc == True))
+            conn.execute(delete(RobotMovimiento.__table__).where(RobotMovimiento.__table__.c.sinc == True))
+        self.reaper.wake()
+        self.apply_retention()
+
+    def apply_retention(self, max_rows=None) -> int:
+        """
+        Deja como mucho max_rows (por defecto self.max_rows) registros en sensores
+        y en robot_movimiento, descartando los más antiguos aunque no se hayan
+        sincronizado, y devuelve al disco las páginas liberadas. Devuelve cuántos
+        registros se han descartado.
+        """
+        max_rows = self.max_rows if max_rows is None else max_rows
+        dropped = 0
+        with self.engine.begin() as conn:
+            for model in (SensorData, RobotMovimiento):
+                t = model.__table__
+                cutoff = conn.execute(select(t.c.id).order_by(t.c.id.desc())
+                                      .offset(max_rows).limit(1)).scalar()
+                if cutoff is not None:
+                    n = conn.execute(delete(t).where(t.c.id <= cutoff)).rowcount
+                    dropped += n
+                    print(f"Retención: descartados {n} registros antiguos de {t.name}")
+        if dropped:
+            self.vacuum()
+        return dropped
+
+    def row_counts(self) -> dict:
+        """{tabla: nº de registros} de sensores y robot_movimiento"""
+        with self.engine.connect() as conn:
+            return {t: conn.exec_driver_sql(f"SELECT count(*) FROM {t}").scalar()
+                    for t in ("sensores", "robot_movimiento")}
+
+    def free_bytes(self) -> int:
+        """Bytes de páginas libres dentro del fichero (se devuelven con vacuum)."""
+        with self.engine.connect() as conn:
+            pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            return pages * conn.exec_driver_sql("PRAGMA page_size").scalar()
+
+    def vacuum(self):
+        """
+        Devuelve al disco las páginas libres. Una BBDD creada sin auto_vacuum
+        incremental (las de antes de la versión 3) se reescribe entera una vez
+        con VACUUM, que la deja en modo incremental para las siguientes.
+        """
+        conn = self.engine.raw_connection()
         try:
-            s.query(SensorData).filter_by(sinc=True).delete()
-            s.query(RobotMovimiento).filter_by(sinc=True).delete()
-            to_delete = s.query(Media).filter_by(sinc=True).all()
-            paths = [m.path for m in to_delete]
-            for p in paths:
-                try:
-                    if os.path.exists(p):
-                        os.remove(p)
-                        print(f"🗑 Archivo eliminado: {p}")
-                    else:
-                        print(f"⚠ Archivo no encontrado: {p}")
-                except Exception as e:
-                    print(f"❌ Error borrando {p}: {e}")
-            s.query(Media).filter_by(sinc=True).delete()
-            s.commit()
+            driver = conn.driver_connection
+            if driver.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                driver.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                driver.execute("VACUUM")
+            # Cada paso de la sentencia libera una página y execute() sólo da uno;
+            # executescript la ejecuta hasta el final. El checkpoint vacía el WAL
+            driver.executescript("PRAGMA incremental_vacuum; PRAGMA wal_checkpoint(TRUNCATE);")
         finally:
-            s.close()
+            conn.close()
+
+    def _synced_media(self, limit) -> list:
+        t = Media.__table__
+        with self.engine.connect() as conn:
+            return conn.execute(select(t.c.id, t.c.path).where(t.c.sinc == True)
+                                .order_by(t.c.id).limit(limit)).all()
+
+    def _forget_media(self, ids):
+        t = Media.__table__
+        with self.engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.id.in_(ids)))
+
+    # ---------------------------
+    # FICHEROS DE MEDIA (StorageManager)
+    # ---------------------------
+    def media_files(self, es_video: bool) -> dict:
+        """{path: (id, sinc)} de las fotos o los vídeos registrados"""
+        t = Media.__table__
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(t.c.path, t.c.id, t.c.sinc).where(t.c.es_video == es_video)).all()
+        return {path: (record_id, bool(sinc)) for path, record_id, sinc in rows}
+
+    def update_media_checksum(self, record_id: int, checksum):
+        """El fichero se ha reducido: la EB debe recibir el checksum del nuevo"""
+        t = Media.__table__
+        with self.engine.begin() as conn:
+            conn.execute(update(t).where(t.c.id == record_id).values(checksum=checksum))
+
+    def forget_media(self, ids):
+        """Elimina registros de media cuyo fichero ya no existe"""
+        if ids:
+            self._forget_media(list(ids))
+
+    # ---------------------------
+    # ESTADO DE LA SINCRONIZACIÓN
+    # ---------------------------
+    def load_sync_state(self) -> dict:
+        """
+        {"cursor": {tabla: id}, "next_packet_id": int | None, "last_ack": int | None,
+         "in_flight": [(packet_id, [(tabla, id), ...]), ...]} tal como quedó en la última ejecución
+        """
+        with self.engine.connect() as conn:
+            values = {k: json.loads(v) for k, v in conn.execute(select(SyncState.key, SyncState.value)).all()}
+            in_flight = conn.execute(select(SyncInFlight.packet_id, SyncInFlight.entries)
+                                     .order_by(SyncInFlight.sent_at)).all()
+        return {
+            "cursor": values.get("cursor", {}),
+            "next_packet_id": values.get("next_packet_id"),
+            "last_ack": values.get("last_ack"),
+            "in_flight": [(pid, [tuple(e) for e in json.loads(entries)]) for pid, entries in in_flight],
+        }
+
+    def save_packet(self, packet_id: int, entries, cursor: dict, next_packet_id: int):
+        """
+        Guarda, antes de enviarlo, un paquete nuevo en vuelo ([(tabla, id), ...])
+        junto con el cursor y el siguiente packet_id, en una sola transacción.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(delete(SyncInFlight.__table__).where(SyncInFlight.packet_id == packet_id))
+            conn.execute(SyncInFlight.__table__.insert().values(
+                packet_id=packet_id, entries=json.dumps([list(e) for e in entries]), sent_at=datetime.now()))
+            self._set_state(conn, cursor=cursor, next_packet_id=next_packet_id)
+
+    def drop_packet(self, packet_id: int):
+        """Olvida un paquete en vuelo (p. ej. si ya no queda ninguno de sus registros)"""
+        with self.engine.begin() as conn:
+            conn.execute(delete(SyncInFlight.__table__).where(SyncInFlight.packet_id == packet_id))
+
+    def _ack_packet(self, conn, packet_id):
+        conn.execute(delete(SyncInFlight.__table__).where(SyncInFlight.packet_id == packet_id))
+        self._set_state(conn, last_ack=packet_id)
+
+    @staticmethod
+    def _set_state(conn, **values):
+        t = SyncState.__table__
+        for key, value in values.items():
+            conn.execute(t.delete().where(t.c.key == key))
+            conn.execute(t.insert().values(key=key, value=json.dumps(value)))
 
 
 
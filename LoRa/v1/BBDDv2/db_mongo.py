@@ -17,30 +17,44 @@ class BaseStationDatabase:
         self.movimientos_col.create_index([("robot_id", ASCENDING), ("timestamp", DESCENDING)])
         self.media_col.create_index([("robot_id", ASCENDING), ("timestamp", DESCENDING)])
 
+        # Un registro sincronizado desde un robot se guarda una sola vez aunque el
+        # paquete se reciba repetido (también tras reiniciar la EB): clave única
+        # por robot, id en la BBDD del robot y timestamp del registro
+        for col in (self.sensores_col, self.movimientos_col, self.media_col):
+            col.create_index([("robot_id", ASCENDING), ("local_id", ASCENDING), ("timestamp", ASCENDING)],
+                             unique=True, partialFilterExpression={"local_id": {"$exists": True}})
+
+    def _insert(self, col, doc, local_id):
+        """Inserta doc; con local_id, sólo si no se había guardado ya (None si estaba)."""
+        if local_id is None:
+            return str(col.insert_one(doc).inserted_id)
+        doc["local_id"] = local_id
+        key = {"robot_id": doc["robot_id"], "local_id": local_id, "timestamp": doc["timestamp"]}
+        result = col.update_one(key, {"$setOnInsert": doc}, upsert=True)
+        return None if result.upserted_id is None else str(result.upserted_id)
+
     # ---------------------------
     # INSERTAR DATOS
     # ---------------------------
-    def insert_sensor(self, robot_id, temp, hum, timestamp=None):
+    def insert_sensor(self, robot_id, temp, hum, timestamp=None, local_id=None):
         doc = {
             "robot_id": robot_id,
             "timestamp": timestamp or datetime.now(),
             "temp": temp,
             "hum": hum
         }
-        result = self.sensores_col.insert_one(doc)
-        return str(result.inserted_id)
+        return self._insert(self.sensores_col, doc, local_id)
 
-    def insert_movimiento(self, robot_id, L, R, timestamp=None):
+    def insert_movimiento(self, robot_id, L, R, timestamp=None, local_id=None):
         doc = {
             "robot_id": robot_id,
             "timestamp": timestamp or datetime.now(),
             "L": L,
             "R": R
         }
-        result = self.movimientos_col.insert_one(doc)
-        return str(result.inserted_id)
+        return self._insert(self.movimientos_col, doc, local_id)
 
-    def insert_media(self, robot_id, path, es_video=False, checksum=None, timestamp=None):
+    def insert_media(self, robot_id, path, es_video=False, checksum=None, timestamp=None, local_id=None):
         doc = {
             "robot_id": robot_id,
             "timestamp": timestamp or datetime.now(),
@@ -48,8 +62,7 @@ class BaseStationDatabase:
             "path": path,
             "checksum": checksum
         }
-        result = self.media_col.insert_one(doc)
-        return str(result.inserted_id)
+        return self._insert(self.media_col, doc, local_id)
 
     # ---------------------------
     # CONSULTAS
@@ -31,6 +31,7 @@ from datetime import datetime
 class EB_RobotGUI_bis(QWidget):
 
     message_received = pyqtSignal(str)
+    nodes_changed = pyqtSignal()
 
     def __init__(self, loranode: LoRaNode = None):
         super().__init__()
@@ -747,8 +748,13 @@ class EB_RobotGUI_bis(QWidget):
         self.panel = RobotsPanel()
 
         if self.loranode is not None:
+            # El estado de los nodos sólo se repinta cuando cambia (NodeLiveness
+            # avisa desde su hilo y la señal lo trae al de Qt); la calidad del
+            # enlace sí se refresca cada 5 s
+            self.nodes_changed.connect(self.refresh_connected_robots)
+            self.loranode.liveness.subscribe(lambda nodes: self.nodes_changed.emit())
             self.timer2 = QTimer()
-            self.timer2.timeout.connect(self.refresh_connected_robots)
+            self.timer2.timeout.connect(self.refresh_links)
             self.timer2.start(5000)
 
         tabs_config.addTab(self.panel, "Nodos Conectados")
@@ -883,8 +889,19 @@ class EB_RobotGUI_bis(QWidget):
             alert = "GENERAL"
 
         self.append_general_log(f"[{time.strftime('%H:%M:%S')}] Sending command to {dest}: {alert}")
-        self.loranode.send_message(dest, msg_type, self.msg_id, cmd, relay)
+        reply = self.loranode.send_message(dest, msg_type, self.msg_id, cmd, relay)
         self._append_output(f"[{time.strftime('%H:%M:%S')}] 📡 Enviado: {msg_type} to {dest}")
+        if reply is not None:
+            reply.add_done_callback(lambda f, d=dest, a=alert: self._on_cmd_reply(f, d, a))
+
+    def _on_cmd_reply(self, reply, dest, alert):
+        """Respuesta (o timeout) de un comando enviado con send_cmd."""
+        if reply.cancelled():
+            return
+        if reply.exception() is not None:
+            self.append_general_log(f"[{time.strftime('%H:%M:%S')}] ⏱ {alert} sin respuesta de {dest}")
+        else:
+            self.append_general_log(f"[{time.strftime('%H:%M:%S')}] ↩️ {alert} respondido por {dest}")
 
     def take_data(self):
         # Envia una orden al nodo para obtener la temperatura y humedad
@@ -1517,7 +1534,10 @@ class EB_RobotGUI_bis(QWidget):
                 for node_id, info in self.loranode.connected_nodes.items()
             }
             
-        self.panel.sync_with_nodes(node_data)
+        self.panel.sync_with_nodes(node_data, self.loranode.links.snapshot())
+
+    def refresh_links(self):
+        self.panel.update_links(self.loranode.links.snapshot())
 
   
     def start_video(self):
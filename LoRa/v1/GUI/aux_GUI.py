@@ -63,6 +63,11 @@ class RobotStatusCard(QFrame):
         self.add_status(layout, "Sensores conectados", self.sensor_status)
         self.add_status(layout, "Cámara conectada", self.camera_status)
 
+        # Calidad del enlace LoRa (LinkStats de la EB)
+        self.link_label = QLabel("Enlace: sin datos")
+        self.link_label.setStyleSheet("font-size: 11px; color: #aaaaaa;")
+        layout.addWidget(self.link_label)
+
         layout.addStretch()
 
     def add_status(self, layout, label_text, indicator):
@@ -79,6 +84,18 @@ class RobotStatusCard(QFrame):
         self.sensor_status.set_state(sensors)
         self.camera_status.set_state(camera)
 
+    def update_link(self, link: dict | None):
+        """link: entrada de LinkStats.snapshot() (rssi, snr, loss, rtt) o None"""
+        if not link:
+            self.link_label.setText("Enlace: sin datos")
+            return
+        def fmt(value, pattern):
+            return "-" if value is None else pattern.format(value)
+        self.link_label.setText(
+            f"RSSI {fmt(link.get('rssi'), '{:.0f} dBm')} · SNR {fmt(link.get('snr'), '{:.0f} dB')} · "
+            f"Pérdidas {fmt(link.get('loss'), '{:.0%}')} · RTT {fmt(link.get('rtt'), '{:.2f} s')}"
+        )
+
 
 class RobotsPanel(QWidget):
     """Panel que muestra todos los robots conectados"""
@@ -89,24 +106,33 @@ class RobotsPanel(QWidget):
         self.layout.setAlignment(Qt.AlignmentFlag.AlignTop)
         self.robots = {}
 
-    def add_or_update_robot(self, node_id, robot, radar, sensors, camera):
+    def add_or_update_robot(self, node_id, robot, radar, sensors, camera, link=None):
         if node_id not in self.robots:
             card = RobotStatusCard(node_id)
             self.layout.addWidget(card)
             self.robots[node_id] = card
         self.robots[node_id].update_status(robot, radar, sensors, camera)
+        self.robots[node_id].update_link(link)
 
-    def sync_with_nodes(self, node_data: dict):
+    def sync_with_nodes(self, node_data: dict, links: dict = None):
         """
         node_data: dict { node_id: (robot, radar, sensors, camera) }
+        links: dict { node_id: {rssi, snr, loss, rtt} } (LinkStats.snapshot())
         Los que no estén en node_data → se ponen en blanco.
         """
+        links = links or {}
         # Actualizar o crear robots presentes
         for node_id, states in node_data.items():
-            self.add_or_update_robot(node_id, *states)
+            self.add_or_update_robot(node_id, *states, link=links.get(node_id))
 
         # Los que ya no aparecen → poner en blanco
         for node_id, card in self.robots.items():
             if node_id not in node_data:
                 card.update_status(None, None, None, None)
+                card.update_link(None)
 
+    def update_links(self, links: dict):
+        """Refresca sólo la calidad del enlace de los robots conectados (LinkStats.snapshot())."""
+        for node_id, card in self.robots.items():
+            if card.robot_status.state is not None:
+                card.update_link(links.get(node_id))
@@ -0,0 +1,253 @@
+import random
+import statistics
+import struct
+import threading
+import time
+from collections import deque
+
+from NodoLoRa.sx126x_bis import SENSITIVITY
+
+# Mensajes de configuración de radio (msg_type 9), payload CONFIG
+ADR_PROPOSE = 1     # EB -> difusión: propuesta de velocidad
+ADR_ACK = 2         # robot -> EB: acepta la propuesta
+ADR_COMMIT = 3      # EB -> difusión: cambiar ya
+CONFIG = struct.Struct(">BI")   # token, velocidad en el aire (bps)
+
+AIR_SPEEDS = (2400, 4800, 9600, 19200, 38400, 62500)
+
+
+class AdaptiveDataRate:
+    """
+    Velocidad en el aire adaptativa.
+
+    La EB guarda el historial de RSSI de cada robot y calcula para cada uno la
+    velocidad más rápida cuyo margen (RSSI bajo del historial - sensibilidad)
+    supera 'margin' dB. Como la EB tiene una sola radio, toda la red comparte
+    velocidad: se usa la del robot activo con peor enlace.
+
+    Cambio negociado por LoRa: la EB difunde PROPOSE, cada robot activo
+    responde ACK y, si responden todos, la EB difunde COMMIT y ambos lados
+    cambian. Fuera de la velocidad por defecto, cada lado vigila el enlace: el
+    robot si deja de oír la red y la EB si deja de oír a alguno de los robots
+    que aceptaron el cambio durante 'revert_after' segundos. En ese caso
+    vuelven a la velocidad por defecto, así que ambos lados siempre coinciden.
+
+    node: LoRaNode (node.node es la radio, con set_air_speed/can_configure).
+    En una EB con varias radios (RadioGroup) sólo cuentan los robots de la
+    principal, y PROPOSE/COMMIT salen sólo por ella: es la única que cambia
+    de velocidad.
+    """
+    def __init__(self, node, speeds=AIR_SPEEDS, default_speed=2400, margin=10.0, history=20,
+                 min_samples=5, period=60.0, hold=3, active_window=180.0, revert_after=90.0,
+                 negotiate_timeout=12.0, reply_jitter=2.0):
+        self.node = node
+        self.speeds = sorted(speeds)
+        self.default_speed = default_speed
+        self.margin = margin
+        self.history = history
+        self.min_samples = min_samples
+        self.period = period
+        self.hold = hold
+        self.active_window = active_window
+        self.revert_after = revert_after
+        self.negotiate_timeout = negotiate_timeout
+        self.reply_jitter = reply_jitter
+        self.lock = threading.Lock()
+        self.rssi = {}              # addr -> deque de RSSI (dBm)
+        self.last_heard = {}        # addr -> instante del último paquete
+        self.last_rx = time.monotonic()
+        self.acks = set()
+        self.members = set()        # robots que aceptaron la velocidad actual (EB)
+        self.switched_at = 0.0
+        self.token = 0
+        self.proposed = None        # (token, velocidad) aceptada por el robot
+        self.candidate = None
+        self.stable = 0
+        self.switches = 0
+        self.reverts = 0
+        self.running = True
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(self.node.node, "can_configure", False)
+
+    @property
+    def air_speed(self) -> int:
+        return getattr(self.node.node, "air_speed", self.default_speed)
+
+    def start(self):
+        if not self.enabled:
+            return
+        threading.Thread(target=self._watch_loop, name="lora-adr-watch", daemon=True).start()
+        if self.node.is_base:
+            threading.Thread(target=self._adr_loop, name="lora-adr", daemon=True).start()
+
+    # ---------------------------
+    # HISTORIAL
+    # ---------------------------
+    def observe(self, addr, rssi=None):
+        """Paquete recibido de addr (con su RSSI en dBm si el módulo lo añade)."""
+        now = time.monotonic()
+        with self.lock:
+            self.last_rx = now
+            self.last_heard[addr] = now
+            if rssi is not None:
+                self.rssi.setdefault(addr, deque(maxlen=self.history)).append(rssi)
+
+    def forget(self, addr):
+        """EB: addr se oye en otra radio; deja de contar para la velocidad de la principal."""
+        with self.lock:
+            self.rssi.pop(addr, None)
+            self.last_heard.pop(addr, None)
+            self.members.discard(addr)
+
+    def best_speed(self, addr):
+        """Velocidad más rápida que permite el enlace con addr (None si no hay muestras suficientes)."""
+        with self.lock:
+            samples = list(self.rssi.get(addr, ()))
+        if len(samples) < self.min_samples:
+            return None
+        # Se usa un RSSI bajo del historial (percentil ~10) para no reaccionar a picos
+        floor = sorted(samples)[len(samples) // 10]
+        best = self.speeds[0]
+        for speed in self.speeds:
+            if floor - SENSITIVITY[speed] >= self.margin:
+                best = speed
+        return best
+
+    def active_nodes(self) -> list:
+        now = time.monotonic()
+        with self.lock:
+            return [a for a, t in self.last_heard.items() if now - t <= self.active_window]
+
+    def target_speed(self):
+        speeds = [self.best_speed(a) for a in self.active_nodes()]
+        speeds = [s for s in speeds if s is not None]
+        return min(speeds) if speeds else None
+
+    def stats(self) -> dict:
+        with self.lock:
+            rssi = {a: round(statistics.mean(d), 1) for a, d in self.rssi.items() if d}
+        return {
+            "air_speed": self.air_speed,
+            "rssi_avg": rssi,
+            "best": {a: self.best_speed(a) for a in rssi},
+            "switches": self.switches,
+            "reverts": self.reverts,
+        }
+
+    # ---------------------------
+    # MENSAJES (msg_type 9)
+    # ---------------------------
+    def on_message(self, addr_sender, msg_id, payload):
+        if not isinstance(payload, (bytes, bytearray)) or len(payload) < CONFIG.size:
+            return
+        token, speed = CONFIG.unpack_from(payload)
+        if msg_id == ADR_ACK and self.node.is_base:
+            with self.lock:
+                if token == self.token:
+                    self.acks.add(addr_sender)
+        elif msg_id == ADR_PROPOSE and not self.node.is_base:
+            if self.enabled and speed in SENSITIVITY:
+                self.proposed = (token, speed)
+                # Retardo aleatorio: la propuesta es de difusión y todos los robots responden
+                threading.Timer(random.uniform(0, self.reply_jitter), self.node.send_data,
+                                args=(addr_sender, 9, ADR_ACK, CONFIG.pack(token, speed))).start()
+        elif msg_id == ADR_COMMIT and not self.node.is_base:
+            if self.proposed == (token, speed):
+                self.proposed = None
+                threading.Thread(target=self._switch, args=(speed,), daemon=True).start()
+
+    def _broadcast(self, msg_id, payload):
+        """Difusión por la radio principal (en RadioGroup, schedulers[0])."""
+        frame = self.node.pack_bytes(0xFFFF, 9, msg_id, payload)
+        if frame is not None:
+            tx = getattr(self.node.tx, "schedulers", [self.node.tx])[0]
+            tx.submit(frame, self.node.tx_priority(9, msg_id))
+
+    def _wait_tx_idle(self, timeout=5.0):
+        """Espera a que salgan los paquetes encolados (p. ej. los COMMIT) antes de cambiar."""
+        deadline = time.monotonic() + timeout
+        while self.node.tx.stats()["queued"] > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.5)     # el último paquete aún está en el aire
+
+    def _switch(self, speed):
+        previous = self.air_speed
+        self._wait_tx_idle()
+        if not self.node.node.set_air_speed(speed):
+            self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] ADR: no se pudo cambiar a {speed} bps")
+            return False
+        self.switched_at = time.monotonic()
+        self.switches += 1
+        self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] ADR: velocidad en el aire {previous} -> {speed} bps")
+        if self.node.is_base:
+            self.node.send_ping()   # los robots responden a la nueva velocidad (y la baliza TDMA cambia de ranuras)
+        return True
+
+    def _revert(self):
+        self.reverts += 1
+        self.members = set()
+        self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] ADR: sin enlace, vuelta a {self.default_speed} bps")
+        self.node.node.set_air_speed(self.default_speed)
+        self.switched_at = time.monotonic()
+
+    def _watch_loop(self):
+        """Vuelta a la velocidad por defecto si se pierde el enlace a otra velocidad."""
+        while self.running and self.node.running:
+            time.sleep(min(5.0, self.revert_after / 4))
+            now = time.monotonic()
+            if self.air_speed == self.default_speed or now - self.switched_at < self.revert_after:
+                continue
+            with self.lock:
+                if self.node.is_base:
+                    lost = [a for a in self.members if now - self.last_heard.get(a, 0) > self.revert_after]
+                else:
+                    lost = now - self.last_rx > self.revert_after
+            if lost:
+                self._revert()
+
+    # ---------------------------
+    # EB: DECISIÓN Y NEGOCIACIÓN
+    # ---------------------------
+    def _adr_loop(self):
+        while self.running and self.node.running:
+            time.sleep(self.period)
+            target = self.target_speed()
+            current = self.air_speed
+            if target is None or target == current:
+                self.candidate, self.stable = None, 0
+                continue
+            # Bajar en cuanto el margen no llega; subir sólo si se mantiene 'hold' evaluaciones
+            self.stable = self.stable + 1 if target == self.candidate else 1
+            self.candidate = target
+            if target < current or self.stable >= self.hold:
+                self.candidate, self.stable = None, 0
+                self._negotiate(target)
+
+    def _negotiate(self, speed):
+        nodes = set(self.active_nodes())
+        with self.lock:
+            self.token = (self.token + 1) & 0xFF
+            token = self.token
+            self.acks = set()
+        payload = CONFIG.pack(token, speed)
+        deadline = time.monotonic() + self.negotiate_timeout
+        while time.monotonic() < deadline:
+            self._broadcast(ADR_PROPOSE, payload)
+            time.sleep(self.negotiate_timeout / 3)
+            with self.lock:
+                if nodes <= self.acks:
+                    break
+        with self.lock:
+            missing = nodes - self.acks
+        if missing:
+            self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] ADR: {sorted(missing)} no aceptan {speed} bps, se mantiene {self.air_speed} bps")
+            return
+        for _ in range(3):
+            self._broadcast(ADR_COMMIT, payload)
+        if self._switch(speed):
+            self.members = nodes
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    def __init__(self, name, fn, period, blocking):
+        self.name = name
+        self.fn = fn
+        self.period = period
+        self.blocking = blocking
+        self.wake = None            # asyncio.Event, se crea dentro del bucle
+        self.runs = 0
+        self.errors = 0
+        self.busy_s = 0.0
+
+
+class AsyncRuntime:
+    """
+    Alternativa a los hilos de LoRaNode.run: un único bucle asyncio (en su
+    propio hilo, para que run() siga volviendo enseguida y la GUI conserve el
+    principal) con
+
+      - la UART de cada radio: con sx126x en Linux, el descriptor del puerto
+        serie se vigila con add_reader y sólo se lee cuando llegan bytes, en
+        lugar de despertar cada FRAME_GAP; el resto de radios (VirtualRadio,
+        Windows) se leen con receive_frames en el executor;
+      - los servidores TCP/UDP como servidores asyncio;
+      - las tareas periódicas en un único planificador: cada una es una
+        función de un paso que devuelve (opcionalmente) los segundos hasta el
+        siguiente, y wake() la adelanta desde cualquier hilo;
+      - las llamadas bloqueantes (BBDD, cámara, puerto serie de sensores) en un
+        executor de pocos hilos.
+
+    stop() cancela todas las tareas, cierra servidores y lectores y espera al
+    hilo del bucle.
+    """
+    def __init__(self, node, workers=4, idle_flush=1.0):
+        self.node = node
+        # Un hilo más por radio por si alguna se lee con receive_frames
+        self.executor = ThreadPoolExecutor(max_workers=workers + len(node.radios), thread_name_prefix="lora-exec")
+        self.idle_flush = idle_flush
+        self.jobs = {}
+        self.servers = []           # (coroutine factory) -> servidor
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.stopping = None
+        self.readers = {}           # id(radio) -> descriptor vigilado con add_reader
+        self.flush_handles = {}
+        self.tasks = []
+
+    # ---------------------------
+    # CONFIGURACIÓN (antes de start)
+    # ---------------------------
+    def add_job(self, name, fn, period, blocking=True):
+        """fn(): un paso de la tarea; si devuelve un número, es la espera hasta el siguiente."""
+        self.jobs[name] = Job(name, fn, period, blocking)
+
+    def add_server(self, factory):
+        """factory(): corrutina que crea el servidor (asyncio.start_server, create_datagram_endpoint...)."""
+        self.servers.append(factory)
+
+    # ---------------------------
+    # CICLO DE VIDA
+    # ---------------------------
+    def start(self, timeout=5.0):
+        self.thread = threading.Thread(target=self._run, name="lora-asyncio", daemon=True)
+        self.thread.start()
+        self.ready.wait(timeout)
+
+    def _run(self):
+        try:
+            asyncio.run(self.main())
+        except Exception as e:
+            print(f"[{time.strftime('%H:%M:%S')}] Error en el runtime asyncio: {e}")
+        finally:
+            self.ready.set()
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(self.executor)
+        self.stopping = asyncio.Event()
+        for radio in self.node.radios:
+            self._attach_radio(radio)
+        opened = []
+        for factory in self.servers:
+            try:
+                opened.append(await factory())
+            except OSError as e:
+                print(f"[{time.strftime('%H:%M:%S')}] No se pudo abrir el servidor: {e}")
+        for job in self.jobs.values():
+            job.wake = asyncio.Event()
+            self.tasks.append(asyncio.create_task(self._job_loop(job), name=f"job-{job.name}"))
+        self.ready.set()
+        try:
+            await self.stopping.wait()
+        finally:
+            for fd in self.readers.values():
+                self.loop.remove_reader(fd)
+            for handle in self.flush_handles.values():
+                handle.cancel()
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            for server in opened:
+                server = server[0] if isinstance(server, tuple) else server     # (transport, protocol)
+                server.close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self, timeout=5.0):
+        if self.loop is not None and self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    # ---------------------------
+    # TAREAS PERIÓDICAS
+    # ---------------------------
+    def wake(self, name):
+        """Adelanta la tarea 'name' (desde cualquier hilo)."""
+        job = self.jobs.get(name)
+        if job is not None and job.wake is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(job.wake.set)
+
+    async def call(self, fn, *args):
+        """Ejecuta una función bloqueante en el executor."""
+        return await self.loop.run_in_executor(None, fn, *args)
+
+    async def _job_loop(self, job):
+        while self.node.running:
+            t = time.monotonic()
+            delay = None
+            try:
+                delay = await self.call(job.fn) if job.blocking else job.fn()
+            except Exception as e:
+                job.errors += 1
+                print(f"[{time.strftime('%H:%M:%S')}] Error en la tarea {job.name}: {e}")
+            job.runs += 1
+            job.busy_s += time.monotonic() - t
+            job.wake.clear()
+            try:
+                await asyncio.wait_for(job.wake.wait(), job.period if delay is None else delay)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---------------------------
+    # UART
+    # ---------------------------
+    def _attach_radio(self, radio):
+        fileno = getattr(radio, "fileno", None)
+        if fileno is not None and hasattr(radio, "read_available"):
+            try:
+                fd = fileno()
+                self.loop.add_reader(fd, self._on_readable, radio)
+                self.readers[id(radio)] = fd
+                return
+            except (NotImplementedError, OSError, ValueError):
+                pass        # Windows (Proactor) o puerto sin descriptor
+        self.tasks.append(asyncio.create_task(self._poll_radio(radio), name="radio-poll"))
+
+    def _on_readable(self, radio):
+        frames = radio.read_available()
+        if frames is None:
+            # La radio está ocupada (configuración, lectura de RSSI): se deja de
+            # vigilar el descriptor, que seguiría listo, y se reintenta tras un hueco
+            self.loop.remove_reader(self.readers[id(radio)])
+            self._schedule_flush(radio, self._gap(radio), resume=True)
+            return
+        if frames:
+            self.node.handle_frames(radio, frames, wait=False)
+        # Un paquete a medias sólo se cierra tras el silencio de FRAME_GAP
+        self._schedule_flush(radio, self._gap(radio) if radio.pending else self.idle_flush)
+
+    def _schedule_flush(self, radio, delay, resume=False):
+        handle = self.flush_handles.get(id(radio))
+        if handle is not None:
+            handle.cancel()
+        self.flush_handles[id(radio)] = self.loop.call_later(delay, self._flush, radio, resume)
+
+    def _flush(self, radio, resume):
+        if resume:
+            self.loop.add_reader(self.readers[id(radio)], self._on_readable, radio)
+        self._on_readable(radio)
+
+    @staticmethod
+    def _gap(radio):
+        return getattr(getattr(radio, "parser", None), "gap", 0.02) * 1.5
+
+    async def _poll_radio(self, radio):
+        while self.node.running:
+            frames = await self.loop.run_in_executor(None, radio.receive_frames)
+            if frames:
+                self.node.handle_frames(radio, frames, wait=False)
+
+    def stats(self) -> dict:
+        return {
+            name: {"runs": j.runs, "errors": j.errors, "busy_s": round(j.busy_s, 2)}
+            for name, j in self.jobs.items()
+        }
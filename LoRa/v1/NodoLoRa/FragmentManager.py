@@ -0,0 +1,237 @@
+import random
+import struct
+import threading
+import time
+
+# Subcabecera de cada fragmento: id de transferencia, nº de secuencia, total
+FRAG_HEADER = struct.Struct(">BHH")
+# Estado de una transferencia (msg 0/31): id, completa (1) o NACK (0), total,
+# seguido de un bitmap con los fragmentos que faltan (bit a 1 = falta)
+STATUS_HEADER = struct.Struct(">BBH")
+
+CHUNK_SIZE = 200
+# Fragmentos que se piden por delante del más alto recibido en un NACK por
+# parada: los posteriores quizá no han salido aún del emisor
+NACK_WINDOW = 8
+# Espacio útil para el bitmap en un paquete de estado (242 - cabecera - STATUS_HEADER)
+MAX_BITMAP = 242 - 7 - STATUS_HEADER.size
+
+
+def missing_bitmap(total: int, received, limit=None) -> bytes:
+    """
+    Bitmap de fragmentos que faltan (bit a 1 = falta), truncado a MAX_BITMAP.
+    limit: sólo se piden los fragmentos anteriores a él (el bitmap se acorta).
+    """
+    limit = total if limit is None else min(total, limit)
+    bitmap = bytearray((limit + 7) // 8)
+    for seq in range(limit):
+        if seq not in received:
+            bitmap[seq >> 3] |= 0x80 >> (seq & 7)
+    return bytes(bitmap[:MAX_BITMAP])
+
+
+def bitmap_to_seqs(bitmap: bytes, total: int) -> list:
+    return [seq for seq in range(min(total, len(bitmap) * 8))
+            if bitmap[seq >> 3] & (0x80 >> (seq & 7))]
+
+
+class OutgoingTransfer:
+    def __init__(self, tid, addr_dest, msg_type, msg_id, data, chunk_size, relay_flag=0):
+        self.tid = tid
+        self.addr_dest = addr_dest
+        self.msg_type = msg_type
+        self.msg_id = msg_id
+        self.relay_flag = relay_flag    # los reenvíos salen por el mismo camino que el original
+        self.chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)] or [b""]
+        self.total = len(self.chunks)
+        self.pending = set()        # fragmentos por enviar (los pedidos por NACK se suman)
+        self.finished_at = None     # instante en que salió el último fragmento pedido
+        self.probes = 0
+        self.created = time.monotonic()
+
+
+class Reassembly:
+    def __init__(self, total, msg_type, msg_id):
+        self.total = total
+        self.msg_type = msg_type
+        self.msg_id = msg_id
+        self.chunks = {}
+        self.last_rx = time.monotonic()
+        self.nacks = 0
+
+
+class FragmentManager:
+    """
+    Fragmentación con repetición selectiva para ficheros enviados por LoRa.
+
+    Emisor: cada fichero se parte en fragmentos con subcabecera (transferencia,
+    secuencia, total) y se conserva en memoria hasta que el receptor confirma.
+    Receptor: reensambla en memoria por (origen, transferencia). Al recibir el
+    último fragmento, o si la transferencia se queda parada, responde con un
+    bitmap de fragmentos que faltan y el emisor reenvía sólo esos. Si el emisor
+    no recibe respuesta tras terminar, reenvía el último fragmento como sondeo.
+
+    node: LoRaNode que aporta pack_bytes, send_data y el planificador tx.
+    on_complete(addr_sender, msg_type, msg_id, data) se llama con el fichero completo.
+    """
+    def __init__(self, node, on_complete, chunk_size=CHUNK_SIZE, nack_after=4.0,
+                 rx_timeout=60.0, tx_timeout=180.0, max_nacks=8, max_probes=3):
+        self.node = node
+        self.on_complete = on_complete
+        self.chunk_size = chunk_size
+        self.nack_after = nack_after
+        self.rx_timeout = rx_timeout
+        self.tx_timeout = tx_timeout
+        self.max_nacks = max_nacks
+        self.max_probes = max_probes
+        self.lock = threading.Lock()
+        self.outgoing = {}          # (addr_dest, tid) -> OutgoingTransfer
+        self.incoming = {}          # (addr_sender, tid) -> Reassembly
+        self.completed = {}         # (addr_sender, tid) -> (total, instante) ya entregadas
+        # Aleatorio: tras reiniciar, el receptor aún recuerda las transferencias
+        # recientes de este nodo y daría por completa una nueva con el mismo id
+        self.next_tid = random.randrange(256)
+        self.running = True
+        threading.Thread(target=self._sweep_loop, name="lora-frag", daemon=True).start()
+
+    # ---------------------------
+    # EMISOR
+    # ---------------------------
+    def send(self, addr_dest, msg_type, msg_id, data: bytes, relay_flag=0):
+        """Registra una transferencia y encola todos sus fragmentos."""
+        with self.lock:
+            tid = self.next_tid
+            self.next_tid = (self.next_tid + 1) & 0xFF
+            tr = OutgoingTransfer(tid, addr_dest, msg_type, msg_id, data, self.chunk_size, relay_flag)
+            self.outgoing[(addr_dest, tid)] = tr
+        print(f"[{time.strftime('%H:%M:%S')}] Transferencia {tid} a {addr_dest}: {len(data)} bytes en {tr.total} fragmentos.")
+        self._queue(tr, range(tr.total))
+        return tid
+
+    def _frame(self, tr, seq):
+        payload = FRAG_HEADER.pack(tr.tid, seq, tr.total) + tr.chunks[seq]
+        part = 1 if seq + 1 < tr.total else 0
+        return self.node.pack_bytes(tr.addr_dest, tr.msg_type, tr.msg_id, payload, tr.relay_flag, part, frag=True)
+
+    def _queue(self, tr, seqs):
+        """
+        Añade fragmentos a los pendientes de la transferencia. Hay un único
+        iterador por transferencia en el planificador: el nuevo sustituye al
+        que siga en cola, y envía lo que éste no llegó a enviar más lo pedido.
+        """
+        def frames():
+            while True:
+                with self.lock:
+                    if not tr.pending:
+                        tr.finished_at = time.monotonic()
+                        return
+                    seq = min(tr.pending)
+                    tr.pending.discard(seq)
+                frame = self._frame(tr, seq)
+                if frame is not None:
+                    yield frame
+
+        with self.lock:
+            tr.pending.update(seqs)
+            tr.finished_at = None
+        self.node.tx.submit_stream(frames(), self.node.tx_priority(tr.msg_type, tr.msg_id),
+                                   transfer=(tr.addr_dest, tr.tid), replace=True)
+
+    def on_status(self, addr_sender, payload: bytes):
+        """Procesa un ACK/NACK de transferencia recibido del receptor."""
+        if len(payload) < STATUS_HEADER.size:
+            return
+        tid, complete, total = STATUS_HEADER.unpack_from(payload)
+        with self.lock:
+            tr = self.outgoing.get((addr_sender, tid))
+            if tr is None:
+                return
+            if complete:
+                del self.outgoing[(addr_sender, tid)]
+        if complete:
+            print(f"[{time.strftime('%H:%M:%S')}] Transferencia {tid} a {addr_sender} confirmada.")
+            return
+        seqs = bitmap_to_seqs(payload[STATUS_HEADER.size:], tr.total)
+        print(f"[{time.strftime('%H:%M:%S')}] NACK de {addr_sender} (transferencia {tid}): reenviando {len(seqs)} fragmentos.")
+        tr.probes = 0
+        self._queue(tr, seqs)
+
+    # ---------------------------
+    # RECEPTOR
+    # ---------------------------
+    def on_fragment(self, addr_sender, msg_type, msg_id, payload: bytes):
+        if len(payload) < FRAG_HEADER.size:
+            return
+        tid, seq, total = FRAG_HEADER.unpack_from(payload)
+        if seq >= total:
+            return          # fragmento mal formado: no cabe en la transferencia
+        key = (addr_sender, tid)
+        with self.lock:
+            prev = self.completed.get(key)
+            repeated = prev is not None and prev[0] == total
+            if not repeated:
+                ra = self.incoming.get(key)
+                if ra is None or ra.total != total:
+                    ra = self.incoming[key] = Reassembly(total, msg_type, msg_id)
+                ra.chunks[seq] = bytes(payload[FRAG_HEADER.size:])
+                ra.last_rx = time.monotonic()
+                done = len(ra.chunks) == ra.total
+                if done:
+                    del self.incoming[key]
+                    self.completed[key] = (total, ra.last_rx)
+        if repeated:
+            # El emisor no recibió nuestra confirmación: repetirla
+            self._send_status(addr_sender, tid, total, complete=True)
+        elif done:
+            self._send_status(addr_sender, tid, total, complete=True)
+            data = b"".join(ra.chunks[i] for i in range(total))
+            self.on_complete(addr_sender, ra.msg_type, ra.msg_id, data)
+        elif seq == total - 1:
+            # Ha llegado el último: pedir ya los que faltan
+            self._nack(addr_sender, tid, ra)
+
+    def _nack(self, addr_sender, tid, ra):
+        ra.nacks += 1
+        ra.last_rx = time.monotonic()
+        # Sin el último fragmento no se sabe hasta dónde ha llegado el emisor
+        limit = None if ra.total - 1 in ra.chunks else max(ra.chunks, default=-1) + 1 + NACK_WINDOW
+        self._send_status(addr_sender, tid, ra.total, complete=False, received=ra.chunks, limit=limit)
+
+    def _send_status(self, addr_dest, tid, total, complete, received=None, limit=None):
+        payload = STATUS_HEADER.pack(tid, 1 if complete else 0, total)
+        if not complete:
+            payload += missing_bitmap(total, received, limit)
+        self.node.send_data(addr_dest, 0, 31, payload)
+
+    # ---------------------------
+    # TEMPORIZADORES
+    # ---------------------------
+    def _sweep_loop(self):
+        while self.running:
+            time.sleep(1)
+            now = time.monotonic()
+            with self.lock:
+                incoming = list(self.incoming.items())
+                outgoing = list(self.outgoing.items())
+                for key in [k for k, (_, t) in self.completed.items() if now - t > self.rx_timeout]:
+                    del self.completed[key]
+            for key, ra in incoming:
+                idle = now - ra.last_rx
+                if idle > self.rx_timeout or ra.nacks >= self.max_nacks:
+                    with self.lock:
+                        self.incoming.pop(key, None)
+                    print(f"[{time.strftime('%H:%M:%S')}] Transferencia {key[1]} de {key[0]} abandonada ({len(ra.chunks)}/{ra.total}).")
+                elif idle > self.nack_after:
+                    self._nack(key[0], key[1], ra)
+            for key, tr in outgoing:
+                if now - tr.created > self.tx_timeout or tr.probes > self.max_probes:
+                    with self.lock:
+                        self.outgoing.pop(key, None)
+                    print(f"[{time.strftime('%H:%M:%S')}] Transferencia {tr.tid} a {tr.addr_dest} sin confirmar, descartada.")
+                elif tr.finished_at is not None and now - tr.finished_at > self.nack_after * 2:
+                    # Sin respuesta del receptor: sondear con el último fragmento
+                    tr.probes += 1
+                    self._queue(tr, [tr.total - 1])
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,200 @@
+import bisect
+import threading
+import time
+
+from NodoLoRa.PacketDispatcher import PacketDispatcher
+
+# Límites superiores (ms) de las clases del histograma de latencia; la última es el resto
+LATENCY_BUCKETS_MS = (1, 5, 20, 100, 500, 2000, 10000)
+
+# Carriles de los handlers lentos: nombre -> (hilos, reparto). Con "src" los
+# paquetes de un emisor van siempre al mismo hilo (en orden); con "type", los
+# de un mismo tipo de mensaje
+DEFAULT_LANES = {
+    "robot": (1, "src"),        # puerto serie del robot: un único hilo, en orden
+    "camera": (1, "src"),       # cámara: fotos, vídeo y streaming
+    "db": (2, "src"),           # paquetes y ACKs de BBDD, por robot
+    "slow": (2, "type"),        # el resto (sensores, LED, plugins)
+}
+
+
+class Handler:
+    def __init__(self, fn, lane, name):
+        self.fn = fn
+        self.lane = lane                # None = rápido, en el hilo del dispatcher
+        self.slow = lane is not None
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.dropped = 0
+        self.lat_sum = 0.0
+        self.lat_max = 0.0
+        self.wait_sum = 0.0
+        self.hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+
+class HandlerRegistry:
+    """
+    Tabla (msg_type, msg_id) -> handler para los paquetes recibidos.
+
+    Un handler registrado con msg_id=None atiende todos los msg_id de su tipo
+    que no tengan uno propio. Cada handler recibe el Packet (HeaderCodec) y
+    declara si es rápido (se ejecuta en el hilo del dispatcher que procesa el
+    paquete) o lento: los lentos van a un carril (lane) con sus propios hilos
+    para no bloquear los paquetes siguientes del mismo emisor. Cada recurso
+    lento tiene su carril (DEFAULT_LANES), así que una grabación de vídeo no
+    retrasa la sincronización de la BBDD ni los comandos al robot, y los
+    comandos al robot se atienden de uno en uno y en orden de llegada.
+
+    Por handler se cuentan llamadas, errores, paquetes descartados por cola
+    llena y la latencia de ejecución (media, máximo e histograma en clases de
+    LATENCY_BUCKETS_MS); para los lentos también la espera en cola.
+
+    Los plugins registran tipos nuevos con register(), también como decorador:
+
+        @node.handlers.register(40, slow=True)
+        def on_radar(packet): ...
+
+    slow=True sin lane usa el carril "slow"; add_lane() crea carriles nuevos.
+    """
+    def __init__(self, on_error=None, lanes=None, max_queue=16):
+        self.on_error = on_error
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.table = {}
+        self.lanes = {}                 # nombre -> (PacketDispatcher, reparto)
+        for name, (workers, key) in (lanes or DEFAULT_LANES).items():
+            self.add_lane(name, workers, key)
+
+    def add_lane(self, name: str, workers=1, key="src"):
+        """Carril de handlers lentos con 'workers' hilos, repartidos por emisor ("src") o por tipo ("type")."""
+        if key not in ("src", "type"):
+            raise ValueError(f"Reparto desconocido: {key}")
+        pool = PacketDispatcher(self._run_slow, workers=workers, max_queue=self.max_queue,
+                                name=f"lora-{name}")
+        with self.lock:
+            self.lanes[name] = (pool, key)
+        return pool
+
+    # ---------------------------
+    # REGISTRO
+    # ---------------------------
+    def register(self, msg_type: int, msg_id=None, fn=None, slow=False, name=None, lane=None):
+        """Registra fn para (msg_type, msg_id); sin fn devuelve un decorador."""
+        if fn is None:
+            def decorator(f):
+                self.register(msg_type, msg_id, f, slow, name, lane)
+                return f
+            return decorator
+        if lane is None and slow:
+            lane = "slow"
+        if lane is not None and lane not in self.lanes:
+            raise ValueError(f"Carril desconocido: {lane}")
+        if name is None:
+            name = getattr(fn, "__name__", "handler").lstrip("_")
+            name = f"{msg_type}/{'*' if msg_id is None else msg_id} {name}"
+        handler = Handler(fn, lane, name)
+        with self.lock:
+            self.table[(msg_type, msg_id)] = handler
+        return handler
+
+    def unregister(self, msg_type: int, msg_id=None):
+        with self.lock:
+            return self.table.pop((msg_type, msg_id), None)
+
+    def lookup(self, msg_type: int, msg_id: int):
+        with self.lock:
+            handler = self.table.get((msg_type, msg_id))
+            return handler if handler is not None else self.table.get((msg_type, None))
+
+    # ---------------------------
+    # EJECUCIÓN
+    # ---------------------------
+    def dispatch(self, packet) -> bool:
+        """Atiende el paquete; False si no hay handler para su tipo o su carril está lleno."""
+        handler = self.lookup(packet.msg_type, packet.msg_id)
+        if handler is None:
+            return False
+        if not handler.slow:
+            self._call(handler, packet)
+            return True
+        pool, key = self.lanes[handler.lane]
+        if not pool.submit(packet.src if key == "src" else packet.msg_type, (handler, packet, time.monotonic())):
+            with self.lock:
+                handler.dropped += 1
+            return False
+        return True
+
+    def _run_slow(self, item):
+        handler, packet, t_in = item
+        with self.lock:
+            handler.wait_sum += time.monotonic() - t_in
+        self._call(handler, packet)
+
+    def _call(self, handler, packet):
+        t = time.monotonic()
+        try:
+            handler.fn(packet)
+        except Exception as e:
+            with self.lock:
+                handler.errors += 1
+            if self.on_error is not None:
+                self.on_error(packet, e)
+            else:
+                print(f"[{time.strftime('%H:%M:%S')}] Error en el handler {handler.name}: {e}")
+        finally:
+            latency = time.monotonic() - t
+            with self.lock:
+                handler.calls += 1
+                handler.lat_sum += latency
+                handler.lat_max = max(handler.lat_max, latency)
+                handler.hist[bisect.bisect_left(LATENCY_BUCKETS_MS, latency * 1000)] += 1
+
+    # ---------------------------
+    # MÉTRICAS
+    # ---------------------------
+    @staticmethod
+    def _percentile(hist, q):
+        """Límite superior de la clase del histograma que contiene el percentil q."""
+        total = sum(hist)
+        if not total:
+            return None
+        acc = 0
+        for i, n in enumerate(hist):
+            acc += n
+            if acc >= q * total:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else float("inf")
+
+    def stats(self) -> dict:
+        """{nombre: {calls, errors, dropped, slow, lane, lat_avg_ms, lat_max_ms, p95_ms, wait_avg_ms, hist}}"""
+        with self.lock:
+            handlers = list(self.table.values())
+            view = {}
+            for h in handlers:
+                if not h.calls and not h.dropped:
+                    continue
+                view[h.name] = {
+                    "calls": h.calls,
+                    "errors": h.errors,
+                    "dropped": h.dropped,
+                    "slow": h.slow,
+                    "lane": h.lane,
+                    "lat_avg_ms": round(1000 * h.lat_sum / h.calls, 1) if h.calls else 0.0,
+                    "lat_max_ms": round(1000 * h.lat_max, 1),
+                    "p95_ms": self._percentile(h.hist, 0.95),
+                    "wait_avg_ms": round(1000 * h.wait_sum / h.calls, 1) if h.slow and h.calls else None,
+                    "hist": list(h.hist),
+                }
+        return view
+
+    def lane_stats(self) -> dict:
+        """{carril: estadísticas de su PacketDispatcher}"""
+        with self.lock:
+            lanes = dict(self.lanes)
+        return {name: pool.stats() for name, (pool, _) in lanes.items()}
+
+    def stop(self):
+        with self.lock:
+            lanes = list(self.lanes.values())
+        for pool, _ in lanes:
+            pool.stop()
@@ -0,0 +1,116 @@
+import struct
+
+# Cabecera de 7 bytes de todos los paquetes LoRa:
+#   destino (2) | origen (2) | flags (1) | relé << 7 | tipo (1) | msg_id (1)
+# flags: bit 0 datos binarios, bit 1 parte intermedia, bit 2 subcabecera de
+# fragmento, bits 3-4 saltos (MeshRouter), bits 5-7 secuencia (TxScheduler)
+HEADER = struct.Struct(">HHBBB")
+HEADER_SIZE = HEADER.size
+ADDRESSES = struct.Struct(">HH")
+
+FLAG_BYTES = 0x01
+FLAG_PART = 0x02
+FLAG_FRAG = 0x04
+
+MAX_FRAME = 242         # lo que acepta el módulo en un paquete
+
+# Cabecera de 6 bytes de los primeros programas (pc_EB_gui_lora.py / lora_to_robot.py):
+#   destino (2) | origen (2) | tipo (1) | msg_id (1)
+LEGACY_HEADER = struct.Struct(">HHBB")
+
+
+def make_flags(is_b=False, part=0, frag=False) -> int:
+    return (FLAG_BYTES if is_b else 0) | (FLAG_PART if part else 0) | (FLAG_FRAG if frag else 0)
+
+
+def encode(dest: int, src: int, msg_type: int, msg_id: int, payload: bytes, flags: int = 0, relay: int = 0):
+    """Paquete completo en un único bytearray, o None si no cabe en MAX_FRAME."""
+    size = HEADER_SIZE + len(payload)
+    if size > MAX_FRAME:
+        return None
+    buf = bytearray(size)
+    encode_into(buf, 0, dest, src, msg_type, msg_id, payload, flags, relay)
+    return buf
+
+
+def encode_into(buf, offset: int, dest: int, src: int, msg_type: int, msg_id: int, payload: bytes,
+                flags: int = 0, relay: int = 0) -> int:
+    """Escribe cabecera y datos en un buffer ya reservado; devuelve los bytes escritos."""
+    HEADER.pack_into(buf, offset, dest & 0xFFFF, src & 0xFFFF, flags & 0xFF,
+                     ((relay & 0x01) << 7) | (msg_type & 0x7F), msg_id & 0xFF)
+    end = offset + HEADER_SIZE + len(payload)
+    buf[offset + HEADER_SIZE:end] = payload
+    return end - offset
+
+
+def addresses(frame) -> tuple:
+    """(destino, origen) sin copiar el paquete."""
+    return ADDRESSES.unpack_from(frame)
+
+
+class Packet:
+    """
+    Vista de un paquete recibido. La cabecera se lee del buffer con
+    unpack_from, sin copias; los datos son un memoryview y el texto sólo se
+    decodifica (una vez) si se pide, así que los fragmentos binarios nunca
+    pasan por str.
+    """
+    __slots__ = ("frame", "dest", "src", "flags", "msg_type", "relay", "msg_id", "_text")
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.dest, self.src, self.flags, type_byte, self.msg_id = HEADER.unpack_from(frame)
+        self.msg_type = type_byte & 0x7F
+        self.relay = type_byte >> 7
+        self._text = None
+
+    # Mismos valores que devolvía unpack_message (máscaras sin desplazar)
+    @property
+    def is_b(self) -> int:
+        return self.flags & FLAG_BYTES
+
+    @property
+    def part(self) -> int:
+        return self.flags & FLAG_PART
+
+    @property
+    def frag(self) -> int:
+        return self.flags & FLAG_FRAG
+
+    @property
+    def payload(self) -> memoryview:
+        return memoryview(self.frame)[HEADER_SIZE:]
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = str(self.payload, "utf-8", "ignore")
+        return self._text
+
+    @property
+    def message(self):
+        """Texto si el paquete es de texto; bytes si es binario."""
+        return bytes(self.payload) if self.is_b else self.text
+
+    def __len__(self):
+        return len(self.frame)
+
+
+def decode(frame):
+    """Packet, o None si el paquete no llega a la cabecera."""
+    if len(frame) < HEADER_SIZE:
+        return None
+    return Packet(frame)
+
+
+def encode_legacy(dest: int, src: int, msg_type: int, msg_id: int, payload: bytes) -> bytearray:
+    buf = bytearray(LEGACY_HEADER.size + len(payload))
+    LEGACY_HEADER.pack_into(buf, 0, dest & 0xFFFF, src & 0xFFFF, msg_type & 0xFF, msg_id & 0xFF)
+    buf[LEGACY_HEADER.size:] = payload
+    return buf
+
+
+def decode_legacy(frame) -> tuple:
+    """(destino, origen, tipo, msg_id, datos como memoryview)."""
+    dest, src, msg_type, msg_id = LEGACY_HEADER.unpack_from(frame)
+    return dest, src, msg_type, msg_id, memoryview(frame)[LEGACY_HEADER.size:]
@@ -0,0 +1,166 @@
+import statistics
+import threading
+import time
+from collections import deque
+
+from NodoLoRa.MeshRouter import frame_hops
+from NodoLoRa.TxScheduler import SEQ_MOD, SEQ_SHIFT
+
+LINK_PREFIX = "Link:"
+
+
+class Neighbour:
+    def __init__(self, history):
+        self.rssi = deque(maxlen=history)       # RSSI de cada paquete (dBm)
+        self.gaps = deque(maxlen=history)       # paquetes perdidos antes de cada recibido
+        self.seq = None
+        self.received = 0
+        self.lost = 0
+        self.last_heard = 0.0
+
+
+class LinkStats:
+    """
+    Calidad del enlace con cada vecino, sobre los últimos 'history' paquetes.
+
+      - RSSI: lo añade el módulo a cada paquete y la radio lo separa (frame.rssi).
+      - Ruido del canal: se lee del módulo cada 'noise_period' segundos si la
+        radio lo permite (get_channel_rssi); SNR aproximada = RSSI - ruido.
+      - Pérdidas: cada nodo numera lo que transmite con una secuencia de 3 bits
+        en los flags de la cabecera (TxScheduler), así que un salto en la
+        secuencia de un vecino son paquetes suyos perdidos. Rachas de 8 o más
+        pérdidas seguidas se cuentan módulo 8. Los paquetes que llegan
+        reenviados por un relé no cuentan: no son del enlace con el origen.
+      - RTT: el suavizado de las peticiones con respuesta (RequestTracker).
+
+    node: LoRaNode (node.node es la radio y node.requests el RequestTracker).
+    """
+    def __init__(self, node, history=50, noise_period=60.0):
+        self.node = node
+        self.history = history
+        self.noise_period = noise_period
+        self.lock = threading.Lock()
+        self.neighbours = {}        # addr -> Neighbour
+        self.noise = deque(maxlen=10)
+        self.running = True
+
+    def start(self):
+        if hasattr(self.node.node, "get_channel_rssi") and getattr(self.node.node, "can_configure", False):
+            threading.Thread(target=self._noise_loop, name="lora-noise", daemon=True).start()
+
+    # ---------------------------
+    # MUESTRAS
+    # ---------------------------
+    def observe(self, addr, frame):
+        """Paquete recibido de addr: RSSI (si lo trae) y secuencia de transmisión."""
+        if len(frame) > 4 and frame_hops(frame) > 0:
+            return
+        rssi = getattr(frame, "rssi", None)
+        seq = (frame[4] >> SEQ_SHIFT) % SEQ_MOD if len(frame) > 4 else None
+        with self.lock:
+            n = self.neighbours.get(addr)
+            if n is None:
+                n = self.neighbours[addr] = Neighbour(self.history)
+            if rssi is not None:
+                n.rssi.append(rssi)
+            if seq is not None:
+                gap = 0 if n.seq is None else (seq - n.seq - 1) % SEQ_MOD
+                n.seq = seq
+                n.gaps.append(gap)
+                n.lost += gap
+            n.received += 1
+            n.last_heard = time.monotonic()
+
+    def sample_noise(self):
+        reading = self.node.node.get_channel_rssi()
+        if reading is not None:
+            with self.lock:
+                self.noise.append(reading[0])
+
+    def _noise_loop(self):
+        while self.running and self.node.running:
+            try:
+                self.sample_noise()
+            except Exception as e:
+                print(f"[{time.strftime('%H:%M:%S')}] Error leyendo el ruido del canal: {e}")
+            time.sleep(self.noise_period)
+
+    # ---------------------------
+    # CONSULTA
+    # ---------------------------
+    def noise_floor(self):
+        with self.lock:
+            return round(statistics.median(self.noise)) if self.noise else None
+
+    def snapshot(self) -> dict:
+        """
+        {addr: {"rssi", "snr", "loss", "rtt", "received", "lost", "age"}}
+        rssi: media (dBm); snr: rssi - ruido (dB); loss: fracción perdida en la
+        ventana; rtt: RTT suavizado (s); age: segundos desde el último paquete.
+        """
+        noise = self.noise_floor()
+        now = time.monotonic()
+        view = {}
+        with self.lock:
+            for addr, n in self.neighbours.items():
+                rssi = round(statistics.mean(n.rssi), 1) if n.rssi else None
+                lost = sum(n.gaps)
+                view[addr] = {
+                    "rssi": rssi,
+                    "snr": None if rssi is None or noise is None else round(rssi - noise, 1),
+                    "loss": round(lost / (lost + len(n.gaps)), 3) if n.gaps else None,
+                    "rtt": None,
+                    "received": n.received,
+                    "lost": n.lost,
+                    "age": round(now - n.last_heard, 1),
+                }
+        for addr, v in view.items():
+            v["rtt"] = self.node.requests.link_stats(addr)["srtt"]
+        return view
+
+    def compact(self, max_len=200) -> str:
+        """
+        Resumen en texto para el comando de estado (msg_type 8):
+            Link:n<ruido>|<addr>:<rssi>,<snr>,<pérdida %>,<rtt ms>|...
+        Los campos sin datos van como '-'. Los vecinos oídos más recientemente
+        van primero y se omiten los que no caben en max_len.
+        """
+        noise = self.noise_floor()
+        out = f"{LINK_PREFIX}n{'-' if noise is None else noise}"
+        stats = sorted(self.snapshot().items(), key=lambda kv: kv[1]["age"])
+        for addr, s in stats:
+            fields = (
+                "-" if s["rssi"] is None else round(s["rssi"]),
+                "-" if s["snr"] is None else round(s["snr"]),
+                "-" if s["loss"] is None else round(s["loss"] * 100),
+                "-" if s["rtt"] is None else round(s["rtt"] * 1000),
+            )
+            item = f"|{addr}:" + ",".join(str(f) for f in fields)
+            if len(out) + len(item) > max_len:
+                break
+            out += item
+        return out
+
+    def stop(self):
+        self.running = False
+
+
+def parse_compact(text: str) -> dict:
+    """Inverso de LinkStats.compact: {"noise": dBm, "links": {addr: {"rssi", "snr", "loss", "rtt"}}}."""
+    def num(s):
+        return None if s in ("", "-") else int(s)
+
+    parts = text[len(LINK_PREFIX):].split("|") if text.startswith(LINK_PREFIX) else []
+    if not parts:
+        return {"noise": None, "links": {}}
+    links = {}
+    for item in parts[1:]:
+        addr, _, fields = item.partition(":")
+        rssi, snr, loss, rtt = (fields.split(",") + ["-"] * 4)[:4]
+        links[int(addr)] = {
+            "rssi": num(rssi),
+            "snr": num(snr),
+            "loss": None if num(loss) is None else num(loss) / 100,
+            "rtt": None if num(rtt) is None else num(rtt) / 1000,
+        }
+    return {"noise": num(parts[0][1:]), "links": links}
@@ -0,0 +1,77 @@
+import random
+import threading
+import time
+
+from NodoLoRa.TxScheduler import LORA_OVERHEAD_BYTES, PRIO_ACK, PRIO_BULK, PRIO_CONTROL, PRIO_TELEMETRY
+
+# Por prioridad: (exponente máximo del backoff, escuchas antes de transmitir igualmente)
+BACKOFF_CAPS = {
+    PRIO_CONTROL: (1, 2),       # seguridad: como mucho ~4 unidades de espera
+    PRIO_ACK: (3, 4),
+    PRIO_TELEMETRY: (5, 6),
+    PRIO_BULK: (6, 8),
+}
+
+
+class ListenBeforeTalk:
+    """
+    Escucha antes de transmitir (CSMA) con backoff exponencial binario.
+
+    Antes de cada paquete se pregunta a la radio si el canal está ocupado
+    (radio.channel_busy: ruido del canal por encima de 'threshold' dBm o un
+    paquete llegando). Si lo está, se espera un tiempo aleatorio entre una
+    unidad y 2^k unidades, con k creciendo en cada intento hasta el tope de la
+    prioridad; agotadas las escuchas el paquete sale igualmente, así que los
+    mensajes de control nunca se retrasan más de unas pocas unidades. La
+    unidad es el tiempo en el aire de un paquete corto a la velocidad actual.
+
+    Cuenta las esperas (deferrals), los paquetes enviados con el canal ocupado
+    (forced) y, si la radio lo sabe (VirtualRadio), los que colisionaron.
+    """
+    def __init__(self, radio, threshold=-100.0, caps=None, unit_bytes=16):
+        self.radio = radio
+        self.threshold = threshold
+        self.caps = caps or BACKOFF_CAPS
+        self.unit_bytes = unit_bytes
+        self.lock = threading.Lock()
+        self.checks = 0
+        self.deferrals = [0, 0, 0, 0]
+        self.forced = 0
+        self.backoff_s = 0.0
+
+    def unit(self) -> float:
+        return (self.unit_bytes + LORA_OVERHEAD_BYTES) * 8 / getattr(self.radio, "air_speed", 2400)
+
+    def wait_clear(self, prio: int) -> bool:
+        """Espera a que el canal esté libre. Devuelve False si se agotan las escuchas."""
+        cap, attempts = self.caps.get(prio, self.caps[PRIO_TELEMETRY])
+        for attempt in range(attempts):
+            try:
+                busy = self.radio.channel_busy(self.threshold)
+            except Exception as e:
+                print(f"[{time.strftime('%H:%M:%S')}] LBT: no se pudo leer el canal: {e}")
+                return True
+            with self.lock:
+                self.checks += 1
+                if busy:
+                    self.deferrals[prio] += 1
+            if not busy:
+                return True
+            unit = self.unit()
+            wait = random.uniform(unit, unit * 2 ** min(attempt + 1, cap))
+            with self.lock:
+                self.backoff_s += wait
+            time.sleep(wait)
+        with self.lock:
+            self.forced += 1
+        return False
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "checks": self.checks,
+                "deferrals": list(self.deferrals),
+                "forced": self.forced,
+                "backoff_s": round(self.backoff_s, 2),
+                "collisions": getattr(self.radio, "collisions", None),
+            }
@@ -11,6 +11,8 @@ import queue
 import time
 import threading
 import platform
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import base64
 from bson import Timestamp
 from matplotlib.pylab import f
@@ -28,23 +30,101 @@ from BBDDv2.db_SQLite import RobotDatabase
 from BBDDv2.NodeSyncManager import NodeSyncManager
 from BBDDv2.EBSyncManager import BaseStationSyncManager
 from BBDDv2.db_mongo import BaseStationDatabase
+from BBDDv2.SyncCodec import encode_ack
+from BBDDv2.StorageManager import StorageManager
 from NodoLoRa.sx126x_bis import sx126x
+from NodoLoRa.PacketDispatcher import PacketDispatcher
+from NodoLoRa.HandlerRegistry import HandlerRegistry
+from NodoLoRa.AsyncRuntime import AsyncRuntime
+from NodoLoRa.FragmentManager import FragmentManager
+from NodoLoRa.RequestTracker import RequestTracker, ReplyCache
+from NodoLoRa.NodeLiveness import NodeLiveness
+from NodoLoRa.TxScheduler import TxScheduler, PRIO_CONTROL, PRIO_ACK, PRIO_TELEMETRY, PRIO_BULK
+from NodoLoRa.AdaptiveDataRate import AdaptiveDataRate
+from NodoLoRa.LinkStats import LinkStats, LINK_PREFIX, parse_compact
+from NodoLoRa.MeshRouter import MeshRouter, frame_hops
+from NodoLoRa.TdmaScheduler import TdmaScheduler
+from NodoLoRa.ListenBeforeTalk import ListenBeforeTalk
+from NodoLoRa.HeaderCodec import addresses, decode, encode, make_flags
+from NodoLoRa.RadioGroup import RadioGroup, ChannelFollower, CHANNEL_MOVE, CHANNEL_ACK
 from parameters import *
 from Multimediav1.LoraCamSender import LoRaCamSender
 
+# Lo que puede tardar el robot en responder por el puerto serie (send_to_robot)
+ROBOT_TIMEOUT = 5.0
+# Plazo de las peticiones antes de reintentar: por encima del peor caso del robot
+REQUEST_TIMEOUT = ROBOT_TIMEOUT + 3.0
+
 class LoRaNode:
     def __init__(self, ser_port, addr, freq=433, pw=0, rssi=True, 
-                 EB=0, robot_port=None, robot_baudrate=None, ip_sock=None, port_sock=None, sens_port=None, sens_baudrate=None):  # EB = 1 si es estación base
-        
+                 EB=0, robot_port=None, robot_baudrate=None, ip_sock=None, port_sock=None, sens_port=None, sens_baudrate=None,
+                 duty_cycle=1.0, radio=None, data_dir=None, db_base=None,
+                 air_speed=2400, uart_baud=9600, m0_pin=None, m1_pin=None, adr=False, tdma=False, lbt=False,
+                 extra_radios=None, plugins=None, storage_budgets=None, base_addr=0):  # EB = 1 si es estación base
+        """
+        radio: transporte LoRa ya creado (p. ej. VirtualChannel.radio()); si es None se abre el sx126x en ser_port
+        air_speed, uart_baud, m0_pin, m1_pin: configuración del módulo (sólo se programa si hay pines M0/M1)
+        adr: velocidad en el aire adaptativa (requiere poder reconfigurar el módulo en todos los nodos)
+        tdma: (EB) difundir balizas con el mapa de ranuras; los robots las siguen al recibirlas
+        lbt: escuchar el canal antes de transmitir, con backoff exponencial (y LBT del propio módulo)
+        extra_radios: (EB) más radios en otros canales: transportes ya creados o tuplas (puerto, freq);
+                      los robots se reparten entre ellas por carga
+        plugins: funciones plugin(node) que registran sus tipos de mensaje con node.handlers.register
+        data_dir: carpeta de la BBDD local del nodo (por defecto ./datos junto al script)
+        storage_budgets: (robot) bytes de disco por categoría {"photos", "videos", "db"} (StorageManager)
+        db_base: BBDD de la EB; si es None se conecta a MongoDB en run()
+        base_addr: (robot) dirección de la EB a la que se sincroniza la BBDD; se actualiza con sus pings
+        """
         self.running = True
         self.lora_port = ser_port
-        self.node = sx126x(serial_num=ser_port, freq=freq, addr=addr, power=pw, rssi=rssi)
+        self.node = radio if radio is not None else sx126x(serial_num=ser_port, freq=freq, addr=addr, power=pw, rssi=rssi,
+                                                           air_speed=air_speed, uart_baud=uart_baud, m0=m0_pin, m1=m1_pin, lbt=lbt)
         print(f"LoRaNode initialized on {ser_port} with address {addr}, freq {freq}MHz, power {pw}dBm")
-        self.pending_requests = {}                                  # msg_id -> callback/event
-        self.lock_pending = threading.Lock()
+        self.radios = [self.node]
+        for extra in extra_radios or []:
+            if isinstance(extra, tuple):
+                port, extra_freq = extra
+                extra = sx126x(serial_num=port, freq=extra_freq, addr=addr, power=pw, rssi=rssi,
+                               air_speed=air_speed, uart_baud=uart_baud, lbt=lbt)
+            self.radios.append(extra)
+        # Cola de transmisión con prioridades y control de duty-cycle (una por radio en la EB multi-radio)
+        if EB and len(self.radios) > 1:
+            self.tx = RadioGroup(self, self.radios, duty_cycle=duty_cycle)
+        else:
+            self.tx = TxScheduler(self.node, duty_cycle=duty_cycle)
+        if lbt:
+            for tx in getattr(self.tx, "schedulers", [self.tx]):
+                tx.access = ListenBeforeTalk(tx.radio)
+        # Transferencias de ficheros por fragmentos con repetición selectiva
+        self.fragments = FragmentManager(self, on_complete=self._on_transfer_complete)
+        # Peticiones pendientes de respuesta: (destino, msg_id) -> plazo, reintentos y Future
+        self.requests = RequestTracker(initial_rto=REQUEST_TIMEOUT, on_alert=lambda msg: self.on_alert(msg))
+        # Comandos ya atendidos: los reintentos de la EB no se ejecutan dos veces
+        self.replies = ReplyCache()
+        # Historial de RSSI por nodo y cambio negociado de velocidad en el aire
+        self.adr = AdaptiveDataRate(self, default_speed=air_speed)
+        self.adr_enabled = adr
+        # Calidad del enlace por vecino: RSSI, ruido, pérdidas y RTT
+        self.links = LinkStats(self)
+        # Rutas, caché de paquetes vistos y reenvío en modo relé
+        self.router = MeshRouter(self)
+        # Ranuras de tiempo coordinadas por la EB: el planificador sólo transmite en las propias.
+        # Con varias radios, una supertrama por radio con los robots que la usan
+        self.tdma = TdmaScheduler(self)
+        self.tdmas = [self.tdma]
+        if isinstance(self.tx, RadioGroup):
+            self.tdma.owns = lambda a: self.tx.radio_of(a) == 0
+            for idx, tx in enumerate(self.tx.schedulers[1:], 1):
+                self.tdmas.append(TdmaScheduler(self, radio=tx.radio, owns=lambda a, idx=idx: self.tx.radio_of(a) == idx))
+        for tdma_radio, tx in zip(self.tdmas, getattr(self.tx, "schedulers", [self.tx])):
+            tdma_radio.enabled = bool(tdma and EB)
+            tx.gate = tdma_radio.wait_time
+        # Cambio de canal pedido por una EB con varias radios
+        self.channels = ChannelFollower(self)
         self.robot = None
         self.is_base = EB  # External Board reference
         self.is_relay = False
+        self.base_addr = base_addr
 
         self.addr = addr
         self.freq = freq
@@ -53,6 +133,12 @@ class LoRaNode:
         self.robot_port = robot_port
         self.robot_baudrate = robot_baudrate
         self.response_queue = queue.Queue()
+        # Pool fijo de hilos para procesar paquetes, en orden por emisor
+        self.dispatcher = PacketDispatcher(self.processing_loop, workers=4, max_queue=64)
+        # Handlers por (msg_type, msg_id); los lentos van a su propio pool
+        self.handlers = HandlerRegistry(on_error=self._on_handler_error)
+        self._register_handlers()
+        self.runtime = None         # AsyncRuntime si run(use_asyncio=True)
         
         self.sensores = None
         self.sens_port = sens_port
@@ -64,10 +150,18 @@ class LoRaNode:
         self.ip_sock = ip_sock
         self.port_sock = port_sock
 
+        self.data_dir = data_dir or os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "datos")
+        self.storage_budgets = storage_budgets
+        self.storage = None         # StorageManager del robot, se crea en run()
+        self.db_base = db_base
+
         if self.is_base:
             self.lock_nodes = threading.Lock()
-            self.connected_nodes = {}
-            self.node_timers = {}
+            # Nodos vivos: caducan a los 60 s sin responder al ping (un único hilo)
+            self.liveness = NodeLiveness(timeout=60.0, lock=self.lock_nodes,
+                                         on_alert=lambda msg: self.on_alert(msg))
+            self.connected_nodes = self.liveness.nodes
+            self.remote_links = {}      # addr -> última respuesta a msg_type 8 (parse_compact)
             self.photo = None
             self.temp_mes = None
             self.hum_mes = None
@@ -106,8 +200,6 @@ class LoRaNode:
             self.camera = None
             self.stream = None
 
-        self.stop_send = False
-
         self.auto_move_running = False
         self.detect_collisions_running = False
 
@@ -127,485 +219,629 @@ class LoRaNode:
         self.on_collision = lambda: print(f"[OBJECT DETECTED]")
         self.on_overturn = lambda vuelco: print(f"[OVERTURN] : {vuelco}")
 
+        for plugin in plugins or []:
+            plugin(self)
+
     # -------------------- MENSAJES --------------------
     def pack_message(self, addr_dest:int, msg_type: int, msg_id: int, message: str, relay_flag: int =0) -> bytes:
-        offset_freq = self.freq - 410 # assuming base freq is 410MHz
-        header = bytes([
-            (addr_dest >> 8) & 0xFF, addr_dest & 0xFF,
-            (self.addr >> 8) & 0xFF, self.addr & 0xFF,
-            (0x00),
-            (relay_flag << 7) | (msg_type & 0x7F),
-            msg_id & 0xFF
-        ])
-        print(f"Message size: {len(message.encode())} / Total size: {len(header) + len(message.encode())} bytes")
-        if len(header) + len(message.encode()) > 242:
+        frame = encode(addr_dest, self.addr, msg_type, msg_id, message.encode(), 0, relay_flag)
+        if frame is None:
             print("⚠️ Message too long to pack in just a LoRa packet.")
-            return
-        return header + message.encode()
+        return frame
     
-    def pack_bytes(self, addr_dest:int, msg_type: int, msg_id: int, data: bytes, relay_flag: int = 0, part: int = 0) -> bytes:
-        offset_freq = self.freq - 410 # assuming base freq is 410MHz
-        header = bytes([
-            (addr_dest >> 8) & 0xFF, addr_dest & 0xFF,
-            (self.addr >> 8) & 0xFF, self.addr & 0xFF,
-            (0x01 if part == 0 else 0x03),
-            (relay_flag << 7) | (msg_type & 0x7F),
-            msg_id & 0xFF
-        ])
-        print(f"Bytes size: {len(data)} / Total size: {len(header) + len(data)} bytes")
-        if len(header) + len(data) > 242:
+    def pack_bytes(self, addr_dest:int, msg_type: int, msg_id: int, data: bytes, relay_flag: int = 0, part: int = 0, frag: bool = False) -> bytes:
+        frame = encode(addr_dest, self.addr, msg_type, msg_id, data, make_flags(True, part, frag), relay_flag)
+        if frame is None:
             print("⚠️ Data too long to pack in just a LoRa packet.")
-            return
-        return header + data
+        return frame
 
     def unpack_message(self, r_buff: bytes) -> tuple:
-        if len(r_buff) < 7:
+        packet = decode(r_buff)
+        if packet is None:
             print(f"⚠️ Paquete recibido demasiado corto: len={len(r_buff)} -> {r_buff}")
             self.on_alert(f"[{time.strftime('%H:%M:%S')}] Paquete recibido demasiado corto")
             return None
-        
-        if self.stop_send:
-            print("⚠️ Receiving paused, message not processed.")
-            return None
-        
-        addr_dest = (r_buff[0] << 8) + r_buff[1]
-        addr_sender = (r_buff[2] << 8) + r_buff[3]
-        part = r_buff[4] & 0x02
-        is_b = r_buff[4] & 0x01
-        msg_type = r_buff[5] & 0x7F
-        relay_flag = r_buff[5] >> 7
-        msg_id = r_buff[6]
-        if is_b == 0:
-            message = r_buff[7:].decode(errors='ignore')
-        else:   
-            message = r_buff[7:] 
-
-        if is_b == 0:
-            print(f"Unpacked message: from {addr_sender} to {addr_dest}, type {msg_type}, id {msg_id}, relay {relay_flag}, msg: {message}")
+        return (packet.src, packet.dest, packet.msg_type, packet.msg_id, packet.relay, packet.message,
+                packet.part, packet.is_b, packet.frag)
+
+    # -------------------- HILOS --------------------
+    def send_ping(self):
+        """Ping de difusión; con TDMA lleva la baliza, que se construye al salir (una por radio)."""
+        if self.is_base and self.tdma.enabled:
+            for tdma_radio, tx in zip(self.tdmas, getattr(self.tx, "schedulers", [self.tx])):
+                tx.submit_stream(tdma_radio.beacon_frames(), self.tx_priority(5, 0))
         else:
-            print(f"Unpacked bytes: from {addr_sender} to {addr_dest}, type {msg_type}, id {msg_id}, relay {relay_flag}, part {part}, is_b {is_b}, bytes length: {len(message)}")
+            self.send_message(0xFFFF, 5, 0, "", 0)
 
-        return addr_sender, addr_dest, msg_type, msg_id, relay_flag, message, part, is_b
+    def status_step(self):
+        self.send_ping()
+        self.on_alert(f"[{time.strftime('%H:%M:%S')}] PING enviado")
 
-    # -------------------- HILOS --------------------
     def periodic_status(self):
         while self.running:
-            self.send_message(0xFFFF, 5, 0, "", 0)
-            self.on_alert(f"[{time.strftime('%H:%M:%S')}] PING enviado")
+            self.status_step()
             time.sleep(40) # intervalos de 40 segundos entre envío y envío
 
-    def send_message(self, addr_dest: int, msg_type: int, msg_id: int, message: str, relay_flag: int = 0, callback=None):
-        if self.stop_send:
-            print("⚠️ Sending paused, message not sent.")
-            return
+    def tx_priority(self, msg_type: int, msg_id: int) -> int:
+        """Clase de prioridad de transmisión según el tipo de mensaje."""
+        if msg_type in (7, 9) or 9 < msg_type < 20 or (msg_type == 0 and msg_id == 50):
+            return PRIO_CONTROL        # stop, configuración de radio, comandos al robot, colisión
+        if 0 < msg_type < 5 or (msg_type == 0 and msg_id == 21):
+            return PRIO_ACK            # respuestas y ACKs de BBDD
+        if msg_type == 0 and msg_id in (20, 30):
+            return PRIO_BULK           # sincronización BBDD e imágenes
+        return PRIO_TELEMETRY
+
+    def send_message(self, addr_dest: int, msg_type: int, msg_id: int, message: str, relay_flag: int = 0, callback=None, priority=None):
+        """
+        Encola un mensaje. En la EB, si el mensaje espera respuesta, devuelve un
+        Future que se completa con la respuesta (o con TimeoutError si se agotan
+        los reintentos); 'callback' se añade a ese Future.
+        """
         data = self.pack_message(addr_dest, msg_type, msg_id, message, relay_flag)
         if data is None:
             return
-        self.node.send_bytes(data)
-        if self.is_base and addr_dest != 0xFFFF:
-            self.add_pending(addr_dest, msg_id)
+        if priority is None:
+            priority = self.tx_priority(msg_type, msg_id)
+        self.tx.submit(data, priority)
+        if not self.is_base and 0 < msg_type < 6:
+            # Respuesta a un comando: se guarda por si llega un reintento
+            self.replies.record(addr_dest, msg_id, (data, priority))
+        if self.is_base and addr_dest != 0xFFFF and 4 < msg_type and msg_type not in (20, 23, 24, 31):
+            # Comandos de cámara: la respuesta llega tras capturar/enviar, sin reintentos.
+            # Comandos al robot: plazo fijo por encima de lo que tarda el puerto serie
+            # (el RTO medido con pings puede quedarse muy por debajo)
+            if 24 < msg_type < 31:
+                retries, timeout = 0, 60.0
+            elif 9 < msg_type < 20:
+                retries, timeout = None, REQUEST_TIMEOUT
+            else:
+                retries, timeout = None, None
+            future = self.add_pending(addr_dest, msg_id, resend=lambda: self.tx.submit(data, priority),
+                                      retries=retries, timeout=timeout)
+            if callback is not None:
+                future.add_done_callback(callback)
+            return future
+
+    def send_data(self, addr_dest: int, msg_type: int, msg_id: int, data: bytes, relay_flag: int = 0, priority=None):
+        """Envía bytes que caben en un único paquete."""
+        packed_data = self.pack_bytes(addr_dest, msg_type, msg_id, data, relay_flag)
+        if packed_data is None:
+            return
+        if priority is None:
+            priority = self.tx_priority(msg_type, msg_id)
+        self.tx.submit(packed_data, priority)
 
     def send_bytes(self, addr_dest: int, msg_type: int, msg_id: int, path: str, relay_flag: int = 0, callback=None):
-        self.stop_send = True
+        """
+        Envía un fichero fragmentado con repetición selectiva. Los fragmentos los
+        espacia el planificador de transmisión según su tiempo en el aire, y el
+        receptor pide por NACK sólo los que le falten.
+        """
         with open(path, "rb") as f:
             data = f.read()
-            while len(data) > 200:
-                chunk = data[:200]
-                data = data[200:]
-                part = 1
-                packed_data = self.pack_bytes(addr_dest, msg_type, msg_id, chunk, relay_flag, part)
-                if packed_data is None:
-                    return
-                self.node.send_bytes(packed_data)
-                time.sleep(2)  # pequeño retardo entre fragmentos
-            part = 0
-            packed_data = self.pack_bytes(addr_dest, msg_type, msg_id, data, relay_flag, part)
-            self.node.send_bytes(packed_data)
-            self.stop_send = False
-        # packed_data = self.pack_bytes(addr_dest, msg_type, msg_id, data, relay_flag)
-        # self.node.send_bytes(packed_data)
-        # if self.is_base and addr_dest != 0xFFFF:
-        #     self.add_pending(addr_dest, msg_id)
-
-    def receive_loop(self):
-        while self.running:
-            msg = self.node.receive_bytes()
-            if not msg:
-                time.sleep(0.05)
-                continue
-            threading.Thread(target=self.processing_loop, args=(msg,), daemon=True).start()
+        return self.fragments.send(addr_dest, msg_type, msg_id, data, relay_flag)
 
-    def processing_loop(self, msg):
+    def _on_transfer_complete(self, addr_sender, msg_type, msg_id, data: bytes):
+        """Fichero completo reensamblado por el FragmentManager."""
+        if msg_type == 0 and msg_id == 30:
             try:
-                addr_sender, addr_dest, msg_type, msg_id, relay_flag, message, part, is_b = self.unpack_message(msg)
+                save_dir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "multi_socket")
+                os.makedirs(save_dir, exist_ok=True)
+                img = Image.open(io.BytesIO(data))
+                final_filename = f"photo_from_{addr_sender}_{int(time.time())}.jpg"
+                final_path = os.path.join(save_dir, final_filename)
+                img.save(final_path)
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Foto guardada en {final_path}.")
+                self.on_img(final_path)
             except Exception as e:
-                print(f"Error unpacking message: {e}")
-                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error unpacking message")
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error decodificando foto: {e}")
+
+    def relay(self, msg, addr_sender, addr_dest, msg_type, msg_id):
+        """Reenvía el paquete tal cual si el router lo encamina por este nodo."""
+        frame = self.router.forward(msg)
+        if frame is None:
+            return
+        print(f"Relaying message from {addr_sender} to {addr_dest}")
+        self.on_alert(f"[{time.strftime('%H:%M:%S')}] Relaying message from {addr_sender} to {addr_dest}")
+        self.tx.submit(frame, self.tx_priority(msg_type, msg_id), stamp=False)
+
+    def receive_loop(self, radio=None):
+        """Un hilo por radio; todos entregan al mismo dispatcher."""
+        radio = radio or self.node
+        while self.running:
+            # receive_frames bloquea como mucho el hueco entre paquetes, y puede
+            # devolver varios paquetes si llegaron seguidos. La radio ya ha separado
+            # el byte de RSSI del paquete (msg.rssi)
+            self.handle_frames(radio, radio.receive_frames())
+
+    def handle_frames(self, radio, frames, wait=True):
+        """Paquetes recibidos por una radio (hilo de recepción o AsyncRuntime)."""
+        group = self.tx if isinstance(self.tx, RadioGroup) else None
+        for msg in frames:
+            addr_sender = addresses(msg)[1] if len(msg) >= 4 else 0
+            if len(msg) >= 7:
+                if group is not None:
+                    group.on_receive(radio, addr_sender, len(msg))
+                # Copias de un mismo paquete llegadas por varios relés
+                if not self.router.accept(msg):
+                    continue
+                relayed = frame_hops(msg) > 0
+                self.links.observe(addr_sender, msg)
+                if radio is self.node:
+                    self.adr.observe(addr_sender, None if relayed else getattr(msg, "rssi", None))
+                else:
+                    self.adr.forget(addr_sender)    # el ADR sólo reconfigura la radio principal
+            self.dispatcher.submit(addr_sender, msg, wait=wait)
+
+    def processing_loop(self, msg):
+            packet = decode(msg)
+            if packet is None:
+                print(f"⚠️ Paquete recibido demasiado corto: len={len(msg)} -> {msg}")
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Paquete recibido demasiado corto")
                 return
-            if is_b == 0:
-                print(f"[{time.strftime('%H:%M:%S')}] Received from {addr_sender}: {message}")
-            else:
-                print(f"[{time.strftime('%H:%M:%S')}] Received bytes from {addr_sender}: {message}")
-            
+            addr_sender, addr_dest = packet.src, packet.dest
+            shown = packet.text if packet.is_b == 0 else f"{len(packet.payload)} bytes"
+            print(f"[{time.strftime('%H:%M:%S')}] Received from {addr_sender}: {shown}")
+
+            if self.is_relay:
+                self.relay(msg, addr_sender, addr_dest, packet.msg_type, packet.msg_id)
             if addr_dest != self.addr and addr_dest != 0xFFFF:
-                if self.is_relay:
-                    print(f"Relaying message from {addr_sender} to {addr_dest}")
-                    self.on_alert(f"[{time.strftime('%H:%M:%S')}] Relaying message from {addr_sender} to {addr_dest}")
-                    self.send_message(addr_dest, msg_type, msg_id, message)
-                else:
-                    self.on_message(f"[{time.strftime('%H:%M:%S')}] ✖️ Received from {addr_sender} to {addr_dest}: {message}.")
+                if not self.is_relay:
+                    self.on_message(f"[{time.strftime('%H:%M:%S')}] ✖️ Received from {addr_sender} to {addr_dest}: {shown}.")
                     self.on_alert(f"[{time.strftime('%H:%M:%S')}] Received message not for this node (dest: {addr_dest}), discarding.")
-                return            
+                return
+            self.on_message(f"[{time.strftime('%H:%M:%S')}] ✔️ Received from {addr_sender} to {addr_dest}: {shown}.")
+            # Reintento de un comando que la EB sigue esperando (ver send_message):
+            # no se vuelve a ejecutar, se repite la respuesta si ya se envió. La
+            # configuración de radio (9) no: ADR reenvía el mismo PROPOSE y su
+            # ACK sale con send_data, sin guardarse
+            if 6 < packet.msg_type < 31 and packet.msg_type not in (9, 20, 23, 24):
+                cached = self.replies.check(packet)
+                if cached is not None:
+                    print(f"[{time.strftime('%H:%M:%S')}] Comando {packet.msg_type}/{packet.msg_id} de {addr_sender} repetido, "
+                          f"{'reenviando respuesta' if cached else 'aún en curso'}.")
+                    for data, priority in cached:
+                        self.tx.submit(data, priority)
+                    return
             # -------------------- HANDLER DE TIPOS --------------------
-            if is_b == 0:
-                self.on_message(f"[{time.strftime('%H:%M:%S')}] ✔️ Received from {addr_sender} to {addr_dest}: {message}.")
+            # Tabla (msg_type, msg_id) -> handler, ver _register_handlers
+            if not self.handlers.dispatch(packet):
+                # Sin handler o descartado por carril lleno: el reintento debe atenderse
+                self.replies.forget(packet)
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Finished processing message.")
+
+    def _on_handler_error(self, packet, e):
+        self.on_alert(f"Error processing message: {e}")
+        # A una difusión no se responde: todos los nodos contestarían a la vez
+        if packet.dest != 0xFFFF:
+            self.send_message(packet.src, 1, packet.msg_id, "Error")
+
+    # -------------------- HANDLERS --------------------
+
+    def _register_handlers(self):
+        """
+        Tabla de tipos de mensaje. Los lentos se atienden en el carril de su
+        recurso (ver DEFAULT_LANES en HandlerRegistry): "db" por robot, "robot"
+        en un único hilo para el puerto serie, "camera" para la cámara y "slow"
+        para sensores y LED. Los plugins añaden sus tipos con self.handlers.register.
+        """
+        h = self.handlers
+        # Tipo 0: datos enviados por el robot
+        # BBDD: la EB recibe los paquetes y los robots sus ACKs
+        if self.is_base:
+            h.register(0, 20, self._on_db_packet, lane="db")
+        else:
+            h.register(0, 21, self._on_db_ack, lane="db")
+        h.register(0, 30, self._on_photo_part)
+        h.register(0, 31, self._on_transfer_status)
+        h.register(0, 40, self._on_periodic_sensors)
+        h.register(0, 50, self._on_collision_detected)
+        h.register(0, 63, self._on_imu_position)
+        h.register(0, 64, self._on_battery_level)
+        h.register(0, 65, self._on_feedback_data)
+        h.register(0, 66, self._on_imu_data)
+        # Respuestas: 1 error, 2 consulta estándar, 3 robot, 4 sensores/cámara/radar (o BBDD)
+        for msg_type in range(1, 5):
+            h.register(msg_type, None, self._on_reply)
+        # Comandos generales
+        h.register(5, None, self._on_ping)
+        h.register(6, None, self._on_status)
+        h.register(7, None, self._on_stop)
+        h.register(8, None, self._on_link_status)
+        h.register(9, None, self._on_radio_config)
+        # Comandos hacia el robot: todos se reenvían por el puerto serie
+        for msg_type in range(10, 20):
+            h.register(msg_type, None, self._on_robot_command, lane="robot")
+        h.register(10, None, self._on_feedback_command, lane="robot")
+        h.register(13, None, self._on_imu_command, lane="robot")
+        h.register(14, None, self._on_auto_move_command, lane="robot")
+        h.register(15, None, self._on_battery_command, lane="robot")
+        h.register(16, None, self._on_collision_command, lane="robot")
+        # Sensores y LED
+        h.register(20, None, lambda p: self.control_led("ON"), slow=True, name="20/* led_on")
+        h.register(21, None, self._on_sensor_loop, slow=True)
+        h.register(22, None, self._on_sensor_once, slow=True)
+        h.register(23, None, lambda p: self.control_led("OFF"), slow=True, name="23/* led_off")
+        h.register(24, None, lambda p: self.control_led("AUTO"), slow=True, name="24/* led_auto")
+        # Cámara y radar
+        h.register(25, None, self._on_photo_wifi, lane="camera")
+        h.register(26, None, self._on_video_wifi, lane="camera")
+        h.register(27, None, self._on_streaming, lane="camera")
+        h.register(28, None, self._on_media_host)
+        h.register(29, None, self._on_photo_lora, lane="camera")
+        # Modo relé
+        h.register(31, None, self._on_relay_mode)
+
+    # Tipo 0: datos enviados por el robot
+
+    def _on_db_packet(self, p):
+        ack = self.process_packet_base(p.message)
+        print(f"[{time.strftime('%H:%M:%S')}] Procesado paquete BBDD {ack['packet_id']}, enviando ACK de {len(ack['saved'])} registros.")
+        if p.is_b:
+            # ACK compacto por rangos de ids para paquetes binarios
+            self.send_data(p.src, 0, 21, encode_ack(ack["packet_id"], ack["saved"]))
+        else:
+            self.send_message(p.src, 0, 21, json.dumps(ack))
+
+    def _on_db_ack(self, p):
+        print(f"[{time.strftime('%H:%M:%S')}] Recibido ACK BBDD. Procesando...")
+        self.ack_BBDD_packet(p.message)
+        print(f"[{time.strftime('%H:%M:%S')}] Borrando registros sincronizados...")
+
+    def _on_photo_part(self, p):
+        if p.frag:
+            self.fragments.on_fragment(p.src, p.msg_type, p.msg_id, p.message)
+            return
+        # Fragmentos sin subcabecera (nodos antiguos)
+        try:
+            save_dir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "multi_socket")
+            os.makedirs(save_dir, exist_ok=True)
+
+            tmp_filename = f"tmp_photo_from_{p.src}.jpg"
+            tmp_path = os.path.join(save_dir, tmp_filename)
+
+            with open(tmp_path, "ab") as f:  # 'ab' = append en modo binario
+                f.write(p.payload)
+
+            if p.part == 2:
+                # Parte intermedia
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Encadenando parte de foto...")
+                return
+
+            if p.part == 0:
+                # Última parte recibida
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Finalizando foto...")
+
+                # Abrir imagen desde el archivo temporal
+                img = Image.open(tmp_path)
+
+                # Guardar la imagen final con timestamp y sender en el nombre
+                final_filename = f"photo_from_{p.src}_{int(time.time())}.jpg"
+                final_path = os.path.join(save_dir, final_filename)
+                img.save(final_path)
+
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Foto guardada en {final_path}.")
+                self.on_img(final_path)
+
+                # Limpiar archivo temporal
+                os.remove(tmp_path)
+
+        except Exception as e:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error decodificando foto: {e}")
+
+    def _on_transfer_status(self, p):  # ACK/NACK de transferencia por fragmentos
+        self.fragments.on_status(p.src, p.message)
+
+    def _on_periodic_sensors(self, p):
+        try:
+            self.temp_hum(p.message)
+        except Exception as e:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error procesando sensores periódicos (ID 40): {e}")
+
+    def _on_collision_detected(self, p):
+        self.on_collision()
+
+    def _on_imu_position(self, p):
+        self.imu_pos(p.message)
+
+    def _on_battery_level(self, p):
+        self.on_battery(p.message)
+
+    def _on_feedback_data(self, p):
+        self.on_feedback(p.message)
+
+    def _on_imu_data(self, p):
+        self.on_imu(p.message)
+
+    # Respuestas
+
+    def _on_reply(self, p):
+        addr_sender, message = p.src, p.message
+        if p.msg_type == 2:  # Respuesta estándar
+            self.liveness.seen(addr_sender, {
+                "robot": bool(int(message[0])),
+                "radar": bool(int(message[1])),
+                "sensors": bool(int(message[2])),
+                "camera": bool(int(message[3]))
+            })
+
+        if p.msg_type == 4:
+            if message.startswith(LINK_PREFIX):
+                # Respuesta al comando de estado del enlace (msg_type 8)
+                with self.lock_nodes:
+                    self.remote_links[addr_sender] = parse_compact(message)
+                self.on_message(f"[{time.strftime('%H:%M:%S')}] Enlace visto por {addr_sender}: {message}")
+            if message.startswith("Temp:"):
+                try:
+                    parts = message.split(",")
+                    temp_str = parts[0].split(":")[1].strip().replace("°C", "")
+                    hum_str = parts[1].split(":")[1].strip().replace("%", "")
+                    self.temp_mes = float(temp_str)
+                    self.hum_mes = float(hum_str)
+                    self.on_sensor(f"[{time.strftime('%H:%M:%S')}] Sensor data from {addr_sender} - Temp: {self.temp_mes}°C, Hum: {self.hum_mes}%")
+                except Exception as e:
+                    print(f"[{time.strftime('%H:%M:%S')}] Error parsing sensor data: {e}")
+
+        self.remove_pending(addr_sender, p.msg_id, message)
+
+    # Comandos generales
+
+    def _on_ping(self, p):  # Ping (con TDMA, baliza con el mapa de ranuras)
+        if not self.is_base:
+            self.base_addr = p.src      # la BBDD se sincroniza con la EB que hace ping
+            self.tdma.on_beacon(p.text, p.frame)
+        resp = ""
+        resp += "1" if self.robot is not None else "0"
+        resp += "1" if self.radar_sock is not None else "0"
+        resp += "1" if self.sensores is not None else "0"
+        resp += "1" if self.camera is not None else "0"
+        self.send_message(p.src, 2, p.msg_id, resp)
+
+    def _on_status(self, p):
+        status = f"Node {self.addr} OK. Freq: {self.freq} MHz, Power: {self.power} dBm"
+        if self.storage is not None:
+            status += f" | Storage: {self.storage.summary()}"
+        self.send_message(p.src, 2, p.msg_id, status)
+
+    def _on_stop(self, p):
+        self.tx.cancel_bulk()  # abortar imágenes/sync en curso entre fragmentos
+        resp = "Node stopping..."
+        self.send_message(p.src, 2, p.msg_id, resp)
+        # Fuera de los hilos de procesado: stop() los detiene y espera a que salga la respuesta
+        threading.Thread(target=self.stop, name="lora-stop").start()
+
+    def _on_link_status(self, p):  # Check RSSI: tabla de enlaces en formato compacto
+        self.send_message(p.src, 4, p.msg_id, self.links.compact())
+
+    def _on_radio_config(self, p):  # Configuración de radio (ADR y cambio de canal)
+        if p.msg_id in (CHANNEL_MOVE, CHANNEL_ACK):
+            (self.tx if isinstance(self.tx, RadioGroup) else self.channels).on_message(p.src, p.msg_id, p.message)
+        else:
+            self.adr.on_message(p.src, p.msg_id, p.message)
+
+    # Comandos hacia el robot
+
+    def _on_robot_command(self, p):
+        if self.robot and self.robot.is_open:
+            resp = self.send_to_robot(p.message)
+            self.send_message(p.src, 3, p.msg_id, resp)
+        else:
+            self.send_message(p.src, 3, p.msg_id, "Error: CAVER is not defined in this node.")
+
+    def _on_feedback_command(self, p):
+        message = p.message
+        if "0" in message:
+            self.feeedback_running = False
+        elif "1" in message:
+            self.feeedback_running = True
+            self.feedback_dest = p.src
+            self.feedback_thread = threading.Thread(target=self._feedback_loop, daemon=True)
+            self.feedback_thread.start()
+        elif "2" in message:
+            resp = self.send_to_robot("{\"T\":130}")
+            self.send_message(p.src, 0, 65, resp)
+        else:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}]⚠️ Comando de feedback desconocido: {message}")
+        self._on_robot_command(p)
+
+    def _on_imu_command(self, p):  # pedir o parar datos imu
+        message = p.message
+        if "1" in message:
+            print("llego el 1 para empezar")
+            if getattr(self, "imu_thread", None) and self.imu_thread.is_alive():
+                self.on_alert("[{time.strftime('%H:%M:%S')}] ⚠️ IMU loop ya estaba activo.")
             else:
-                self.on_message(f"[{time.strftime('%H:%M:%S')}] ✔️ Received bytes from {addr_sender} to {addr_dest}: {len(message)} bytes.")
-            
-            try: 
-                # Mensajes tipo 0 -son los enviados por el robot directamente-, por lo que aquí se describe la lógica de recepción de datos
-                if msg_type == 0:
-                    if msg_id == 20: # hacer lo que sea en la EB
-                        ack = self.process_packet_base(message)
-                        print(f"[{time.strftime('%H:%M:%S')}] Procesado paquete BBDD, enviando ACK: {ack}")
-                        self.send_message(addr_sender, 0, 21, json.dumps(ack))
-                    if msg_id == 21: 
-                        print(f"[{time.strftime('%H:%M:%S')}] Recibido ACK BBDD. Procesando...")
-                        self.ack_BBDD_packet(message)
-                        print(f"[{time.strftime('%H:%M:%S')}] Borrando registros sincronizados...")
-                    
-                    elif msg_id == 30:
-                        try:
-                            save_dir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "multi_socket")
-                            os.makedirs(save_dir, exist_ok=True)
-
-                            tmp_filename = f"tmp_photo_from_{addr_sender}.jpg"
-                            tmp_path = os.path.join(save_dir, tmp_filename)
-
-                            with open(tmp_path, "ab") as f:  # 'ab' = append en modo binario
-                                f.write(message)
-
-                            if part == 2:
-                                # Parte intermedia
-                                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Encadenando parte de foto...")
-                                return
-
-                            if part == 0:
-                                # Última parte recibida
-                                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Finalizando foto...")
-
-                                # Abrir imagen desde el archivo temporal
-                                img = Image.open(tmp_path)
-
-                                # Guardar la imagen final con timestamp y sender en el nombre
-                                final_filename = f"photo_from_{addr_sender}_{int(time.time())}.jpg"
-                                final_path = os.path.join(save_dir, final_filename)
-                                img.save(final_path)
-
-                                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Foto guardada en {final_path}.")
-                                self.on_img(final_path)
-
-                                # Limpiar archivo temporal
-                                os.remove(tmp_path)
-
-                        except Exception as e:
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error decodificando foto: {e}")
-
-                    elif msg_id == 40: # sensores
-                        try:
-                            self.temp_hum(message)
-                        except Exception as e:
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error procesando sensores periódicos (ID 40): {e}")
-                    elif msg_id == 50: # colision
-                        self.on_collision()
-                    elif msg_id == 63: #imu
-                        self.imu_pos(message)
-                    elif msg_id == 64: # beteria
-                        battery_level = message
-                        self.on_battery(battery_level)
-                    elif msg_id == 65: # feedback
-                        self.on_feedback(message)
-                    elif msg_id == 66: # imu
-                        self.on_imu(message)
-                    elif msg_id == 69: 
-                        if self.is_base:
-                            # resp = procesar_paquete_lora(message)
-                            # self.send_message(addr_sender, 4, msg_id, resp)
-                            ...
-                
-                # Respuestas posibles: 1- Error, 2- Consulta estándar, 3- Respuesta robot, 4- Respuesta sensores/camara/radar (o BBDD), 5- Ack Relay
-                elif 0 < msg_type < 5: 
-                    if msg_type == 2:  # Respuesta estándar
-                        with self.lock_nodes:
-                            self.connected_nodes[addr_sender] = {
-                                "robot": bool(int(message[0])),      
-                                "radar": bool(int(message[1])),      
-                                "sensors": bool(int(message[2])),   
-                                "camera": bool(int(message[3]))     
-                            }
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Nodos: {self.connected_nodes}")
-                        
-                        if addr_sender in self.node_timers:
-                            self.node_timers[addr_sender].cancel()
-                        timer = threading.Timer(60, self.remove_node, args=(addr_sender,))
-                        self.node_timers[addr_sender] = timer
-                        print(self.node_timers)
-                        timer.start()
-
-                    if msg_type == 4:
-                        if message.startswith("Temp:"):
-                            try:
-                                parts = message.split(",")
-                                temp_str = parts[0].split(":")[1].strip().replace("°C", "")
-                                hum_str = parts[1].split(":")[1].strip().replace("%", "")
-                                self.temp_mes = float(temp_str)
-                                self.hum_mes = float(hum_str)
-                                self.on_sensor(f"[{time.strftime('%H:%M:%S')}] Sensor data from {addr_sender} - Temp: {self.temp_mes}°C, Hum: {self.hum_mes}%")
-                            except Exception as e:
-                                print(f"[{time.strftime('%H:%M:%S')}] Error parsing sensor data: {e}")
-
-                    self.remove_pending(addr_sender, msg_id)
-                    return
+                self.stop_imu_flag = False
+                self.imu_dest = p.src
+                self.imu_thread = threading.Thread(target=self._get_imu_loop_raspi, daemon=True)
+                self.imu_thread.start()
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] 🟢 IMU loop activado por EB.")
+        elif "0" in message:
+            self.stop_imu_flag = True
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] 🔴 IMU loop detenido por EB.")
+        elif "2" in message:
+            resp = self.send_to_robot("{\"T\":126}")
+            self.send_message(p.src, 0, 66, resp)
+        else:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando IMU desconocido: {message}")
+        self._on_robot_command(p)
+
+    def _on_auto_move_command(self, p):
+        message = p.message
+        if "1" in message:
+            self.auto_move_running = True
+            self.detect_collisions_running = True
+            self.colision_dest = p.src
+            if not getattr(self, "mov_aut_thread", None) or not self.mov_aut_thread.is_alive():
+                self.mov_aut_thread = threading.Thread(target=self._move_robot_loop, daemon=True)
+                self.mov_aut_thread.start()
+        elif "0" in message:
+            print(f"[{time.strftime('%H:%M:%S')}] Movimiento autónomo loop detenido por EB.")
+            self.auto_move_running = False
+            self.detect_collisions_running = False
+        else:
+            print(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando movimiento autónomo desconocido: {message}")
+        self._on_robot_command(p)
+
+    def _on_battery_command(self, p):
+        message = p.message
+        if "0" in message:
+            self.battery_monitor_running = False
+        elif "1" in message:
+            self.battery_monitor_running = True
+            self.battery_dest = p.src
+            self.battery_monitor_thread = threading.Thread(target=self._battery_monitor_loop, daemon=True)
+            self.battery_monitor_thread.start()
+        elif "2" in message:
+            resp = self.send_to_robot("{\"T\":130}")
+            print("[DEBUG RAW RESP]:", repr(resp))
+            data = json.loads(resp)
+            battery = data.get("v", 0)   # por si no existe, devuelve 0
+            print("BATERIA")
+            print(battery)
+            print("BATERIA ")
+            # self.send_message(self.battery_dest, 0, 64, battery)
+            self.send_message(p.src, 0, 64, str(battery))
+        else:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando de monitorización de batería desconocido: {message}")
+        self._on_robot_command(p)
+
+    def _on_collision_command(self, p):
+        message = p.message
+        if "1" in message:
+            self.detect_collisions_running = True
+            self.colision_dest = p.src
+            if not getattr(self, "mov_aut_thread", None) or not self.mov_aut_thread.is_alive():
+                self.mov_aut_thread = threading.Thread(target=self._move_robot_loop, daemon=True)
+                self.mov_aut_thread.start()
+        elif "0" in message:
+            print("Detacción de colisiones detenida por EB.")
+            self.detect_collisions_running = False
+        else:
+            print(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando detección de colisiones desconocido: {message}")
+        self._on_robot_command(p)
 
-                elif 4 < msg_type < 10:  # Comandos generales
-                    if msg_type == 5:  # Ping
-                        resp = ""
-                        resp += "1" if self.robot is not None else "0"
-                        resp += "1" if self.radar_sock is not None else "0"
-                        resp += "1" if self.sensores is not None else "0"
-                        resp += "1" if self.camera is not None else "0"
-                        # time.sleep(0.2*self.addr)  # evitar colisiones
-                        self.send_message(addr_sender, 2, msg_id, resp)
-                    elif msg_type == 6:  # Status
-                        status = f"Node {self.addr} OK. Freq: {self.freq} MHz, Power: {self.power} dBm"
-                        # time.sleep(0.2*self.addr)  # evitar colisiones
-                        self.send_message(addr_sender, 2, msg_id, status)
-                    elif msg_type == 7:  # Stop
-                        resp = "Node stopping..."
-                        # time.sleep(0.2*self.addr)  # evitar colisiones
-                        self.send_message(addr_sender, 2, msg_id, resp)
-                        self.stop()
-                    elif msg_type == 8: # Check RSSI
-                        ...
-                    elif msg_type == 9: 
-                        ...
-
-                elif 9 < msg_type < 20:  # Comandos hacia el robot
-                    # -------------------- feedback --------------------
-                    if msg_type == 10:
-                        if "0" in message:
-                            self.feeedback_running = False
-                        elif "1" in message:
-                            self.feeedback_running = True
-                            self.feedback_dest = addr_sender
-                            self.feedback_thread = threading.Thread(target=self._feedback_loop, daemon=True)
-                            self.feedback_thread.start()
-                        elif "2" in message:
-                            resp = self.send_to_robot("{\"T\":130}")  
-                            self.send_message(addr_sender, 0, 65, resp)
-                        else:
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}]⚠️ Comando de feedback desconocido: {message}") 
-
-                    elif msg_type == 13: # pedir o parar datos imu
-                        if "1" in message:
-                            print("llego el 1 para empezar")
-                            if getattr(self, "imu_thread", None) and self.imu_thread.is_alive():
-                                self.on_alert("[{time.strftime('%H:%M:%S')}] ⚠️ IMU loop ya estaba activo.")
-                            else:
-                                self.stop_imu_flag = False
-                                self.imu_dest = addr_sender
-                                self.imu_thread = threading.Thread(target=self._get_imu_loop_raspi, daemon=True)
-                                self.imu_thread.start()
-                                self.on_alert(f"[{time.strftime('%H:%M:%S')}] 🟢 IMU loop activado por EB.")
-                        elif "0" in message:
-                            self.stop_imu_flag = True
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}] 🔴 IMU loop detenido por EB.")
-                        elif "2" in message:
-                            resp = self.send_to_robot("{\"T\":126}")  
-                            self.send_message(addr_sender, 0, 66, resp)
-                        else:
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando IMU desconocido: {message}") 
-                    
-                    elif msg_type == 14:
-                        if "1" in message:
-                            self.auto_move_running = True
-                            self.detect_collisions_running = True
-                            self.colision_dest = addr_sender
-                            if not getattr(self, "mov_aut_thread", None) or not self.mov_aut_thread.is_alive():
-                                self.mov_aut_thread = threading.Thread(target=self._move_robot_loop, daemon=True)
-                                self.mov_aut_thread.start()
-                        elif "0" in message:
-                            print(f"[{time.strftime('%H:%M:%S')}] Movimiento autónomo loop detenido por EB.")
-                            self.auto_move_running = False
-                            self.detect_collisions_running = False
-                        else: 
-                            print(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando movimiento autónomo desconocido: {message}") 
-
-                    elif msg_type == 15:
-                        if "0" in message:
-                            self.battery_monitor_running = False
-                        elif "1" in message:
-                            self.battery_monitor_running = True
-                            self.battery_dest = addr_sender
-                            self.battery_monitor_thread = threading.Thread(target=self._battery_monitor_loop, daemon=True)
-                            self.battery_monitor_thread.start()
-                        elif "2" in message:
-                            resp = self.send_to_robot("{\"T\":130}")  
-                            print("[DEBUG RAW RESP]:", repr(resp))
-                            data = json.loads(resp)
-                            battery = data.get("v", 0)   # por si no existe, devuelve 0
-                            print("BATERIA")
-                            print(battery)
-                            print("BATERIA ")
-                            # self.send_message(self.battery_dest, 0, 64, battery)
-                            self.send_message(addr_sender, 0, 64, str(battery))
-                        else:
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando de monitorización de batería desconocido: {message}") 
-
-                    elif msg_type == 16:
-                        if "1" in message:
-                            self.detect_collisions_running = True
-                            self.colision_dest = addr_sender
-                            if not getattr(self, "mov_aut_thread", None) or not self.mov_aut_thread.is_alive():
-                                self.mov_aut_thread = threading.Thread(target=self._move_robot_loop, daemon=True)
-                                self.mov_aut_thread.start()
-                        elif "0" in message:
-                            print("Detacción de colisiones detenida por EB.")
-                            self.detect_collisions_running = False
-                        else: 
-                            print(f"[{time.strftime('%H:%M:%S')}] ⚠️ Comando detección de colisiones desconocido: {message}") 
-
-                    if self.robot.is_open and self.robot:
-                        resp = self.send_to_robot(message)
-                        self.send_message(addr_sender, 3, msg_id, resp)
-                    else:
-                        self.send_message(addr_sender, 3, msg_id, "Error: CAVER is not defined in this node.")
-                    
+    # Sensores y BBDD
 
-                elif 19 < msg_type < 25:  # Comando para los sensores y BBDD
-                    if msg_type == 21:  # Lectura temperatura y humedad
-                        self.sensor_dest = addr_sender
-                        if self.on_sensor is None:
-                            self.connect_sensors()
-                            self.sensor_dest = addr_sender
-                            sensor_th = threading.Thread(target=self.read_sensors_loop, daemon=True)
-                            sensor_th.start()
-                        self.send_message(addr_sender, 4, msg_id, f"Temp: {self.temp:.1f}°C, Hum: {self.hum:.1f}%")
-                    if msg_type == 22:  # Realizar lectura mandada por la EB
-                        self.read_sensors_once()
-                        self.send_message(addr_sender, 4, msg_id, f"Temp: {self.temp:.1f}°C, Hum: {self.hum:.1f}%")
-                    if msg_type == 20:  # Encender led
-                        self.control_led("ON")
-                    if msg_type == 23:  # Apagar led
-                        self.control_led("OFF")
-                    if msg_type == 24:  # Modo automático led
-                        self.control_led("AUTO")
-
-                elif 24 < msg_type < 31:  # Comandos para cámara y radar
-                    if msg_type == 25: # Tomar foto y enviar vía WiFi
-                        try:
-                            data = json.loads(message)
-                            quality = data.get("quality", "Baja")
-                            path = self.lora_cam_sender.capture_recording_optimized(self.photo_dir, resolution=quality)
-                            timestamp = datetime.now()
-
-                            if self.lora_cam_sender.send_photo_file_wifi(self.host_eb, self.port_eb, path, timestamp, self.addr):
-                                self.db.insert_media(path=path, es_video=False, sinc=True)
-                                print(f"[{time.strftime('%H:%M:%S')}] Foto enviada vía WiFi a EB.")
-                                print(f"[{time.strftime('%H:%M:%S')}] Foto guardada en SQLite y sincronizada.")
-                                self.send_message(addr_sender, 4, msg_id, f"Foto tomada y enviada.")
-                            else:
-                                self.db.insert_media(path=path, es_video=False)
-                                print(f"[{time.strftime('%H:%M:%S')}] Foto guardada en SQLite.")
-                                self.send_message(addr_sender, 4, msg_id, f"Foto tomada y guardada.")
-                        except Exception as e:
-                            print(f"[{time.strftime('%H:%M:%S')}] Error enviando foto vía WiFi: {e}")
-
-                    elif msg_type == 26: # Grabar video y enviar vía WiFi 
-                        try:
-                            data = json.loads(message)
-                            duration = data.get("duration", 3)
-                            quality = data.get("quality", "Baja")
-                            timestamp = datetime.now()
-
-                            path = self.lora_cam_sender.video_recording_optimized(self.video_dir, duration, resolution=quality)
-
-                            if self.lora_cam_sender.send_video_file_wifi(self.host_eb, self.port_eb, path, timestamp, self.addr):
-                                self.db.insert_media(path=path, es_video=True, sinc=True)
-                                print(f"[{time.strftime('%H:%M:%S')}] Video enviado vía WiFi a EB.")
-                                print(f"[{time.strftime('%H:%M:%S')}] Video guardado en SQLite y sincronizada.")
-                                self.send_message(addr_sender, 4, msg_id, f"Video tomado y enviado.")
-                            else:
-                                self.db.insert_media(path=path, es_video=True)
-                                print(f"[{time.strftime('%H:%M:%S')}] Video guardado en SQLite.")
-                                self.send_message(addr_sender, 4, msg_id, f"Video tomado y guardado.")
-                        except Exception as e:
-                            print(f"[{time.strftime('%H:%M:%S')}] Error enviando video vía WiFi: {e}")
-
-                    elif msg_type == 27:  # empezar/parar streaming vía WiFi
-                        if message == "1":
-                            print("📥 Comando: iniciar streaming H.264")
-                            self.lora_cam_sender.start_streaming(self.host_eb, 5400)
-                            self.send_message(addr_sender, 4, msg_id, f"OK")
-                        elif message == "0":
-                            print("📥 Comando: detener streaming H.264")
-                            ack = self.lora_cam_sender.stop_streaming()
-                            self.send_message(addr_sender, 4, msg_id, f"OK" if ack else "Error")
-
-                    elif msg_type == 28:  # host:port para enviar foto vía WiFi
-                        self.host_eb, self.port_eb = message.split(":")
-                        self.port_eb = int(self.port_eb)
-                        print(f"[{time.strftime('%H:%M:%S')}] Host EB para multimedia vía WiFi: {self.host_eb}:{self.port_eb}")
-                        self.send_message(addr_sender, 4, msg_id, f"OK")
-
-                    elif msg_type == 29:  # imagen por LoRa
-                        try:
-                            #self.send_message(addr_sender, 4, msg_id, "OK STARTING")
-                            path = self.lora_cam_sender.capture_recording_optimized(self.photo_dir, resolution="Baja")
-                            time.sleep(0.5)
-                            self.send_bytes(addr_sender, 0, 30, path)
-                        except Exception as e:
-                            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error decodificando imagen LoRa: {e}")
-
-                elif msg_type == 31:
-                    print("Relay mode set to: ", relay_flag)
-                    self.is_relay = bool(relay_flag)
-                    self.send_message(addr_sender, 5, msg_id, "OK")
+    def _on_sensor_loop(self, p):  # Lectura temperatura y humedad
+        self.sensor_dest = p.src
+        if self.on_sensor is None:
+            self.connect_sensors()
+            self.sensor_dest = p.src
+            sensor_th = threading.Thread(target=self.read_sensors_loop, daemon=True)
+            sensor_th.start()
+        self.send_message(p.src, 4, p.msg_id, f"Temp: {self.temp:.1f}°C, Hum: {self.hum:.1f}%")
 
-            except Exception as e:
-                self.on_alert(f"Error processing message: {e}")
-                self.send_message(addr_sender, 1, msg_id, "Error")
+    def _on_sensor_once(self, p):  # Realizar lectura mandada por la EB
+        self.read_sensors_once()
+        self.send_message(p.src, 4, p.msg_id, f"Temp: {self.temp:.1f}°C, Hum: {self.hum:.1f}%")
 
-            finally:
-                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Finished processing message.")
-                time.sleep(0.1)
+    # Cámara y radar
+
+    def _on_photo_wifi(self, p):  # Tomar foto y enviar vía WiFi
+        try:
+            data = json.loads(p.message)
+            quality = data.get("quality", "Baja")
+            if not self._storage_admit("photos"):
+                self.send_message(p.src, 4, p.msg_id, "Sin espacio en disco.")
+                return
+            path = self.lora_cam_sender.capture_recording_optimized(self.photo_dir, resolution=quality)
+            self._storage_add(path, "photos")
+            timestamp = datetime.now()
+
+            if self.lora_cam_sender.send_photo_file_wifi(self.host_eb, self.port_eb, path, timestamp, self.addr):
+                self.db.insert_media(path=path, es_video=False, sinc=True)
+                print(f"[{time.strftime('%H:%M:%S')}] Foto enviada vía WiFi a EB.")
+                print(f"[{time.strftime('%H:%M:%S')}] Foto guardada en SQLite y sincronizada.")
+                self.send_message(p.src, 4, p.msg_id, f"Foto tomada y enviada.")
+            else:
+                self.db.insert_media(path=path, es_video=False)
+                print(f"[{time.strftime('%H:%M:%S')}] Foto guardada en SQLite.")
+                self.send_message(p.src, 4, p.msg_id, f"Foto tomada y guardada.")
+        except Exception as e:
+            print(f"[{time.strftime('%H:%M:%S')}] Error enviando foto vía WiFi: {e}")
+
+    def _on_video_wifi(self, p):  # Grabar video y enviar vía WiFi
+        try:
+            data = json.loads(p.message)
+            duration = data.get("duration", 3)
+            quality = data.get("quality", "Baja")
+            timestamp = datetime.now()
+
+            if not self._storage_admit("videos"):
+                self.send_message(p.src, 4, p.msg_id, "Sin espacio en disco.")
+                return
+            path = self.lora_cam_sender.video_recording_optimized(self.video_dir, duration, resolution=quality)
+            self._storage_add(path, "videos")
+
+            if self.lora_cam_sender.send_video_file_wifi(self.host_eb, self.port_eb, path, timestamp, self.addr):
+                self.db.insert_media(path=path, es_video=True, sinc=True)
+                print(f"[{time.strftime('%H:%M:%S')}] Video enviado vía WiFi a EB.")
+                print(f"[{time.strftime('%H:%M:%S')}] Video guardado en SQLite y sincronizada.")
+                self.send_message(p.src, 4, p.msg_id, f"Video tomado y enviado.")
+            else:
+                self.db.insert_media(path=path, es_video=True)
+                print(f"[{time.strftime('%H:%M:%S')}] Video guardado en SQLite.")
+                self.send_message(p.src, 4, p.msg_id, f"Video tomado y guardado.")
+        except Exception as e:
+            print(f"[{time.strftime('%H:%M:%S')}] Error enviando video vía WiFi: {e}")
+
+    def _on_streaming(self, p):  # empezar/parar streaming vía WiFi
+        if p.message == "1":
+            print("📥 Comando: iniciar streaming H.264")
+            self.lora_cam_sender.start_streaming(self.host_eb, 5400)
+            self.send_message(p.src, 4, p.msg_id, f"OK")
+        elif p.message == "0":
+            print("📥 Comando: detener streaming H.264")
+            ack = self.lora_cam_sender.stop_streaming()
+            self.send_message(p.src, 4, p.msg_id, f"OK" if ack else "Error")
+
+    def _on_media_host(self, p):  # host:port para enviar foto vía WiFi
+        self.host_eb, self.port_eb = p.message.split(":")
+        self.port_eb = int(self.port_eb)
+        print(f"[{time.strftime('%H:%M:%S')}] Host EB para multimedia vía WiFi: {self.host_eb}:{self.port_eb}")
+        self.send_message(p.src, 4, p.msg_id, f"OK")
+
+    def _on_photo_lora(self, p):  # imagen por LoRa
+        try:
+            #self.send_message(p.src, 4, p.msg_id, "OK STARTING")
+            if not self._storage_admit("photos"):
+                self.send_message(p.src, 4, p.msg_id, "Sin espacio en disco.")
+                return
+            path = self.lora_cam_sender.capture_recording_optimized(self.photo_dir, resolution="Baja")
+            self._storage_add(path, "photos")
+            time.sleep(0.5)
+            self.send_bytes(p.src, 0, 30, path)
+        except Exception as e:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error decodificando imagen LoRa: {e}")
+
+    def _on_relay_mode(self, p):
+        print("Relay mode set to: ", p.relay)
+        self.is_relay = bool(p.relay)
+        self.send_message(p.src, 5, p.msg_id, "OK")
 
     # ------------------- PENDING REQUESTS -----------------
 
-    def add_pending(self, addr_dest: int, msg_id: int):
-        with self.lock_pending:
-            self.pending_requests.setdefault(addr_dest, []).append(msg_id)
+    @property
+    def pending_requests(self) -> dict:
+        """Vista destino -> [msg_ids] de las peticiones pendientes."""
+        return self.requests.snapshot()
+
+    def add_pending(self, addr_dest: int, msg_id: int, resend=None, retries=None, timeout=None):
+        future = self.requests.add(addr_dest, msg_id, resend=resend, retries=retries, timeout=timeout)
         self.on_alert(f"[{time.strftime('%H:%M:%S')}] Added pending request: {msg_id} to {addr_dest}")
+        return future
 
-    def remove_pending(self, addr_dest: int, msg_id: int) -> bool:
-        with self.lock_pending:
-            if addr_dest in self.pending_requests:
-                try:
-                    self.pending_requests[addr_dest].remove(msg_id) 
-                    if not self.pending_requests[addr_dest]:
-                        del self.pending_requests[addr_dest]
-                    self.on_alert(f"[{time.strftime('%H:%M:%S')}] Removed pending request: {msg_id} to {addr_dest}")
-                    return True
-                except ValueError:
-                    pass  
-            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Unavailable pending request: {msg_id} to {addr_dest}")
-            return False
+    def remove_pending(self, addr_dest: int, msg_id: int, reply=None) -> bool:
+        if self.requests.complete(addr_dest, msg_id, reply):
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Removed pending request: {msg_id} to {addr_dest}")
+            return True
+        self.on_alert(f"[{time.strftime('%H:%M:%S')}] Unavailable pending request: {msg_id} to {addr_dest}")
+        return False
         
     def remove_node(self, addr_sender):
-        with self.lock_nodes:
-            if addr_sender in self.connected_nodes:
-                del self.connected_nodes[addr_sender]
-                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Nodo {addr_sender} eliminado por timeout.")
+        return self.liveness.remove(addr_sender)
 
 
     # -------------------- SERIAL ROBOT --------------------
@@ -618,7 +854,8 @@ class LoRaNode:
     
     def connect_robot(self):
         try:
-            self.robot = serial.Serial(self.robot_port, self.robot_baudrate, dsrdtr=None, rtscts=False)
+            # serial_for_url admite también URLs de pyserial (loop://, socket://...) para simulación
+            self.robot = serial.serial_for_url(self.robot_port, self.robot_baudrate, dsrdtr=None, rtscts=False)
             self.robot.setRTS(False)
             self.robot.setDTR(False)
             self.robot.write(("{\"T\":131,\"cmd\":0}" + "\r\n").encode('utf-8'))      # se desactiva el chasis feedback
@@ -652,7 +889,7 @@ class LoRaNode:
                 self.db.insert_movimiento(L= json.loads(command).get("L"), R=json.loads(command).get("R"))
             print(f"[{time.strftime('%H:%M:%S')}] Enviando comando al robot.")  
             try:
-                response = self.response_queue.get(timeout=5)
+                response = self.response_queue.get(timeout=ROBOT_TIMEOUT)
                 return response
             except queue.Empty:
                 return "OK"
@@ -930,7 +1167,12 @@ class LoRaNode:
         """Envía frames de video periódicamente al nodo solicitante mientras self.streaming_running sea True."""
         while getattr(self, "streaming_running", False) and self.running:
             try:
+                if not self._storage_admit("videos"):
+                    print(f"[{time.strftime('%H:%M:%S')}] Streaming en pausa: sin espacio en disco.")
+                    time.sleep(5)
+                    continue
                 path = self.lora_cam_sender.video_recording_optimized(self.video_dir, duration=3)
+                self._storage_add(path, "videos")
                 if self.lora_cam_sender.send_video_file_wifi(self.host_eb, self.port_eb, path):
                     print(f"[{time.strftime('%H:%M:%S')}] Frame de video enviado vía WiFi a EB.")
                     self.send_message(self.stream_dest, 0, 70, f"Frame enviado.")
@@ -943,7 +1185,7 @@ class LoRaNode:
     # -------------------- SENSORES --------------------
     def connect_sensors(self):
         try:
-            self.sensores = serial.Serial(self.sens_port, self.sens_baudrate, timeout=2)
+            self.sensores = serial.serial_for_url(self.sens_port, self.sens_baudrate, timeout=2)
             time.sleep(2)
             print("[SENSORS] Conectado al ESP32 en", self.sens_port)
             return True
@@ -954,33 +1196,35 @@ class LoRaNode:
     def read_sensors_loop(self):
         """Lee datos de temperatura y humedad del ESP32 conectado por serie."""
         while self.running:
-            try:
-                line = self.sensores.readline().decode('utf-8', errors='ignore').strip()
-                if line and line.startswith("H") and "T" in line:
-                    # Ejemplo: "Humidity:72% Temperature:21°C"
-                    parts = line.split()
-                    self.hum = float(parts[0].split(':')[1].replace('%', ''))
-                    self.temp = float(parts[1].split(':')[1].replace('°C', ''))
+            self.sensors_step()
+            time.sleep(30) #cmabiar a 120 o lo que queramos
 
-                    print(f"[{time.strftime('%H:%M:%S')}] [SENSORS] Temp={self.temp:.1f}°C | Hum={self.hum:.1f}%")
+    def sensors_step(self):
+        try:
+            line = self.sensores.readline().decode('utf-8', errors='ignore').strip()
+            if line and line.startswith("H") and "T" in line:
+                # Ejemplo: "Humidity:72% Temperature:21°C"
+                parts = line.split()
+                self.hum = float(parts[0].split(':')[1].replace('%', ''))
+                self.temp = float(parts[1].split(':')[1].replace('°C', ''))
+
+                print(f"[{time.strftime('%H:%M:%S')}] [SENSORS] Temp={self.temp:.1f}°C | Hum={self.hum:.1f}%")
+
+                # self.send_message(self.sensor_dest, 0, 40, f"Temp: {self.temp:.1f}°C, Hum: {self.hum:.1f}%")
+                if hasattr(self, "sensor_dest"):
+                    temp_str = parts[1].split(':')[1].replace('°C', '')
+                    hum_str = parts[0].split(':')[1].replace('%', '')
+                    self.send_message(self.sensor_dest, 0, 40, f"{temp_str},{hum_str}")
+                else:
+                    print("⚠️ sensor_dest no existe, no se envía mensaje")
 
-                    # self.send_message(self.sensor_dest, 0, 40, f"Temp: {self.temp:.1f}°C, Hum: {self.hum:.1f}%")
-                    if hasattr(self, "sensor_dest"):
-                        temp_str = parts[1].split(':')[1].replace('°C', '')
-                        hum_str = parts[0].split(':')[1].replace('%', '')
-                        self.send_message(self.sensor_dest, 0, 40, f"{temp_str},{hum_str}")
-                    else:
-                        print("⚠️ sensor_dest no existe, no se envía mensaje")
-                        
-                    # with get_db_session() as session:
-                    #     registrar_lectura(self.temp, self.hum, session)
+                # with get_db_session() as session:
+                #     registrar_lectura(self.temp, self.hum, session)
 
-                    self.db.insert_sensor(temp=self.temp, hum=self.hum)
+                self.db.insert_sensor(temp=self.temp, hum=self.hum)
 
-            except Exception as e:
-                print(f"[{time.strftime('%H:%M:%S')}] [SENSORS] Error leyendo ESP32: {e}")
-            
-            time.sleep(30) #cmabiar a 120 o lo que queramos
+        except Exception as e:
+            print(f"[{time.strftime('%H:%M:%S')}] [SENSORS] Error leyendo ESP32: {e}")
 
     def read_sensors_once(self):
         """Lee datos de temperatura y humedad del ESP32 conectado por serie una vez."""
@@ -1048,21 +1292,26 @@ class LoRaNode:
             print(f"[LED] ❌ Error enviando orden al ESP32: {e}")
 
     # -------------------- BBDD --------------------
-    def sync_BBDD_sens_loop(self):
-        """Sincroniza datos pendientes con la BBDD local."""
+    def sync_BBDD_loop(self):
+        """
+        Sincroniza con la EB los registros pendientes (sensores, movimientos y media).
+        Mantiene hasta sync.window paquetes sin confirmar: cada ACK libera un hueco
+        y el siguiente paquete sale en cuanto llega, sin esperar al siguiente ciclo.
+        """
         while self.running:
-            packets = self.sync.prepare_packets_sensors()
-            count = 0
-            for pkt in packets:
-                print(f"[{time.strftime('%H:%M:%S')}] Iniciando sincronización SENSORES.")
-                count += 1
-                if count > 1:
-                    break  # enviar máximo 1 paquetes por ciclo
-                json_string = pkt.to_json()  # Este string es lo que envías por LoRa
-                print(f"[{time.strftime('%H:%M:%S')}] Enviando: {json_string}")
-                self.send_message(0xFFFF, 0, 20, json_string)
-                time.sleep(1)
-            time.sleep(20)
+            self.sync_step()
+            self.sync.wait(idle=20.0)
+
+    def sync_step(self) -> float:
+        """Envía lo que toque de la ventana; devuelve los segundos hasta el próximo vencimiento."""
+        for pkt in self.sync.poll():
+            payload = pkt.encode()  # bytes (codec binario) o string JSON
+            print(f"[{time.strftime('%H:%M:%S')}] Enviando paquete {pkt.packet_id}: {len(pkt.entries)} registros, {pkt.length} bytes")
+            if isinstance(payload, bytes):
+                self.send_data(self.base_addr, 0, 20, payload)
+            else:
+                self.send_message(self.base_addr, 0, 20, payload)
+        return self.sync.next_timeout(idle=20.0)
 
     def process_packet_base(self, json):
         """Procesa un paquete de BBDD recibido desde un nodo."""
@@ -1070,8 +1319,11 @@ class LoRaNode:
         return self.sync_base.process_packet(json)
 
     def ack_BBDD_packet(self, json):
-        """Marca un paquete de BBDD como recibido."""
-        self.sync.handle_ack(json)
+        """Marca un paquete de BBDD como recibido. Acepta el ACK binario por rangos o el JSON."""
+        packet_id = self.sync.handle_ack(json)
+        if self.runtime is not None:
+            self.runtime.wake("sync")       # el hueco liberado se rellena ya
+        return packet_id
 
     def delete_BBDD_data(self):
         """Elimina los datos sincronizados de la BBDD local."""
@@ -1079,32 +1331,42 @@ class LoRaNode:
             self.db.delete_synced_entries()
             time.sleep(180)  # cada 3 minutos
 
+    def _storage_admit(self, category) -> bool:
+        return self.storage is None or self.storage.admit(category)
+
+    def _storage_add(self, path, category):
+        if self.storage is not None and isinstance(path, str):
+            self.storage.add(path, category)
+
     # -------------------- WiFi --------------------
     def sync_BDDD_wifi_loop(self):
         """Sincroniza datos pendientes con la BBDD en la base vía WiFi."""
         while self.running:
-            try:
-                print(f"[{time.strftime('%H:%M:%S')}] Iniciando sincronización de multimedia vía WiFi...")
-                media_list = self.db.get_unsynced_media()
-                packet_entries = []
-                for item in media_list:
-                    id = item['id']
-                    path = item['data']['path']
-                    es_video = item['data']['es_video']
-                    if es_video:
-                        sent = self.lora_cam_sender.send_video_file_wifi(self.host_eb, self.port_eb, path, datetime.now(), self.addr)
-                    else:
-                        sent = self.lora_cam_sender.send_photo_file_wifi(self.host_eb, self.port_eb, path, datetime.now(), self.addr)
-                    if sent:
-                        packet_entry = {"table": "media", "id": id}
-                        packet_entries.append(packet_entry)
-                        print(f"[{time.strftime('%H:%M:%S')}] Multimedia sincronizada vía WiFi: {path}")
-                self.db.mark_as_synced(packet_entries)
-
-            except Exception as e:
-                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error sincronizando BBDD vía WiFi: {e}")
+            self.media_sync_step()
             time.sleep(90)  # cada 90 segundos
 
+    def media_sync_step(self):
+        try:
+            print(f"[{time.strftime('%H:%M:%S')}] Iniciando sincronización de multimedia vía WiFi...")
+            media_list = self.db.get_unsynced_media()
+            packet_entries = []
+            for item in media_list:
+                id = item['id']
+                path = item['data']['path']
+                es_video = item['data']['es_video']
+                if es_video:
+                    sent = self.lora_cam_sender.send_video_file_wifi(self.host_eb, self.port_eb, path, datetime.now(), self.addr)
+                else:
+                    sent = self.lora_cam_sender.send_photo_file_wifi(self.host_eb, self.port_eb, path, datetime.now(), self.addr)
+                if sent:
+                    packet_entry = {"table": "media", "id": id}
+                    packet_entries.append(packet_entry)
+                    print(f"[{time.strftime('%H:%M:%S')}] Multimedia sincronizada vía WiFi: {path}")
+            self.db.mark_as_synced(packet_entries)
+
+        except Exception as e:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Error sincronizando BBDD vía WiFi: {e}")
+
     def listen_robot(self, host="0.0.0.0", port=6000, save_path=os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "multi_socket/")):
         """
         Hilo que escucha comandos enviados por el robot.
@@ -1154,25 +1416,7 @@ class LoRaNode:
                         break
                     data += packet
 
-                # Guardamos según tipo
-                if header == "PHOTO":
-                    filename_ = save_path + filename
-                    with open(filename_, "wb") as f:
-                        f.write(data)
-                    print(f"📸 Foto guardada en {filename_}")
-                    self.db_base.insert_media(robot_id=robot_id, path=filename_, es_video=False, checksum=base64.b64encode(checksum_bytes).decode("utf-8"), timestamp=timestamp_dt)
-                    self.on_img(filename_)
-
-                elif header == "VIDEO":
-                    filename_ = save_path + filename
-                    with open(filename_, "wb") as f:
-                        f.write(data)
-                    print(f"🎥 Vídeo guardado en {filename_}")
-                    self.db_base.insert_media(robot_id=robot_id, path=filename_, es_video=True, checksum=base64.b64encode(checksum_bytes).decode("utf-8"), timestamp=timestamp_dt)
-                    self.on_video(filename_)
-
-                else:
-                    print("⚠️ Tipo de dato desconocido")
+                self._store_media(header, filename, robot_id, timestamp_dt, checksum_bytes, data, save_path)
 
             except Exception as e:
                 print(f"❌ Error recibiendo datos: {e}")
@@ -1180,6 +1424,51 @@ class LoRaNode:
                 conn.close()
         s.close()
 
+    def _store_media(self, header, filename, robot_id, timestamp_dt, checksum_bytes, data, save_path):
+        # Guardamos según tipo
+        if header == "PHOTO":
+            filename_ = save_path + filename
+            with open(filename_, "wb") as f:
+                f.write(data)
+            print(f"📸 Foto guardada en {filename_}")
+            self.db_base.insert_media(robot_id=robot_id, path=filename_, es_video=False, checksum=base64.b64encode(checksum_bytes).decode("utf-8"), timestamp=timestamp_dt)
+            self.on_img(filename_)
+
+        elif header == "VIDEO":
+            filename_ = save_path + filename
+            with open(filename_, "wb") as f:
+                f.write(data)
+            print(f"🎥 Vídeo guardado en {filename_}")
+            self.db_base.insert_media(robot_id=robot_id, path=filename_, es_video=True, checksum=base64.b64encode(checksum_bytes).decode("utf-8"), timestamp=timestamp_dt)
+            self.on_video(filename_)
+
+        else:
+            print("⚠️ Tipo de dato desconocido")
+
+    async def _media_client(self, reader, writer, save_path=os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "multi_socket/")):
+        """Versión asyncio de listen_robot para una conexión (mismo formato)."""
+        print(f"Conexión desde {writer.get_extra_info('peername')}")
+        try:
+            header = (await reader.readexactly(10)).decode().strip()
+            name_len = int.from_bytes(await reader.readexactly(2), 'big')
+            filename = (await reader.readexactly(name_len)).decode("utf-8")
+            robot_id = int.from_bytes(await reader.readexactly(2), 'big')
+            timestamp_dt = datetime.fromtimestamp(struct.unpack('>d', await reader.readexactly(8))[0])
+            checksum_bytes = await reader.readexactly(32)
+            size = int.from_bytes(await reader.readexactly(8), byteorder="big")
+            print(f"📩 {header} de robot {robot_id}: {filename}, {size} bytes, {timestamp_dt.isoformat()}")
+            try:
+                data = await reader.readexactly(size)
+            except asyncio.IncompleteReadError as e:
+                data = e.partial       # como listen_robot: se guarda lo recibido
+            os.makedirs(save_path, exist_ok=True)
+            await self.runtime.call(self._store_media, header, filename, robot_id, timestamp_dt,
+                                    checksum_bytes, data, save_path)
+        except Exception as e:
+            print(f"❌ Error recibiendo datos: {e}")
+        finally:
+            writer.close()
+
     def listen_streaming(self):
         """Escucha y muestra un stream de video H.264 enviado por el robot vía UDP."""
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -1190,11 +1479,7 @@ class LoRaNode:
                 data, addr = sock.recvfrom(65536)  # UDP máximo ~64 KB
                 if not data:
                     continue
-                print(f"📥 Frame recibido de {len(data)} bytes")
-                frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
-                if frame is not None:
-                    cv2.imshow("Live Stream", frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+                if not self._show_stream_frame(data):
                     break
         except KeyboardInterrupt:
             print("🛑 Recepción detenida")
@@ -1202,10 +1487,65 @@ class LoRaNode:
             sock.close()
             cv2.destroyAllWindows()
 
+    def _show_stream_frame(self, data) -> bool:
+        """Muestra un frame del stream; False si el usuario pulsa 'q'."""
+        print(f"📥 Frame recibido de {len(data)} bytes")
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is not None:
+            cv2.imshow("Live Stream", frame)
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+    async def _open_streaming(self):
+        """Versión asyncio de listen_streaming: se muestra sólo el último frame recibido."""
+        loop = asyncio.get_running_loop()
+        latest = asyncio.Queue(maxsize=1)
+        viewer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lora-video")  # HighGUI en un único hilo
+
+        class StreamProtocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                if not data:
+                    return
+                if latest.full():
+                    latest.get_nowait()         # frame atrasado: se descarta
+                latest.put_nowait(data)
+
+        async def show():
+            try:
+                while True:
+                    data = await latest.get()
+                    if not await loop.run_in_executor(viewer, self._show_stream_frame, data):
+                        break
+            finally:
+                viewer.submit(cv2.destroyAllWindows)
+                viewer.shutdown(wait=False)
+
+        transport, _ = await loop.create_datagram_endpoint(StreamProtocol, local_addr=('0.0.0.0', 5400))
+        print(f"Servidor escuchando en 0.0.0.0:5400...")
+        self.runtime.tasks.append(asyncio.create_task(show(), name="stream-view"))
+        return transport
+
 
     # -------------------- EJECUCIÓN --------------------
-    def run(self):
-        receive_th = threading.Thread(target=self.receive_loop, daemon=True).start()            
+    def run(self, use_asyncio=False):
+        """
+        use_asyncio: en lugar de un hilo por bucle, un único bucle asyncio
+        (AsyncRuntime) con la UART, los servidores TCP/UDP y las tareas periódicas.
+        """
+        if use_asyncio:
+            self.runtime = AsyncRuntime(self)
+        else:
+            for radio in self.radios:
+                threading.Thread(target=self.receive_loop, args=(radio,), daemon=True).start()
+        if isinstance(self.tx, RadioGroup):
+            self.tx.start()
+        elif not self.is_base:
+            self.channels.start()
+        if self.adr_enabled:
+            self.adr.start()
+        if self.runtime is None:
+            self.links.start()
+        elif hasattr(self.node, "get_channel_rssi") and getattr(self.node, "can_configure", False):
+            self.runtime.add_job("noise", self.links.sample_noise, self.links.noise_period)
         # -------------------- ROBOT --------------------
         if self.robot_port and self.robot_baudrate:
             flag_robot = self.connect_robot()
@@ -1215,41 +1555,81 @@ class LoRaNode:
         # -------------------- SENSORES --------------------
         if self.sens_port and self.sens_baudrate:
             self.connect_sensors()
-            sensor_th = threading.Thread(target=self.read_sensors_loop, daemon=True).start()
+            if self.runtime is None:
+                sensor_th = threading.Thread(target=self.read_sensors_loop, daemon=True).start()
+            else:
+                self.runtime.add_job("sensors", self.sensors_step, 30.0)
         # -------------------- BBDD --------------------
         if not self.is_base:
-            data_dir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "datos")
-            os.makedirs(data_dir, exist_ok=True)
-            db_path = os.path.join(data_dir, "robot_data.db")
-            if os.path.exists(db_path):
-                os.remove(db_path)
-            print("Creando BBDD SQLite.")
-            self.db = RobotDatabase(db_path)
+            os.makedirs(self.data_dir, exist_ok=True)
+            db_path = os.path.join(self.data_dir, "robot_data.db")
+            # La BBDD es la cola de salida: se conserva entre ejecuciones con lo
+            # pendiente de sincronizar y el estado de la sincronización
+            print("Abriendo BBDD SQLite.")
+            # Inserciones por lotes en un hilo: un comando de movimiento no espera al fsync de la SD
+            self.db = RobotDatabase(db_path, write_behind=True)
+            # Presupuesto de disco de fotos, vídeos y BBDD
+            self.storage = StorageManager(self.db, {"photos": getattr(self, "photo_dir", None),
+                                                    "videos": getattr(self, "video_dir", None)},
+                                          db_path=db_path, budgets=self.storage_budgets)
             self.sync = NodeSyncManager(self.db, self.addr)
-            bbdd_th = threading.Thread(target=self.sync_BBDD_sens_loop, daemon=True).start()
-            delete_data_th = threading.Thread(target=self.delete_BBDD_data, daemon=True).start()
+            if self.runtime is None:
+                bbdd_th = threading.Thread(target=self.sync_BBDD_loop, daemon=True).start()
+                delete_data_th = threading.Thread(target=self.delete_BBDD_data, daemon=True).start()
+            else:
+                self.runtime.add_job("sync", self.sync_step, 20.0)
+                self.runtime.add_job("delete", self.db.delete_synced_entries, 180.0)
         else:
             # connect_mongo()
-            print("Conectando a MongoDB.")
-            self.db_base = BaseStationDatabase()
+            if self.db_base is None:
+                print("Conectando a MongoDB.")
+                self.db_base = BaseStationDatabase()
             self.sync_base = BaseStationSyncManager(db=self.db_base)
         # -------------------- MuMULTIMEDIA --------------------
-        if self.is_base:
+        if self.runtime is not None:
+            if self.is_base:
+                self.runtime.add_server(lambda: asyncio.start_server(self._media_client, "0.0.0.0", 6000))
+                self.runtime.add_server(self._open_streaming)
+            else:
+                self.runtime.add_job("media", self.media_sync_step, 90.0)
+        elif self.is_base:
             wifi_th = threading.Thread(target=self.listen_robot, daemon=True).start()
             stream_th = threading.Thread(target=self.listen_streaming, daemon=True).start()
         else:
             sync_wifi_th = threading.Thread(target=self.sync_BDDD_wifi_loop, daemon=True).start()
         # -------------------- INFO PERIODICA --------------------
         if self.is_base:
-            status_th = threading.Thread(target=self.periodic_status, daemon=True).start()
+            if self.runtime is not None:
+                self.runtime.add_job("status", self.status_step, 40.0, blocking=False)
+            else:
+                status_th = threading.Thread(target=self.periodic_status, daemon=True).start()
+        if self.runtime is not None:
+            self.runtime.start()
 
         print(f"[{time.strftime('%H:%M:%S')}] LoRaNode running... Ctrl+C to stop")
     
     def stop(self):
         print(f"[{time.strftime('%H:%M:%S')}] Stopping LoRaNode...")
         self.running = False
+        if self.runtime is not None:
+            self.runtime.stop()
+        self.dispatcher.stop()
+        self.handlers.stop()
+        self.adr.stop()
+        self.links.stop()
+        self.channels.stop()
+        self.tx.stop(drain=2.0)
+        self.fragments.stop()
+        self.requests.stop()
+        if self.is_base:
+            self.liveness.stop()
+        elif getattr(self, "db", None) is not None:
+            if self.storage is not None:
+                self.storage.stop()
+            self.db.close()         # escribe las inserciones aún en cola
         time.sleep(0.2)
         if self.robot and self.robot.is_open:
             self.robot.close()
             self.sensores.close()
-        self.node.close()
\ No newline at end of file
+        for radio in self.radios:
+            radio.close()
\ No newline at end of file
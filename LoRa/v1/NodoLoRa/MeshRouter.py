@@ -0,0 +1,196 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from NodoLoRa.HeaderCodec import FLAG_BYTES, HEADER_SIZE, addresses
+
+# Saltos ya recorridos por el paquete: bits 3-4 del byte de flags de la cabecera
+HOP_SHIFT = 3
+HOP_MASK = 0x18
+MAX_HOPS = 3
+
+BROADCAST = 0xFFFF
+PATH_SEP = ">"          # separador de la ruta que los relés añaden a pings y respuestas
+
+
+def frame_hops(frame) -> int:
+    return (frame[4] & HOP_MASK) >> HOP_SHIFT
+
+
+class Route:
+    def __init__(self, next_hop, hops, expires):
+        self.next_hop = next_hop
+        self.hops = hops                # relés intermedios (0 = vecino directo)
+        self.expires = expires
+
+
+class MeshRouter:
+    """
+    Reenvío en malla para los nodos relé.
+
+      - Contador de saltos (bits 3-4 de los flags): cada relé lo incrementa y no
+        reenvía paquetes que ya han dado MAX_HOPS saltos.
+      - Caché de paquetes vistos con caducidad: cada relé reenvía un paquete una
+        sola vez, y las copias que llegan por varios caminos se descartan. Como
+        los msg_id son fijos por tipo de mensaje, la clave es (origen, destino,
+        tipo, msg_id, secuencia de transmisión, crc32 de los datos).
+      - Rutas con siguiente salto aprendidas de los pings periódicos y de sus
+        respuestas: cada relé que los reenvía añade '>addr' al texto, así que
+        quien los recibe sabe por qué relé llega cada nodo. Los paquetes recibidos
+        sin saltos marcan al emisor como vecino directo.
+      - Reenvío sólo hacia el destino: un paquete unicast se reenvía si hay ruta
+        al destino y su siguiente salto no es el mismo por el que llega el origen
+        (horizonte dividido); si no hay ruta, se descarta. Los de difusión se
+        reenvían una vez, hasta MAX_HOPS saltos.
+
+    El paquete se reenvía tal cual (sólo cambian los saltos), sin volver a
+    codificar los datos ni renumerar la secuencia del origen.
+    """
+    def __init__(self, node, max_hops=MAX_HOPS, seen_ttl=10.0, route_ttl=120.0, max_seen=1024):
+        self.node = node
+        self.max_hops = max_hops
+        self.seen_ttl = seen_ttl
+        self.route_ttl = route_ttl
+        self.max_seen = max_seen
+        self.lock = threading.Lock()
+        self.seen = OrderedDict()       # clave -> [caducidad, llegó reenviado, ya reenviado]
+        self.routes = {}                # addr -> Route
+        self.counters = {"forwarded": 0, "duplicates": 0, "no_route": 0, "backwards": 0, "ttl": 0}
+
+    # ---------------------------
+    # CABECERA
+    # ---------------------------
+    @staticmethod
+    def with_hops(frame, hops: int) -> bytes:
+        frame = bytearray(frame)
+        frame[4] = (frame[4] & ~HOP_MASK & 0xFF) | ((hops << HOP_SHIFT) & HOP_MASK)
+        return bytes(frame)
+
+    @staticmethod
+    def _is_ping(frame) -> bool:
+        # Ping (5) y respuesta estándar (2), en texto
+        return not frame[4] & FLAG_BYTES and (frame[5] & 0x7F) in (2, 5)
+
+    def key(self, frame) -> tuple:
+        payload = bytes(frame[HEADER_SIZE:])
+        if self._is_ping(frame):
+            payload = payload.split(PATH_SEP.encode(), 1)[0]   # la ruta cambia en cada salto
+        return (bytes(frame[0:4]), frame[4] >> 5, frame[5], frame[6], zlib.crc32(payload))
+
+    # ---------------------------
+    # RECEPCIÓN
+    # ---------------------------
+    def accept(self, frame) -> bool:
+        """
+        Registra el paquete en la caché. Devuelve False si es una copia de uno
+        ya recibido y alguna de las dos llegó reenviada por un relé.
+        """
+        now = time.monotonic()
+        relayed = frame_hops(frame) > 0
+        key = self.key(frame)
+        with self.lock:
+            self._expire(now)
+            entry = self.seen.get(key)
+            if entry is not None:
+                if relayed or entry[1]:
+                    self.counters["duplicates"] += 1
+                    return False
+                entry[0] = now + self.seen_ttl
+                self.seen.move_to_end(key)
+                return True
+            self.seen[key] = [now + self.seen_ttl, relayed, False]
+            while len(self.seen) > self.max_seen:
+                self.seen.popitem(last=False)
+        self.learn(frame)
+        return True
+
+    def _expire(self, now):
+        while self.seen:
+            entry = next(iter(self.seen.values()))
+            if entry[0] > now:
+                break
+            self.seen.popitem(last=False)
+
+    def learn(self, frame):
+        """Actualiza la ruta hacia el emisor del paquete."""
+        src = addresses(frame)[1]
+        if src == self.node.addr:
+            return
+        hops = frame_hops(frame)
+        if hops == 0:
+            self._set_route(src, src, 0)
+        elif self._is_ping(frame):
+            path = bytes(frame[HEADER_SIZE:]).decode(errors="ignore").split(PATH_SEP)[1:]
+            try:
+                relays = [int(a) for a in path]
+            except ValueError:
+                return
+            if relays:
+                self._set_route(src, relays[-1], len(relays))
+                for i, relay in enumerate(relays[:-1]):
+                    self._set_route(relay, relays[-1], len(relays) - 1 - i)
+
+    def _set_route(self, addr, next_hop, hops):
+        now = time.monotonic()
+        with self.lock:
+            r = self.routes.get(addr)
+            # Se prefiere la ruta más corta mientras no caduque
+            if r is None or r.expires < now or hops <= r.hops:
+                self.routes[addr] = Route(next_hop, hops, now + self.route_ttl)
+
+    def next_hop(self, addr):
+        with self.lock:
+            r = self.routes.get(addr)
+            if r is None or r.expires < time.monotonic():
+                return None
+            return r.next_hop
+
+    # ---------------------------
+    # REENVÍO
+    # ---------------------------
+    def forward(self, frame):
+        """Devuelve el paquete a reenviar (con un salto más) o None si no hay que reenviarlo."""
+        dest, src = addresses(frame)
+        hops = frame_hops(frame)
+        if src == self.node.addr or dest == self.node.addr:
+            return None
+        if hops >= self.max_hops:
+            self._count("ttl")
+            return None
+        if dest != BROADCAST:
+            via = self.next_hop(dest)
+            if via is None:
+                self._count("no_route")
+                return None
+            if via == self.next_hop(src):
+                self._count("backwards")
+                return None
+        key = self.key(frame)
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None:
+                if entry[2]:
+                    self.counters["duplicates"] += 1
+                    return None
+                entry[2] = True
+            self.counters["forwarded"] += 1
+        out = self.with_hops(frame, hops + 1)
+        if self._is_ping(frame):
+            out += f"{PATH_SEP}{self.node.addr}".encode()
+        return out
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def route_table(self) -> dict:
+        """{addr: {"next_hop", "hops", "ttl"}} de las rutas vigentes."""
+        now = time.monotonic()
+        with self.lock:
+            return {a: {"next_hop": r.next_hop, "hops": r.hops, "ttl": round(r.expires - now, 1)}
+                    for a, r in self.routes.items() if r.expires >= now}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, seen=len(self.seen))
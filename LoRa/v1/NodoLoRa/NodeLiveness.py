@@ -0,0 +1,111 @@
+import heapq
+import threading
+import time
+
+
+class NodeLiveness:
+    """
+    Nodos vivos vistos por la estación base (respuestas msg_type 2 al ping).
+
+    Cada nodo guarda su estado (robot, radar, sensores, cámara) y la hora a la
+    que se oyó por última vez. Un único hilo con un montículo de plazos da por
+    caídos los que llevan 'timeout' segundos sin responder: cada respuesta añade
+    un plazo nuevo y los antiguos se descartan al vencer si el nodo se ha oído
+    después, así que no hay un temporizador (ni un hilo) por nodo.
+
+    Los suscriptores (subscribe) reciben una copia {addr: estado} sólo cuando
+    algo cambia: un nodo nuevo, un estado distinto o un nodo caído; un ping que
+    confirma lo que ya se sabía no avisa a nadie.
+
+    lock: el de LoRaNode.lock_nodes, para que quien lea 'nodes' con él
+    (TdmaScheduler, la GUI) vea siempre un estado coherente.
+    """
+    def __init__(self, timeout=60.0, lock=None, on_alert=None):
+        self.timeout = timeout
+        self.on_alert = on_alert or print
+        self.cond = threading.Condition(lock or threading.Lock())
+        self.nodes = {}                 # addr -> {"robot", "radar", "sensors", "camera"}
+        self.last_seen = {}             # addr -> time.monotonic() de la última respuesta
+        self.heap = []                  # (plazo, addr)
+        self.subscribers = []
+        self.running = True
+        threading.Thread(target=self._expiry_loop, name="lora-liveness", daemon=True).start()
+
+    # ---------------------------
+    # API
+    # ---------------------------
+    def subscribe(self, fn):
+        """fn(nodes): se llama con una copia de los nodos vivos cada vez que cambian."""
+        self.subscribers.append(fn)
+        return fn
+
+    def seen(self, addr, state: dict) -> bool:
+        """Registra una respuesta de addr. Devuelve True si el nodo es nuevo o ha cambiado su estado."""
+        now = time.monotonic()
+        entry = (now + self.timeout, addr)
+        with self.cond:
+            changed = self.nodes.get(addr) != state
+            self.nodes[addr] = state
+            self.last_seen[addr] = now
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                self.cond.notify()      # sólo si es el plazo más próximo
+            snapshot = dict(self.nodes) if changed else None
+        if changed:
+            self.on_alert(f"[{time.strftime('%H:%M:%S')}] Nodo {addr}: {state}")
+            self._publish(snapshot)
+        return changed
+
+    def remove(self, addr, reason="eliminado") -> bool:
+        with self.cond:
+            if self.nodes.pop(addr, None) is None:
+                return False
+            del self.last_seen[addr]
+            snapshot = dict(self.nodes)
+        self.on_alert(f"[{time.strftime('%H:%M:%S')}] Nodo {addr} {reason}.")
+        self._publish(snapshot)
+        return True
+
+    def snapshot(self) -> dict:
+        """{addr: {estado..., "age": segundos desde la última respuesta}}"""
+        now = time.monotonic()
+        with self.cond:
+            return {
+                addr: dict(state, age=round(now - self.last_seen[addr], 1))
+                for addr, state in self.nodes.items()
+            }
+
+    # ---------------------------
+    # CADUCIDAD
+    # ---------------------------
+    def _expiry_loop(self):
+        while self.running:
+            expired = []
+            with self.cond:
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    _, addr = heapq.heappop(self.heap)
+                    last = self.last_seen.get(addr)
+                    if last is not None and last + self.timeout <= now:
+                        del self.nodes[addr]
+                        del self.last_seen[addr]
+                        expired.append(addr)
+                snapshot = dict(self.nodes) if expired else None
+                if not expired:
+                    self.cond.wait(self.heap[0][0] - now if self.heap else None)
+            for addr in expired:
+                self.on_alert(f"[{time.strftime('%H:%M:%S')}] Nodo {addr} eliminado por timeout.")
+            if expired:
+                self._publish(snapshot)
+
+    def _publish(self, snapshot):
+        for fn in list(self.subscribers):
+            try:
+                fn(snapshot)
+            except Exception as e:
+                print(f"[{time.strftime('%H:%M:%S')}] Error notificando nodos: {e}")
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
@@ -0,0 +1,83 @@
+import queue
+import threading
+import time
+
+
+class PacketDispatcher:
+    """
+    Reparte los paquetes recibidos entre un número fijo de hilos de trabajo.
+    Cada origen se asigna siempre al mismo hilo (addr % workers), de modo que
+    los paquetes de un mismo emisor se procesan en orden y los de emisores
+    distintos en paralelo. Las colas están acotadas: si la del hilo está llena,
+    submit() espera hasta 'put_timeout' y después descarta el paquete.
+    """
+    def __init__(self, handler, workers=4, max_queue=64, put_timeout=0.5, name="lora-worker"):
+        self.handler = handler
+        self.put_timeout = put_timeout
+        self.queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self.lock_stats = threading.Lock()
+        self.submitted = 0
+        self.handled = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.lat_sum = 0.0
+        self.lat_max = 0.0
+        self.running = True
+        self.threads = []
+        for i, q in enumerate(self.queues):
+            th = threading.Thread(target=self._worker, args=(q,), name=f"{name}-{i}", daemon=True)
+            th.start()
+            self.threads.append(th)
+
+    def submit(self, source: int, item, wait: bool = True) -> bool:
+        """Encola un paquete del origen indicado. Devuelve False si se descarta (wait=False: sin esperar)."""
+        q = self.queues[source % len(self.queues)]
+        try:
+            q.put((time.monotonic(), item), timeout=self.put_timeout if wait else 0)
+        except queue.Full:
+            with self.lock_stats:
+                self.dropped += 1
+            print(f"[{time.strftime('%H:%M:%S')}] ⚠️ Cola de procesado llena, paquete de {source} descartado.")
+            return False
+        with self.lock_stats:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, q.qsize())
+        return True
+
+    def _worker(self, q):
+        while self.running:
+            try:
+                t_in, item = q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.handler(item)
+            except Exception as e:
+                with self.lock_stats:
+                    self.errors += 1
+                print(f"[{time.strftime('%H:%M:%S')}] Error en el procesado del paquete: {e}")
+            finally:
+                latency = time.monotonic() - t_in
+                with self.lock_stats:
+                    self.handled += 1
+                    self.lat_sum += latency
+                    self.lat_max = max(self.lat_max, latency)
+                q.task_done()
+
+    def stats(self) -> dict:
+        """Contadores de profundidad de cola y latencia (cola + handler) en ms."""
+        with self.lock_stats:
+            return {
+                "depth": [q.qsize() for q in self.queues],
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "handled": self.handled,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "lat_avg_ms": round(1000 * self.lat_sum / self.handled, 1) if self.handled else 0.0,
+                "lat_max_ms": round(1000 * self.lat_max, 1),
+            }
+
+    def stop(self):
+        self.running = False
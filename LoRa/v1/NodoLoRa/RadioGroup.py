@@ -0,0 +1,240 @@
+import struct
+import threading
+import time
+from collections import deque
+
+from NodoLoRa.HeaderCodec import addresses
+from NodoLoRa.TxScheduler import PRIO_BULK, PRIO_TELEMETRY, TxScheduler
+
+# Cambio de canal (msg_type 9, mismos mensajes de configuración de radio que el ADR)
+CHANNEL_MOVE = 4    # EB -> robot: pasar a otra frecuencia
+CHANNEL_ACK = 5     # robot -> EB: acepta y cambia
+CHANNEL = struct.Struct(">BH")  # token, frecuencia (MHz)
+
+BROADCAST = 0xFFFF
+
+
+class RadioGroup:
+    """
+    Varias radios en la EB (p. ej. dos o tres adaptadores USB en canales
+    distintos), con la misma interfaz que TxScheduler para LoRaNode.
+
+    Cada radio tiene su propio planificador de transmisión; los paquetes salen
+    por la radio en la que se oyó por última vez al destino (la principal si aún
+    no se le ha oído) y los de difusión por todas. La recepción (un hilo por
+    radio en LoRaNode), el dispatcher, el RequestTracker y la BBDD son comunes.
+
+    Reparto por carga: cada 'period' segundos se suman los bytes recibidos por
+    radio en los últimos 'window' segundos y, si la diferencia entre la radio
+    más cargada y la menos cargada lo justifica, se pide a un robot de la
+    primera que pase a la frecuencia de la segunda (CHANNEL_MOVE). El robot
+    vuelve solo a su frecuencia inicial si deja de oír a la EB.
+
+    La radio principal (radios[0]) es la de la frecuencia inicial de los robots
+    y la única en la que actúa el ADR. Con TDMA cada radio tiene su propia
+    supertrama y su baliza, con los robots que se oyen en ella (radio_of).
+    """
+    def __init__(self, node, radios, duty_cycle=1.0, period=60.0, window=300.0, min_gain=0.2):
+        self.node = node
+        self.radios = radios
+        self.schedulers = [TxScheduler(r, duty_cycle=duty_cycle) for r in radios]
+        self.period = period
+        self.window = window
+        self.min_gain = min_gain
+        self.lock = threading.Lock()
+        self.heard_on = {}              # addr -> índice de la radio en la que se oyó
+        self.rx_log = deque()           # (instante, addr, índice de radio, bytes)
+        self.token = 0
+        self.moves = 0
+        self.acks = 0
+        self.running = True
+
+    @property
+    def gate(self):
+        return self.schedulers[0].gate
+
+    @gate.setter
+    def gate(self, gate):
+        self.schedulers[0].gate = gate
+
+    def start(self):
+        threading.Thread(target=self._balance_loop, name="lora-balance", daemon=True).start()
+
+    # ---------------------------
+    # TRANSMISIÓN
+    # ---------------------------
+    def radio_of(self, addr) -> int:
+        """Índice de la radio del robot (la principal si aún no se le ha oído)."""
+        with self.lock:
+            return self.heard_on.get(addr, 0)
+
+    def _scheduler_for(self, dest) -> TxScheduler:
+        return self.schedulers[self.radio_of(dest)]
+
+    def submit(self, frame: bytes, prio: int = PRIO_TELEMETRY, stamp: bool = True):
+        dest = addresses(frame)[0]
+        if dest == BROADCAST:
+            for tx in self.schedulers:
+                tx.submit(frame, prio, stamp)
+        else:
+            self._scheduler_for(dest).submit(frame, prio, stamp)
+
+    def submit_stream(self, frames, prio: int = PRIO_BULK, transfer=None, replace=False):
+        """Las transferencias (destino, tid) van por la radio del destino; el resto por la principal."""
+        dest = transfer[0] if isinstance(transfer, tuple) else None
+        if replace:
+            # El destino puede haber cambiado de radio desde el iterador anterior
+            for other in self.schedulers:
+                other.discard(transfer)
+        tx = self._scheduler_for(dest) if dest is not None else self.schedulers[0]
+        tx.submit_stream(frames, prio, transfer)
+
+    def cancel(self, transfer):
+        for tx in self.schedulers:
+            tx.cancel(transfer)
+
+    def cancel_bulk(self):
+        for tx in self.schedulers:
+            tx.cancel_bulk()
+
+    def stats(self) -> dict:
+        per_radio = [tx.stats() for tx in self.schedulers]
+        load = self.load()
+        with self.lock:
+            robots = [sorted(a for a, i in self.heard_on.items() if i == idx) for idx in range(len(self.radios))]
+        for idx, s in enumerate(per_radio):
+            s["freq"] = getattr(self.radios[idx], "freq", None)
+            s["robots"] = robots[idx]
+            s["rx_bytes"] = load[idx]
+        return {
+            "queued": sum(s["queued"] for s in per_radio),
+            "sent": [sum(col) for col in zip(*(s["sent"] for s in per_radio))],
+            "deferred": sum(s["deferred"] for s in per_radio),
+            "airtime_s": round(sum(s["airtime_s"] for s in per_radio), 2),
+            "duty": max(s["duty"] for s in per_radio),
+            "moves": self.moves,
+            "radios": per_radio,
+        }
+
+    def stop(self, drain=0.0):
+        self.running = False
+        for tx in self.schedulers:
+            tx.stop(drain=drain)
+
+    # ---------------------------
+    # RECEPCIÓN Y CARGA
+    # ---------------------------
+    def on_receive(self, radio, addr, n_bytes):
+        idx = self.radios.index(radio)
+        now = time.monotonic()
+        with self.lock:
+            self.heard_on[addr] = idx
+            self.rx_log.append((now, addr, idx, n_bytes))
+            while self.rx_log and now - self.rx_log[0][0] > self.window:
+                self.rx_log.popleft()
+
+    def _robot_load(self) -> dict:
+        """(addr, radio) -> bytes recibidos en la ventana."""
+        now = time.monotonic()
+        loads = {}
+        with self.lock:
+            for t, addr, idx, n in self.rx_log:
+                if now - t <= self.window:
+                    loads[(addr, idx)] = loads.get((addr, idx), 0) + n
+        return loads
+
+    def load(self) -> list:
+        totals = [0] * len(self.radios)
+        for (_, idx), n in self._robot_load().items():
+            totals[idx] += n
+        return totals
+
+    def rebalance(self):
+        """Mueve como mucho un robot de la radio más cargada a la menos cargada."""
+        loads = self._robot_load()
+        totals = self.load()
+        hi = max(range(len(totals)), key=totals.__getitem__)
+        lo = min(range(len(totals)), key=totals.__getitem__)
+        diff = totals[hi] - totals[lo]
+        if hi == lo or diff <= 0 or diff < self.min_gain * sum(totals):
+            return None
+        with self.lock:
+            candidates = [(n, addr) for (addr, idx), n in loads.items()
+                          if idx == hi and self.heard_on.get(addr) == hi]
+        # El robot cuya carga más acerca ambas radios a la mitad de la diferencia
+        candidates = [(abs(diff / 2 - n), addr) for n, addr in candidates if n < diff]
+        if not candidates:
+            return None
+        _, addr = min(candidates)
+        self.move(addr, lo)
+        return addr
+
+    def move(self, addr, idx):
+        freq = getattr(self.radios[idx], "freq")
+        with self.lock:
+            self.token = (self.token + 1) & 0xFF
+            token = self.token
+        self.moves += 1
+        self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] Radios: robot {addr} pasa a {freq} MHz")
+        self.node.send_data(addr, 9, CHANNEL_MOVE, CHANNEL.pack(token, freq))
+
+    def on_message(self, addr_sender, msg_id, payload):
+        if msg_id == CHANNEL_ACK:
+            self.acks += 1
+
+    def _balance_loop(self):
+        while self.running and self.node.running:
+            time.sleep(self.period)
+            try:
+                self.rebalance()
+            except Exception as e:
+                print(f"[{time.strftime('%H:%M:%S')}] Error repartiendo robots entre radios: {e}")
+
+
+class ChannelFollower:
+    """
+    Lado del robot del reparto por canales: atiende CHANNEL_MOVE cambiando la
+    frecuencia de su radio tras confirmar, y vuelve a la frecuencia inicial si
+    en 'revert_after' segundos no recibe nada en la nueva.
+    """
+    def __init__(self, node, revert_after=90.0):
+        self.node = node
+        self.revert_after = revert_after
+        self.home = getattr(node.node, "freq", None)
+        self.moved_at = 0.0
+        self.running = True
+
+    def start(self):
+        if getattr(self.node.node, "can_configure", False):
+            threading.Thread(target=self._watch_loop, name="lora-channel-watch", daemon=True).start()
+
+    def on_message(self, addr_sender, msg_id, payload):
+        if msg_id != CHANNEL_MOVE or not isinstance(payload, (bytes, bytearray)) or len(payload) < CHANNEL.size:
+            return
+        if not getattr(self.node.node, "can_configure", False):
+            return
+        _, freq = CHANNEL.unpack_from(payload)
+        self.node.send_data(addr_sender, 9, CHANNEL_ACK, bytes(payload[:CHANNEL.size]))
+        threading.Thread(target=self._move, args=(freq,), daemon=True).start()
+
+    def _move(self, freq):
+        self.node.adr._wait_tx_idle()       # que salga el ACK antes de cambiar
+        if self.node.node.set(freq=freq):
+            self.moved_at = time.monotonic()
+            self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] Canal: frecuencia {freq} MHz")
+        else:
+            self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] Canal: no se pudo cambiar a {freq} MHz")
+
+    def _watch_loop(self):
+        while self.running and self.node.running:
+            time.sleep(5.0)
+            now = time.monotonic()
+            if self.node.node.freq == self.home or now - self.moved_at < self.revert_after:
+                continue
+            if now - self.node.adr.last_rx > self.revert_after:
+                self.node.on_alert(f"[{time.strftime('%H:%M:%S')}] Canal: sin enlace, vuelta a {self.home} MHz")
+                self.node.node.set(freq=self.home)
+                self.moved_at = time.monotonic()
+
+    def stop(self):
+        self.running = False
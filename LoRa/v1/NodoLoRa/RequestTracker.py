@@ -0,0 +1,223 @@
+import heapq
+import itertools
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class PendingRequest:
+    def __init__(self, dest, msg_id, resend, retries, timeout):
+        self.dest = dest
+        self.msg_id = msg_id
+        self.resend = resend            # función que vuelve a encolar el paquete
+        self.retries = retries          # reintentos que quedan
+        self.timeout = timeout          # plazo fijo (None = usar RTO del destino)
+        self.first_sent = time.monotonic()
+        self.sent_at = self.first_sent
+        self.deadline = None
+        self.attempts = 1
+        self.future = Future()
+
+
+class LinkTimer:
+    """RTT suavizado y RTO de un destino (RFC 6298)."""
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial_rto):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+
+    def sample(self, rtt, min_rto, max_rto):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(max_rto, max(min_rto, self.srtt + 4 * self.rttvar))
+
+
+class RequestTracker:
+    """
+    Peticiones pendientes de respuesta, por (destino, msg_id).
+    Cada petición tiene un plazo calculado con el RTO del destino; un único hilo
+    con un montículo de plazos reintenta las que vencen (con backoff exponencial)
+    y da por perdidas las que agotan los reintentos. Las respuestas completan un
+    Future que el llamante puede esperar o al que puede añadir callbacks.
+    """
+    def __init__(self, initial_rto=3.0, min_rto=1.0, max_rto=60.0, max_retries=2, on_alert=None):
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_retries = max_retries
+        self.on_alert = on_alert or print
+        self.pending = {}               # (dest, msg_id) -> PendingRequest
+        self.timers = {}                # dest -> LinkTimer
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+        threading.Thread(target=self._timer_loop, name="lora-requests", daemon=True).start()
+
+    def _timer(self, dest) -> LinkTimer:
+        if dest not in self.timers:
+            self.timers[dest] = LinkTimer(self.initial_rto)
+        return self.timers[dest]
+
+    def _arm(self, req):
+        if req.timeout is not None:
+            wait = req.timeout
+        else:
+            # Backoff exponencial sobre el RTO del destino en cada reintento
+            wait = min(self.max_rto, self._timer(req.dest).rto * (2 ** (req.attempts - 1)))
+        req.deadline = req.sent_at + wait
+        heapq.heappush(self.heap, (req.deadline, next(self.seq), req))
+        self.cond.notify()
+
+    # ---------------------------
+    # API
+    # ---------------------------
+    def add(self, dest, msg_id, resend=None, retries=None, timeout=None) -> Future:
+        """Registra una petición enviada y devuelve el Future de su respuesta."""
+        key = (dest, msg_id & 0xFF)
+        req = PendingRequest(dest, msg_id & 0xFF, resend,
+                             self.max_retries if retries is None else retries, timeout)
+        if resend is None:
+            req.retries = 0
+        with self.cond:
+            old = self.pending.pop(key, None)
+            self.pending[key] = req
+            self._arm(req)
+        if old is not None and not old.future.done():
+            old.future.cancel()
+        return req.future
+
+    def complete(self, dest, msg_id, reply=None) -> bool:
+        """Marca como respondida una petición. Devuelve False si no estaba pendiente."""
+        with self.cond:
+            req = self.pending.pop((dest, msg_id & 0xFF), None)
+            if req is None:
+                return False
+            # Algoritmo de Karn: sólo se mide el RTT de peticiones no reenviadas
+            if req.attempts == 1:
+                self._timer(dest).sample(time.monotonic() - req.sent_at, self.min_rto, self.max_rto)
+        if not req.future.done():
+            req.future.set_result(reply)
+        return True
+
+    def snapshot(self) -> dict:
+        """Vista destino -> [msg_ids] de las peticiones pendientes."""
+        with self.cond:
+            view = {}
+            for dest, msg_id in self.pending:
+                view.setdefault(dest, []).append(msg_id)
+            return view
+
+    def link_stats(self, dest) -> dict:
+        with self.cond:
+            t = self.timers.get(dest)
+            if t is None:
+                return {"srtt": None, "rto": self.initial_rto}
+            return {"srtt": None if t.srtt is None else round(t.srtt, 3), "rto": round(t.rto, 3)}
+
+    # ---------------------------
+    # TEMPORIZADOR
+    # ---------------------------
+    def _timer_loop(self):
+        while self.running:
+            expired = []
+            with self.cond:
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    deadline, _, req = heapq.heappop(self.heap)
+                    # Entradas obsoletas: ya respondida o re-armada con otro plazo
+                    if self.pending.get((req.dest, req.msg_id)) is not req or req.deadline != deadline:
+                        continue
+                    if req.retries > 0:
+                        req.retries -= 1
+                        req.attempts += 1
+                        req.sent_at = now
+                        self._arm(req)
+                        expired.append((req, True))
+                    else:
+                        del self.pending[(req.dest, req.msg_id)]
+                        self._timer(req.dest).rto = min(self.max_rto, self._timer(req.dest).rto * 2)
+                        expired.append((req, False))
+                wait = self.heap[0][0] - now if self.heap else 0.5
+                if not expired:
+                    self.cond.wait(min(wait, 0.5))
+            for req, retry in expired:
+                if retry:
+                    self.on_alert(f"[{time.strftime('%H:%M:%S')}] Reintento {req.attempts - 1} de la petición {req.msg_id} a {req.dest}")
+                    try:
+                        req.resend()
+                    except Exception as e:
+                        print(f"Error reenviando petición {req.msg_id} a {req.dest}: {e}")
+                else:
+                    self.on_alert(f"[{time.strftime('%H:%M:%S')}] Petición {req.msg_id} a {req.dest} sin respuesta tras {req.attempts} intentos")
+                    if not req.future.done():
+                        req.future.set_exception(TimeoutError(f"Sin respuesta de {req.dest} a la petición {req.msg_id}"))
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+
+
+class ReplyCache:
+    """
+    Lado receptor de los reintentos: comandos ya atendidos, por (origen, tipo,
+    msg_id, crc32 de los datos). Un reintento de la EB es el mismo paquete, así
+    que no vuelve a ejecutar el handler: si el comando aún se está atendiendo
+    se descarta, y si ya se respondió se reenvían las respuestas guardadas.
+    Las entradas caducan a los 'ttl' segundos (los msg_id dan la vuelta).
+    """
+    def __init__(self, ttl=60.0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # clave -> [caducidad, [respuestas]]
+        self.open = {}                  # (origen, msg_id) -> clave del último comando
+        self.duplicates = 0
+
+    def check(self, packet):
+        """
+        None si el comando es nuevo (queda registrado). Si es repetido, la lista
+        de respuestas ya enviadas (vacía si todavía se está atendiendo).
+        """
+        key = (packet.src, packet.msg_type, packet.msg_id, zlib.crc32(packet.payload))
+        now = time.monotonic()
+        with self.lock:
+            while self.entries:
+                oldest = next(iter(self.entries))
+                if self.entries[oldest][0] > now and len(self.entries) <= self.max_entries:
+                    break
+                del self.entries[oldest]
+                if self.open.get((oldest[0], oldest[2])) == oldest:
+                    del self.open[(oldest[0], oldest[2])]
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.duplicates += 1
+                return list(entry[1])
+            self.entries[key] = [now + self.ttl, []]
+            self.open[(packet.src, packet.msg_id)] = key
+        return None
+
+    def forget(self, packet):
+        """Olvida un comando que no se llegó a atender, para que su reintento se ejecute."""
+        key = (packet.src, packet.msg_type, packet.msg_id, zlib.crc32(packet.payload))
+        with self.lock:
+            self.entries.pop(key, None)
+            if self.open.get((packet.src, packet.msg_id)) == key:
+                del self.open[(packet.src, packet.msg_id)]
+
+    def record(self, dest, msg_id, reply):
+        """Guarda una respuesta enviada a 'dest' para el comando msg_id en curso."""
+        with self.lock:
+            entry = self.entries.get(self.open.get((dest, msg_id & 0xFF)))
+            if entry is not None:
+                entry[1].append(reply)
@@ -0,0 +1,177 @@
+import threading
+import time
+
+from NodoLoRa.MeshRouter import PATH_SEP, frame_hops
+from NodoLoRa.TxScheduler import PRIO_CONTROL, time_on_air
+
+BEACON_PREFIX = "T"
+
+
+class TdmaScheduler:
+    """
+    Acceso al canal por ranuras de tiempo (TDMA) coordinado por la EB.
+
+    La EB difunde periódicamente una baliza (el ping, msg_type 5) con su hora y
+    el mapa de ranuras; la baliza marca el inicio de una supertrama:
+
+        | EB | contienda | robot 1 | robot 2 | ... |
+
+      - Ranura de la EB: baliza, ACKs y comandos (tantos paquetes como robots).
+      - Ranura de contienda (un paquete): robots que aún no están en el mapa
+        (su respuesta al ping es la petición de entrada) y alarmas.
+      - Una ranura por robot del mapa, de 'frames_per_slot' paquetes, en la que
+        envía su telemetría, sincronización y respuestas.
+
+    Las ranuras se dimensionan con el tiempo en el aire de un paquete completo
+    a la velocidad actual más un margen de guarda. Los paquetes de control
+    (PRIO_CONTROL) pueden salir también en la ranura de contienda. La EB decide
+    si se usa TDMA (enabled); los robots lo siguen en cuanto reciben una
+    baliza, y sin baliza reciente transmiten libremente como antes.
+
+    Formato de la baliza (texto, los relés añaden su ruta detrás):
+        T<hora de la EB, epoch s>;S<ms EB>,<ms contienda>,<ms robot>;M<addr>,<addr>,...
+    La baliza se construye justo al salir, así que su recepción menos su tiempo
+    en el aire es el inicio de la supertrama. Las balizas reenviadas por un relé
+    llegan con retraso: sólo se usan para sincronizar si no hay balizas directas.
+
+    En una EB con varias radios hay un TdmaScheduler por radio ('radio'), y
+    'owns(addr)' dice si un robot usa esa radio: cada baliza lleva sólo los
+    robots de su canal.
+    """
+    def __init__(self, node, frames_per_slot=2, guard=0.1, sync_timeout=120.0, max_frame=240, radio=None, owns=None):
+        self.node = node
+        self.radio = radio or node.node
+        self.owns = owns
+        self.frames_per_slot = frames_per_slot
+        self.guard = guard
+        self.sync_timeout = sync_timeout
+        self.max_frame = max_frame
+        self.lock = threading.Lock()
+        self.members = []           # mapa de ranuras: direcciones de los robots en orden
+        self.slots = None           # (ms EB, ms contienda, ms robot)
+        self.anchor = None          # instante local (monotonic) de inicio de supertrama
+        self.synced_at = 0.0
+        self.direct_at = 0.0
+        self.offset = 0.0           # hora de la EB - hora local (s)
+        self.beacons = 0
+        self.enabled = False
+
+    # ---------------------------
+    # DIMENSIONADO
+    # ---------------------------
+    def frame_time(self) -> float:
+        return time_on_air(self.max_frame, getattr(self.radio, "air_speed", 2400), getattr(self.radio, "uart_baud", 9600))
+
+    def layout(self, n_members: int) -> tuple:
+        frame = self.frame_time()
+        base = max(self.frames_per_slot, n_members) * frame + self.guard
+        contention = frame + self.guard
+        robot = self.frames_per_slot * frame + self.guard
+        return round(base * 1000), round(contention * 1000), round(robot * 1000)
+
+    def superframe(self) -> float:
+        base, contention, robot = self.slots
+        return (base + contention + robot * len(self.members)) / 1000
+
+    # ---------------------------
+    # BALIZA
+    # ---------------------------
+    def beacon_payload(self) -> str:
+        """EB: nuevo mapa de ranuras; la supertrama empieza ahora."""
+        with self.node.lock_nodes:
+            members = sorted(a for a in self.node.connected_nodes if self.owns is None or self.owns(a))
+        with self.lock:
+            self.members = members
+            self.slots = self.layout(len(members))
+            self.anchor = time.monotonic()
+            self.synced_at = self.anchor
+            self.beacons += 1
+            slots = ",".join(str(s) for s in self.slots)
+            return f"{BEACON_PREFIX}{time.time():.3f};S{slots};M{','.join(str(a) for a in members)}"
+
+    def beacon_frames(self):
+        """Iterador de un solo paquete para TxScheduler.submit_stream: se construye al salir."""
+        frame = self.node.pack_message(0xFFFF, 5, 0, self.beacon_payload())
+        if frame is not None:
+            yield frame
+
+    def on_beacon(self, message: str, frame) -> bool:
+        """Robot: baliza recibida. Devuelve False si el ping no lleva baliza."""
+        text = message.split(PATH_SEP, 1)[0]
+        if not text.startswith(BEACON_PREFIX):
+            return False
+        try:
+            fields = dict((f[0], f[1:]) for f in text.split(";") if f)
+            base_time = float(fields["T"])
+            slots = tuple(int(s) for s in fields["S"].split(","))
+            members = [int(a) for a in fields.get("M", "").split(",") if a]
+        except (KeyError, ValueError, IndexError):
+            return False
+        now = time.monotonic()
+        direct = frame_hops(frame) == 0
+        with self.lock:
+            if not direct and now - self.direct_at < self.sync_timeout:
+                return True         # ya hay balizas directas, más precisas
+            start = now - time_on_air(len(frame), getattr(self.radio, "air_speed", 2400),
+                                      getattr(self.radio, "uart_baud", 9600))
+            self.members = members
+            self.slots = slots
+            self.anchor = start
+            self.offset = base_time - (time.time() - (now - start))
+            self.synced_at = now
+            if direct:
+                self.direct_at = now
+            self.beacons += 1
+            self.enabled = True
+        return True
+
+    def base_time(self) -> float:
+        """Hora de la EB estimada con la última baliza."""
+        return time.time() + self.offset
+
+    # ---------------------------
+    # RANURAS
+    # ---------------------------
+    def synced(self) -> bool:
+        return self.anchor is not None and time.monotonic() - self.synced_at < self.sync_timeout
+
+    def _windows(self, prio) -> list:
+        """Ranuras (inicio, fin) en s desde el inicio de la supertrama en que puede transmitir este nodo."""
+        base, contention, robot = (s / 1000 for s in self.slots)
+        windows = []
+        if self.node.is_base:
+            windows.append((0.0, base))
+        elif self.node.addr in self.members:
+            start = base + contention + robot * self.members.index(self.node.addr)
+            windows.append((start, start + robot))
+        if prio == PRIO_CONTROL or not windows:
+            windows.append((base, base + contention))
+        return windows
+
+    def wait_time(self, prio) -> float:
+        """Segundos hasta poder transmitir un paquete completo con esta prioridad (0 = ya)."""
+        with self.lock:
+            if not self.enabled or not self.synced():
+                return 0.0
+            period = self.superframe()
+            if period <= 0:
+                return 0.0
+            need = self.frame_time()
+            pos = (time.monotonic() - self.anchor) % period
+            best = period
+            for start, end in self._windows(prio):
+                if start <= pos and pos + need <= end:
+                    return 0.0
+                best = min(best, (start - pos) % period)
+        return best
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "synced": self.synced(),
+                "members": list(self.members),
+                "slots_ms": self.slots,
+                "superframe_s": round(self.superframe(), 2) if self.slots else None,
+                "beacons": self.beacons,
+            }
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+# Clases de prioridad de transmisión (menor valor = más urgente)
+PRIO_CONTROL = 0      # seguridad / control (stop, comandos al robot, colisiones)
+PRIO_ACK = 1          # respuestas y ACKs
+PRIO_TELEMETRY = 2    # telemetría periódica (sensores, IMU, batería, ping)
+PRIO_BULK = 3         # sincronización BBDD e imágenes
+
+# Sobrecoste aproximado de cada paquete LoRa (preámbulo + cabecera + CRC) en bytes
+LORA_OVERHEAD_BYTES = 12
+
+# Secuencia de transmisión de 3 bits en los bits 5-7 del byte de flags de la
+# cabecera: permite a los vecinos contar los paquetes perdidos (LinkStats)
+SEQ_SHIFT = 5
+SEQ_MOD = 8
+
+# Marca de los paquetes reenviados por un relé (no se renumeran)
+FORWARDED = "forwarded"
+
+
+def time_on_air(n_bytes: int, air_speed: int, uart_baud: int = 9600) -> float:
+    """
+    Estimación del tiempo que el módulo está ocupado con un paquete de n_bytes:
+    la transferencia por la UART (10 bits por byte) más el tiempo en el aire a
+    la velocidad configurada.
+    """
+    uart = n_bytes * 10 / uart_baud
+    air = (n_bytes + LORA_OVERHEAD_BYTES) * 8 / air_speed
+    return uart + air
+
+
+class TxScheduler:
+    """
+    Único punto de salida hacia la radio.
+    Los paquetes se ordenan por prioridad (y por orden de llegada dentro de cada
+    clase), se espacian según su tiempo en el aire y respetan un presupuesto de
+    duty-cycle sobre una ventana deslizante. Los paquetes de control no esperan
+    al presupuesto, pero su tiempo en el aire sí se contabiliza.
+
+    Las transferencias largas (imágenes) se encolan como un iterador de
+    fragmentos: sólo se extrae el siguiente fragmento cuando le toca salir, así
+    que cualquier mensaje más prioritario se cuela entre dos fragmentos y
+    cancel() puede abortar la transferencia.
+
+    'gate' (opcional, p. ej. TdmaScheduler.wait_time) dice cuántos segundos
+    faltan para poder transmitir con la prioridad del primero de la cola.
+
+    Cada paquete propio se numera al salir (stamp), en el orden real de
+    transmisión; los reenviados por un relé conservan la secuencia del origen.
+    """
+    def __init__(self, radio, duty_cycle=1.0, window=3600.0):
+        self.radio = radio
+        self.duty_cycle = duty_cycle
+        self.window = window
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.cancelled = set()
+        self.airtime_log = deque()          # (instante, tiempo en el aire)
+        self.airtime_used = 0.0
+        self.sent = [0, 0, 0, 0]
+        self.deferred = 0
+        self.tx_seq = 0
+        self.gate = None                    # prio -> segundos hasta poder transmitir
+        self.access = None                  # escucha antes de transmitir (ListenBeforeTalk)
+        self.running = True
+        self.thread = threading.Thread(target=self._tx_loop, name="lora-tx", daemon=True)
+        self.thread.start()
+
+    # ---------------------------
+    # ENCOLAR
+    # ---------------------------
+    def submit(self, frame: bytes, prio: int = PRIO_TELEMETRY, stamp: bool = True):
+        with self.cond:
+            heapq.heappush(self.heap, (prio, next(self.seq), None if stamp else FORWARDED, frame))
+            self.cond.notify()
+
+    def submit_stream(self, frames, prio: int = PRIO_BULK, transfer=None, replace=False):
+        """
+        Encola un iterador de paquetes que se envían de uno en uno.
+        replace: sustituye al iterador de la misma transferencia que siga en cola.
+        """
+        with self.cond:
+            self.cancelled.discard(transfer)
+            if replace:
+                self._discard(transfer)
+            heapq.heappush(self.heap, (prio, next(self.seq), transfer, iter(frames)))
+            self.cond.notify()
+
+    def discard(self, transfer):
+        """Quita de la cola el iterador de una transferencia sin darla por cancelada."""
+        with self.cond:
+            self._discard(transfer)
+
+    def _discard(self, transfer):
+        if transfer is None:
+            return
+        self.heap = [e for e in self.heap if e[2] != transfer or isinstance(e[3], (bytes, bytearray))]
+        heapq.heapify(self.heap)
+
+    def cancel(self, transfer):
+        """Aborta una transferencia entre dos fragmentos."""
+        with self.cond:
+            self.cancelled.add(transfer)
+
+    def cancel_bulk(self):
+        """Aborta todas las transferencias por fragmentos en curso."""
+        with self.cond:
+            for prio, _, transfer, item in self.heap:
+                if not isinstance(item, (bytes, bytearray)):
+                    self.cancelled.add(transfer)
+
+    # ---------------------------
+    # PRESUPUESTO DE AIRE
+    # ---------------------------
+    def _expire_airtime(self, now):
+        while self.airtime_log and now - self.airtime_log[0][0] > self.window:
+            self.airtime_used -= self.airtime_log.popleft()[1]
+
+    def _budget_wait(self, toa, now) -> float:
+        """Segundos a esperar para no superar el duty-cycle (0 si hay presupuesto)."""
+        if self.duty_cycle >= 1.0:
+            return 0.0
+        self._expire_airtime(now)
+        budget = self.duty_cycle * self.window
+        if self.airtime_used + toa <= budget or not self.airtime_log:
+            return 0.0
+        # Hay que esperar a que caduque aire suficiente de la ventana
+        excess = self.airtime_used + toa - budget
+        freed = 0.0
+        for t, a in self.airtime_log:
+            freed += a
+            if freed >= excess:
+                return max(0.0, t + self.window - now)
+        return self.window
+
+    # ---------------------------
+    # HILO DE TRANSMISIÓN
+    # ---------------------------
+    def stamp(self, frame) -> bytes:
+        """Pone la secuencia de transmisión en los flags de la cabecera."""
+        if len(frame) < 7:
+            return frame
+        frame = bytearray(frame)
+        frame[4] = (frame[4] & ((1 << SEQ_SHIFT) - 1)) | (self.tx_seq << SEQ_SHIFT)
+        self.tx_seq = (self.tx_seq + 1) % SEQ_MOD
+        return frame
+
+    def _next_frame(self):
+        """Saca el paquete más prioritario (o el siguiente fragmento de un iterador)."""
+        while self.heap:
+            prio, seq, transfer, item = heapq.heappop(self.heap)
+            if isinstance(item, (bytes, bytearray)):
+                return prio, item if transfer is FORWARDED else self.stamp(item)
+            if transfer in self.cancelled:
+                self.cancelled.discard(transfer)
+                print(f"[{time.strftime('%H:%M:%S')}] Transferencia {transfer} cancelada.")
+                continue
+            frame = next(item, None)
+            if frame is None:
+                continue
+            # El resto del iterador vuelve a la cola detrás de lo ya encolado
+            heapq.heappush(self.heap, (prio, next(self.seq), transfer, item))
+            return prio, self.stamp(frame)
+        return None, None
+
+    def _tx_loop(self):
+        while self.running:
+            with self.cond:
+                while self.running and not self.heap:
+                    self.cond.wait(0.5)
+                if not self.running:
+                    break
+                head = self.heap[0][0]
+            wait = self.gate(head) if self.gate is not None else 0.0
+            if wait > 0:
+                # Fuera de ranura: se espera, pero un paquete nuevo más prioritario despierta el hilo
+                with self.cond:
+                    self.cond.wait(min(wait, 0.5))
+                continue
+            with self.cond:
+                prio, frame = self._next_frame()
+            if frame is None:
+                continue
+
+            toa = time_on_air(len(frame), getattr(self.radio, "air_speed", 2400), getattr(self.radio, "uart_baud", 9600))
+            if prio != PRIO_CONTROL:
+                with self.cond:
+                    wait = self._budget_wait(toa, time.monotonic())
+                if wait > 0:
+                    self.deferred += 1
+                    print(f"[{time.strftime('%H:%M:%S')}] Duty-cycle agotado, esperando {wait:.1f}s.")
+                    time.sleep(wait)
+            if self.access is not None:
+                self.access.wait_clear(prio)
+            try:
+                self.radio.send_bytes(frame)
+            except Exception as e:
+                print(f"[{time.strftime('%H:%M:%S')}] Error enviando por LoRa: {e}")
+                continue
+            with self.cond:
+                self.airtime_log.append((time.monotonic(), toa))
+                self.airtime_used += toa
+                self.sent[prio] += 1
+            # El módulo es half-duplex: no se le pasa otro paquete hasta que termine
+            time.sleep(toa)
+
+    def stats(self) -> dict:
+        with self.cond:
+            self._expire_airtime(time.monotonic())
+            return {
+                "queued": len(self.heap),
+                "sent": list(self.sent),
+                "deferred": self.deferred,
+                "airtime_s": round(self.airtime_used, 2),
+                "duty": round(self.airtime_used / self.window, 4),
+            }
+
+    def stop(self, drain=0.0):
+        """Detiene el hilo; antes espera hasta 'drain' segundos a vaciar la cola."""
+        self.cancel_bulk()
+        deadline = time.monotonic() + drain
+        while self.heap and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
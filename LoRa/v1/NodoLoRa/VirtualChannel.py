@@ -0,0 +1,238 @@
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+
+from NodoLoRa.TxScheduler import LORA_OVERHEAD_BYTES
+from NodoLoRa.sx126x_bis import FRAME_GAP, SENSITIVITY, split_rssi
+
+
+class VirtualRadio:
+    """
+    Radio simulada con la misma interfaz que sx126x (send_bytes, receive_frames,
+    receive_bytes, close, air_speed, get_channel_rssi, channel_busy), conectada a un VirtualChannel.
+    """
+    def __init__(self, channel, addr, freq=433, air_speed=2400, rssi=True, buffer_size=240, tx_dbm=-80, noise_dbm=-115):
+        self.channel = channel
+        self.addr = addr
+        self.freq = freq
+        self.air_speed = air_speed
+        self.rssi = rssi
+        self.buffer_size = buffer_size
+        self.tx_dbm = tx_dbm            # nivel con el que los demás oyen a esta radio
+        self.noise_dbm = noise_dbm      # ruido del canal en esta radio
+        self.last_rssi = None
+        self.collisions = 0             # paquetes propios que colisionaron
+        self.rx_queue = queue.Queue()
+        self.rx_frames = []
+        self.tx_until = 0.0             # half-duplex: no recibe mientras transmite
+
+    # Misma API de configuración que sx126x; el cambio es inmediato
+    can_configure = True
+    uart_baud = 9600
+
+    def set(self, persist=False, **changes) -> bool:
+        for k, v in changes.items():
+            setattr(self, k, v)
+        return True
+
+    def set_air_speed(self, air_speed: int) -> bool:
+        return self.set(air_speed=air_speed)
+
+    def set_uart_baud(self, uart_baud: int) -> bool:
+        return self.set(uart_baud=uart_baud)
+
+    def get_channel_rssi(self):
+        return self.noise_dbm, self.last_rssi
+
+    def channel_busy(self, threshold=-100) -> bool:
+        return self.channel.carrier(self, threshold)
+
+    def send_bytes(self, data):
+        self.channel.transmit(self, bytes(data))
+
+    def receive_frames(self) -> list:
+        try:
+            frames = [self.rx_queue.get(timeout=FRAME_GAP)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                frames.append(self.rx_queue.get_nowait())
+            except queue.Empty:
+                break
+        # Como el módulo: el RSSI llega como último byte y se separa igual que en sx126x
+        frames = [split_rssi(f, self.rssi) for f in frames]
+        if frames[-1].rssi is not None:
+            self.last_rssi = frames[-1].rssi
+        return frames
+
+    def receive_bytes(self):
+        if not self.rx_frames:
+            self.rx_frames.extend(self.receive_frames())
+        return self.rx_frames.pop(0) if self.rx_frames else None
+
+    def close(self):
+        self.channel.detach(self)
+
+
+class Transmission:
+    def __init__(self, sender, frame, start, end):
+        self.sender = sender
+        self.frame = frame
+        self.start = start
+        self.end = end
+        self.freq = sender.freq
+        self.air_speed = sender.air_speed
+
+
+class VirtualChannel:
+    """
+    Canal LoRa en memoria para probar la red sin módulos reales.
+
+    Modela el tiempo en el aire según la velocidad de cada radio, la MTU del
+    módulo (los paquetes más largos se parten como en el E22), pérdidas
+    aleatorias por enlace, colisiones entre transmisiones solapadas en la misma
+    frecuencia, half-duplex y RSSI por enlace (se añade como último byte si la
+    radio receptora tiene rssi=True). Un paquete sólo se entrega a radios con la
+    misma frecuencia y velocidad, y si su RSSI supera la sensibilidad.
+    """
+    def __init__(self, loss=0.0, mtu=240, collisions=True, time_scale=1.0, seed=None):
+        self.loss = loss
+        self.mtu = mtu
+        self.collisions = collisions
+        self.time_scale = time_scale    # <1 acelera el tiempo en el aire
+        self.rand = random.Random(seed)
+        self.radios = []
+        self.links = {}                 # (emisor, receptor) -> {"rssi": dBm, "loss": p}
+        self.active = []                # transmisiones recientes, para detectar solapes
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.counters = {"tx": 0, "tx_bytes": 0, "delivered": 0, "lost": 0,
+                         "collided": 0, "weak": 0, "split": 0}
+        self.busy = 0.0
+        self.started = time.monotonic()
+        self.running = True
+        threading.Thread(target=self._deliver_loop, name="lora-sim", daemon=True).start()
+
+    # ---------------------------
+    # TOPOLOGÍA
+    # ---------------------------
+    def radio(self, addr, **kwargs) -> VirtualRadio:
+        r = VirtualRadio(self, addr, **kwargs)
+        with self.cond:
+            self.radios.append(r)
+        return r
+
+    def detach(self, radio):
+        with self.cond:
+            if radio in self.radios:
+                self.radios.remove(radio)
+
+    def set_link(self, a, b, rssi=None, loss=None, symmetric=True):
+        """Fija el RSSI (dBm) y/o la pérdida del enlace entre las direcciones a y b."""
+        pairs = [(a, b), (b, a)] if symmetric else [(a, b)]
+        with self.cond:
+            for pair in pairs:
+                link = self.links.setdefault(pair, {})
+                if rssi is not None:
+                    link["rssi"] = rssi
+                if loss is not None:
+                    link["loss"] = loss
+
+    def _link(self, sender, receiver):
+        link = self.links.get((sender.addr, receiver.addr), {})
+        return link.get("rssi", sender.tx_dbm), link.get("loss", self.loss)
+
+    # ---------------------------
+    # TRANSMISIÓN
+    # ---------------------------
+    def airtime(self, n_bytes, air_speed) -> float:
+        return (n_bytes + LORA_OVERHEAD_BYTES) * 8 / air_speed * self.time_scale
+
+    def transmit(self, sender, frame: bytes):
+        # El módulo parte en trozos de MTU lo que le llega por la UART
+        chunks = [frame[i:i + self.mtu] for i in range(0, len(frame), self.mtu)] or [b""]
+        with self.cond:
+            start = max(time.monotonic(), sender.tx_until)
+            if len(chunks) > 1:
+                self.counters["split"] += 1
+            for chunk in chunks:
+                end = start + self.airtime(len(chunk), sender.air_speed)
+                tx = Transmission(sender, chunk, start, end)
+                self.active.append(tx)
+                heapq.heappush(self.heap, (end, next(self.seq), tx))
+                self.counters["tx"] += 1
+                self.counters["tx_bytes"] += len(chunk)
+                self.busy += end - start
+                start = end
+            sender.tx_until = start
+            self.cond.notify()
+
+    def carrier(self, radio, threshold) -> bool:
+        """Detección de portadora: alguna transmisión en curso que radio oye por encima de threshold dBm."""
+        now = time.monotonic()
+        with self.cond:
+            for tx in self.active:
+                if tx.sender is radio or tx.freq != radio.freq or not tx.start <= now < tx.end:
+                    continue
+                if self._link(tx.sender, radio)[0] >= threshold:
+                    return True
+        return False
+
+    def _overlaps(self, tx) -> bool:
+        return any(o is not tx and o.freq == tx.freq and o.start < tx.end and tx.start < o.end
+                   for o in self.active)
+
+    def _deliver(self, tx):
+        collided = self.collisions and self._overlaps(tx)
+        if collided:
+            tx.sender.collisions += 1
+        for r in self.radios:
+            if r is tx.sender or r.freq != tx.freq or r.air_speed != tx.air_speed:
+                continue
+            if r.tx_until > tx.start:
+                continue                # transmitiendo: no escucha
+            if collided:
+                self.counters["collided"] += 1
+                continue
+            rssi, loss = self._link(tx.sender, r)
+            if rssi < SENSITIVITY.get(tx.air_speed, -138):
+                self.counters["weak"] += 1
+                continue
+            if self.rand.random() < loss:
+                self.counters["lost"] += 1
+                continue
+            frame = tx.frame
+            if r.rssi:
+                frame += bytes([max(0, min(255, 256 + int(rssi)))])
+            r.rx_queue.put(frame)
+            self.counters["delivered"] += 1
+
+    def _deliver_loop(self):
+        while self.running:
+            with self.cond:
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    _, _, tx = heapq.heappop(self.heap)
+                    self._deliver(tx)
+                # Se conservan las transmisiones que aún pueden solapar con otras
+                oldest = min((t.start for _, _, t in self.heap), default=now)
+                self.active = [t for t in self.active if t.end > oldest]
+                wait = self.heap[0][0] - now if self.heap else 0.5
+                self.cond.wait(min(wait, 0.5))
+
+    def stats(self) -> dict:
+        with self.cond:
+            s = dict(self.counters)
+            elapsed = time.monotonic() - self.started
+            s["busy"] = round(self.busy / elapsed, 3) if elapsed > 0 else 0.0
+            return s
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
@@ -1,8 +1,83 @@
 import serial
+import threading
 import time
 
+try:
+    import RPi.GPIO as GPIO  # type: ignore
+except ImportError:
+    GPIO = None             # PC / adaptador USB: M0 y M1 van por jumper
+
 END_CHAR = b'\n\r'
 
+# Silencio mínimo en la UART que separa dos paquetes consecutivos del módulo.
+# El E22 vuelca cada paquete recibido por aire de golpe, así que dentro de un
+# paquete no hay huecos; 20 ms cubre también el latency timer de los USB-serie.
+FRAME_GAP = 0.02
+
+# Cabecera de la respuesta del módulo a la lectura de RSSI (C0 C1 C2 C3 00 02)
+RSSI_REPLY = bytes([0xC1, 0x00, 0x02])
+# Lecturas de ruido seguidas sin respuesta antes de dejar de preguntar, y
+# segundos hasta volver a intentarlo
+NOISE_MAX_MISSES = 3
+NOISE_REPROBE = 60.0
+
+# Sensibilidad aproximada del E22 (dBm) para cada velocidad en el aire (bps)
+SENSITIVITY = {
+    300: -147, 1200: -141, 2400: -138, 4800: -135,
+    9600: -132, 19200: -129, 38400: -126, 62500: -123,
+}
+
+
+class RxFrame(bytes):
+    """Paquete recibido. rssi: RSSI del paquete en dBm (None si el módulo no lo añade)."""
+    rssi = None
+
+
+def split_rssi(frame: bytes, rssi: bool) -> RxFrame:
+    """Separa el byte de RSSI que el módulo añade al final de cada paquete con rssi=True."""
+    if not rssi or len(frame) < 2:
+        return RxFrame(frame)
+    out = RxFrame(frame[:-1])
+    out.rssi = -(256 - frame[-1])
+    return out
+
+
+class FrameParser:
+    """
+    Parser incremental de la UART del módulo.
+    Separa paquetes por longitud máxima (buffer_size + byte de RSSI) o por un
+    silencio de 'gap' segundos tras el último byte, y entrega cada paquete en
+    cuanto llega su último byte, aunque vengan varios seguidos.
+    """
+    def __init__(self, max_len=240, rssi=False, gap=FRAME_GAP):
+        self.max_len = max_len + (1 if rssi else 0)
+        self.gap = gap
+        self.buff = bytearray()
+        self.last_rx = 0.0
+
+    def feed(self, data: bytes, now: float = None) -> list:
+        """Añade bytes leídos y devuelve la lista de paquetes completos."""
+        now = time.monotonic() if now is None else now
+        frames = []
+        if data:
+            # Bytes tras un silencio largo pertenecen a un paquete nuevo
+            if self.buff and now - self.last_rx >= self.gap:
+                frames.append(bytes(self.buff))
+                self.buff.clear()
+            self.buff += data
+            self.last_rx = now
+            while len(self.buff) >= self.max_len:
+                frames.append(bytes(self.buff[:self.max_len]))
+                del self.buff[:self.max_len]
+        elif self.buff and now - self.last_rx >= self.gap:
+            frames.append(bytes(self.buff))
+            self.buff.clear()
+        return frames
+
+    def reset(self):
+        self.buff.clear()
+
+
 class sx126x:
         # Configuration registers
     cfg_reg = [0xC2, 0x00, 0x09, 0x00, 0x00, 0x00, 0x62, 0x00, 0x12, 0x43, 0x00, 0x00]
@@ -33,15 +108,278 @@ class sx126x:
     SX126X_Power_13dBm = 0x02
     SX126X_Power_10dBm = 0x03
 
-    def __init__(self, serial_num, freq, addr, power, rssi=False, air_speed=2400, net_id=0, buffer_size=240, crypt=0, relay=False, lbt=False, wor=False):
+    lora_air_speed_dic = {
+        300: 0x00,
+        1200: 0x01,
+        2400: 0x02,
+        4800: 0x03,
+        9600: 0x04,
+        19200: 0x05,
+        38400: 0x06,
+        62500: 0x07
+    }
+
+    uart_baudrate_dic = {
+        1200: SX126X_UART_BAUDRATE_1200,
+        2400: SX126X_UART_BAUDRATE_2400,
+        4800: SX126X_UART_BAUDRATE_4800,
+        9600: SX126X_UART_BAUDRATE_9600,
+        19200: SX126X_UART_BAUDRATE_19200,
+        38400: SX126X_UART_BAUDRATE_38400,
+        57600: SX126X_UART_BAUDRATE_57600,
+        115200: SX126X_UART_BAUDRATE_115200
+    }
+
+    lora_power_dic = {
+        22: SX126X_Power_22dBm,
+        17: SX126X_Power_17dBm,
+        13: SX126X_Power_13dBm,
+        10: SX126X_Power_10dBm
+    }
+
+    lora_buffer_size_dic = {
+        240: SX126X_PACKAGE_SIZE_240_BYTE,
+        128: SX126X_PACKAGE_SIZE_128_BYTE,
+        64: SX126X_PACKAGE_SIZE_64_BYTE,
+        32: SX126X_PACKAGE_SIZE_32_BYTE
+    }
+
+    def __init__(self, serial_num, freq, addr, power, rssi=False, air_speed=2400, net_id=0, buffer_size=240, crypt=0, relay=False, lbt=False, wor=False,
+                 uart_baud=9600, m0=None, m1=None, module_addr=0xFFFF):
+        """
+        m0, m1: pines BCM que controlan el modo del módulo. Sin ellos (o sin
+        RPi.GPIO) no se puede entrar en modo configuración y se usa la
+        configuración guardada en el módulo.
+        module_addr: dirección programada en el módulo. Por defecto 0xFFFF
+        (escucha todo): el direccionamiento lo hace la cabecera de LoRaNode.
+        """
         self.serial_n = serial_num
         self.freq = freq
         self.addr = addr
         self.power = power
         self.rssi = rssi
-        self.ser = serial.Serial(serial_num, baudrate=9600, timeout=0.1)
+        self.air_speed = air_speed
+        self.buffer_size = buffer_size
+        self.net_id = net_id
+        self.crypt = crypt
+        self.relay = relay
+        self.lbt = lbt
+        self.wor = wor
+        self.uart_baud = uart_baud
+        self.module_addr = module_addr
+        self.m0 = m0
+        self.m1 = m1
+        self.cfg_reg = list(sx126x.cfg_reg)
+        self.lock = threading.Lock()
+        # El timeout de lectura es el propio hueco entre paquetes: read() vuelve
+        # en cuanto hay datos o tras FRAME_GAP sin ellos.
+        self.ser = serial.Serial(serial_num, baudrate=uart_baud, timeout=FRAME_GAP)
         self.ser.flushInput()
+        self.parser = FrameParser(max_len=buffer_size, rssi=rssi, gap=FRAME_GAP)
+        self.rx_frames = []
+        self.held = []              # paquetes completados durante get_channel_rssi
+        # Sólo se pregunta el ruido si el registro está habilitado (REG1 bit 5,
+        # lo escribe set()): si no, el comando saldría por el aire como datos
+        self.noise_enabled = False
+        self.noise_misses = 0
+        self.noise_retry_at = 0.0
+
+        if self.can_configure:
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setwarnings(False)
+            GPIO.setup(self.m0, GPIO.OUT)
+            GPIO.setup(self.m1, GPIO.OUT)
+            self.set()
+            print(f"Configuración del módulo: {self.get_settings()}")
+        else:
+            print("sx126x: sin control de M0/M1, se usa la configuración guardada en el módulo.")
+
+    # ---------------------------
+    # CONFIGURACIÓN
+    # ---------------------------
+    @property
+    def can_configure(self) -> bool:
+        return GPIO is not None and self.m0 is not None and self.m1 is not None
+
+    def _mode(self, config: bool):
+        """Modo configuración (M0=0, M1=1) o transmisión normal (M0=0, M1=0)."""
+        GPIO.output(self.m0, GPIO.LOW)
+        GPIO.output(self.m1, GPIO.HIGH if config else GPIO.LOW)
+        time.sleep(0.1)
+
+    def _channel(self):
+        if self.freq > 850:
+            return 850, self.freq - 850
+        return 410, self.freq - 410
+
+    def build_config(self, persist=False) -> list:
+        """Registros 00H-08H a partir de los atributos actuales (mismo formato que sx126x.set del fabricante)."""
+        start_freq, channel = self._channel()
+        self.start_freq = start_freq
+        self.offset_freq = channel
+        reg = [0xC0 if persist else 0xC2, 0x00, 0x09]
+        reg.append((self.module_addr >> 8) & 0xFF)
+        reg.append(self.module_addr & 0xFF)
+        reg.append(self.net_id & 0xFF)
+        reg.append(self.uart_baudrate_dic[self.uart_baud] + self.lora_air_speed_dic[self.air_speed])
+        # 0x20: habilita la lectura del ruido del canal (get_channel_rssi)
+        reg.append(self.lora_buffer_size_dic[self.buffer_size] + self.lora_power_dic.get(self.power, self.SX126X_Power_22dBm) + 0x20)
+        reg.append(channel & 0xFF)
+        # REG3: byte de RSSI tras cada paquete (0x80), relay (0x20), LBT (0x10),
+        # WOR (0x08) y ciclo WOR 2000 ms (0x03). Modo transparente: la cabecera
+        # del paquete la pone LoRaNode.
+        reg.append((0x80 if self.rssi else 0) | (0x20 if self.relay else 0) | (0x10 if self.lbt else 0)
+                   | (0x08 if self.wor else 0) | 0x03)
+        reg.append((self.crypt >> 8) & 0xFF)
+        reg.append(self.crypt & 0xFF)
+        return reg
+
+    def _command(self, cmd: bytes, reply_len: int, retries=2):
+        """Envía un comando en modo configuración (UART a 9600) y devuelve la respuesta."""
+        self.ser.baudrate = 9600
+        for _ in range(retries):
+            self.ser.reset_input_buffer()
+            self.ser.write(cmd)
+            deadline = time.monotonic() + 0.5
+            reply = b""
+            while len(reply) < reply_len and time.monotonic() < deadline:
+                reply += self.ser.read(reply_len - len(reply))
+            if len(reply) >= 3 and reply[0] == 0xC1:
+                return reply
+        return None
+
+    def set(self, persist=False, **changes) -> bool:
+        """
+        Programa los registros del módulo. Admite los mismos parámetros que el
+        constructor (freq, power, rssi, air_speed, net_id, buffer_size, crypt,
+        relay, lbt, wor, uart_baud, module_addr); los no indicados no cambian.
+        Si la escritura falla se restauran los valores anteriores.
+        """
+        if not self.can_configure:
+            print("sx126x: no se puede configurar el módulo sin M0/M1.")
+            return False
+        previous = {k: getattr(self, k) for k in changes}
+        for k, v in changes.items():
+            setattr(self, k, v)
+        try:
+            reg = self.build_config(persist)
+        except KeyError as e:
+            print(f"sx126x: valor de configuración no soportado: {e}")
+            for k, v in previous.items():
+                setattr(self, k, v)
+            return False
+        with self.lock:
+            self._mode(config=True)
+            reply = self._command(bytes(reg), len(reg))
+            self._mode(config=False)
+            ok = reply is not None and list(reply[3:]) == reg[3:]
+            if not ok:
+                for k, v in previous.items():
+                    setattr(self, k, v)
+            self.cfg_reg = reg if ok else self.cfg_reg
+            if ok:
+                # La configuración habilita el registro de ruido
+                self.noise_enabled = True
+                self.noise_misses = 0
+            # Tras salir del modo configuración el módulo usa su velocidad de UART
+            self.ser.baudrate = self.uart_baud
+            self.ser.reset_input_buffer()
+            self.parser = FrameParser(max_len=self.buffer_size, rssi=self.rssi, gap=FRAME_GAP)
+        if not ok:
+            print(f"sx126x: fallo al escribir la configuración (respuesta {reply}).")
+        return ok
 
+    def get_settings(self) -> dict:
+        """Lee los registros 00H-08H del módulo. Devuelve None si no responde."""
+        if not self.can_configure:
+            return None
+        with self.lock:
+            self._mode(config=True)
+            reply = self._command(bytes([0xC1, 0x00, 0x09]), 12)
+            self._mode(config=False)
+            self.ser.baudrate = self.uart_baud
+            self.ser.reset_input_buffer()
+        if reply is None or len(reply) < 12 or reply[2] != 0x09:
+            return None
+        reg = reply[3:]
+        if reg[4] & 0x20:
+            self.noise_enabled = True
+        speeds = {v: k for k, v in self.lora_air_speed_dic.items()}
+        bauds = {v: k for k, v in self.uart_baudrate_dic.items()}
+        powers = {v: k for k, v in self.lora_power_dic.items()}
+        sizes = {v: k for k, v in self.lora_buffer_size_dic.items()}
+        start_freq, _ = self._channel()
+        return {
+            "module_addr": (reg[0] << 8) | reg[1],
+            "net_id": reg[2],
+            "uart_baud": bauds.get(reg[3] & 0xE0),
+            "air_speed": speeds.get(reg[3] & 0x07),
+            "buffer_size": sizes.get(reg[4] & 0xC0),
+            "power": powers.get(reg[4] & 0x03),
+            "freq": start_freq + reg[5],
+            "rssi": bool(reg[6] & 0x80),
+            "relay": bool(reg[6] & 0x20),
+            "lbt": bool(reg[6] & 0x10),
+            "wor": bool(reg[6] & 0x08),
+        }
+
+    def set_air_speed(self, air_speed: int) -> bool:
+        return self.set(air_speed=air_speed)
+
+    def set_uart_baud(self, uart_baud: int) -> bool:
+        return self.set(uart_baud=uart_baud)
+
+    def get_channel_rssi(self):
+        """
+        Ruido del canal y RSSI del último paquete (dBm), en modo normal. None si
+        no responde. Los bytes de paquetes que lleguen mientras tanto no se
+        pierden: pasan al parser y se entregan en el siguiente receive_frames.
+
+        Sólo se pregunta con el registro de ruido habilitado. Tras
+        NOISE_MAX_MISSES lecturas seguidas sin respuesta se deja de preguntar
+        durante NOISE_REPROBE segundos (una respuesta perdida no desactiva LBT).
+        """
+        if not self.noise_enabled or time.monotonic() < self.noise_retry_at:
+            return None
+        with self.lock:
+            self.ser.write(bytes([0xC0, 0xC1, 0xC2, 0xC3, 0x00, 0x02]))
+            deadline = time.monotonic() + 0.5
+            data = b""
+            i = -1
+            while time.monotonic() < deadline:
+                data += self.ser.read(self.ser.in_waiting or 1)
+                i = data.find(RSSI_REPLY)
+                if i >= 0 and len(data) >= i + 5:
+                    break
+            if i < 0 or len(data) < i + 5:
+                self.noise_misses += 1
+                if self.noise_misses >= NOISE_MAX_MISSES:
+                    self.noise_misses = 0
+                    self.noise_retry_at = time.monotonic() + NOISE_REPROBE
+                    print(f"sx126x: sin respuesta a la lectura de ruido, se reintenta en {NOISE_REPROBE:.0f} s.")
+                self.held += [split_rssi(f, self.rssi) for f in self.parser.feed(data)]
+                return None
+            self.noise_misses = 0
+            reply = data[i:i + 5]
+            self.held += [split_rssi(f, self.rssi) for f in self.parser.feed(data[:i] + data[i + 5:])]
+        return -(256 - reply[3]), -(256 - reply[4])
+
+    def channel_busy(self, threshold=-100) -> bool:
+        """
+        Detección de portadora antes de transmitir: ocupado si está llegando un
+        paquete por la UART o si el ruido del canal supera 'threshold' dBm.
+        """
+        with self.lock:
+            # El parser lo modifica el hilo de recepción con el mismo lock
+            receiving = bool(self.parser.buff) or self.ser.in_waiting > 0
+        if receiving:
+            return True
+        reading = self.get_channel_rssi()
+        return reading is not None and reading[0] > threshold
+
+    # ---------------------------
+    # DATOS
+    # ---------------------------
     def send_bytes(self, data):
         """
         Envía datos al puerto serie añadiendo un carácter de fin de mensaje.
@@ -50,22 +388,62 @@ class sx126x:
         #     data = data.encode()  # Convertir string a bytes si hace falta
         packet = data
         print(f"Sending bytes: {packet}")
-        self.ser.write(packet)
+        with self.lock:
+            self.ser.write(packet)
 
-    def receive_bytes(self):
+    def receive_frames(self) -> list:
         """
-        Recibe bytes desde el puerto serie hasta encontrar END_CHAR.
-        Devuelve None si no hay datos.
+        Lee lo disponible en el puerto serie (bloquea como mucho FRAME_GAP) y
+        devuelve todos los paquetes que se hayan completado, como RxFrame sin
+        el byte de RSSI (que queda en frame.rssi).
         """
         try:
-            if self.ser.in_waiting > 0:
-                time.sleep(0.5)  # Wait for complete message
-                r_buff = self.ser.read(self.ser.in_waiting)
-
-                return r_buff
+            with self.lock:
+                data = self.ser.read(self.ser.in_waiting or 1)
+                frames, self.held = self.held, []
+                return frames + [split_rssi(f, self.rssi) for f in self.parser.feed(data)]
         except Exception as e:
             print(f"Error receiving bytes: {e}")
+            self.parser.reset()
+            return []
+
+    def fileno(self) -> int:
+        return self.ser.fileno()
+
+    def read_available(self):
+        """
+        Sin bloquear (para AsyncRuntime): lee lo que haya en la UART y devuelve
+        los paquetes completos, o None si la radio está ocupada configurándose.
+        """
+        if not self.lock.acquire(blocking=False):
             return None
+        try:
+            n = self.ser.in_waiting
+            data = self.ser.read(n) if n else b""
+            frames, self.held = self.held, []
+            return frames + [split_rssi(f, self.rssi) for f in self.parser.feed(data)]
+        except Exception as e:
+            print(f"Error receiving bytes: {e}")
+            self.parser.reset()
+            return []
+        finally:
+            self.lock.release()
+
+    @property
+    def pending(self) -> bool:
+        """Hay un paquete a medias esperando al silencio que lo cierra."""
+        return bool(self.parser.buff or self.held)
+
+    def receive_bytes(self):
+        """
+        Devuelve el siguiente paquete completo recibido.
+        Devuelve None si no hay datos.
+        """
+        if not self.rx_frames:
+            self.rx_frames.extend(self.receive_frames())
+        if self.rx_frames:
+            return self.rx_frames.pop(0)
+        return None
 
     def close(self):
         self.ser.close()
@@ -0,0 +1,134 @@
+"""
+Micro-benchmark de la cabecera de los paquetes LoRa.
+
+Compara las funciones anteriores de LoRaNode (cabecera con desplazamientos y
+bytes([...]), tres message.encode() y un print por paquete) con HeaderCodec
+(struct precompilado, pack_into y lectura sin copias con datos perezosos).
+Los print de las funciones anteriores van a os.devnull, así que su coste es
+el mínimo que tendrían en el nodo.
+
+Uso (desde LoRa/v1):  python Pruebas/bench_header_codec.py [paquetes]
+"""
+
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NodoLoRa.HeaderCodec import MAX_FRAME, decode, encode, encode_into, make_flags
+
+ADDR = 1
+FREQ = 433
+
+
+def old_pack_message(addr_dest, msg_type, msg_id, message, relay_flag=0):
+    """pack_message anterior, para comparar."""
+    offset_freq = FREQ - 410
+    header = bytes([
+        (addr_dest >> 8) & 0xFF, addr_dest & 0xFF,
+        (ADDR >> 8) & 0xFF, ADDR & 0xFF,
+        (0x00),
+        (relay_flag << 7) | (msg_type & 0x7F),
+        msg_id & 0xFF
+    ])
+    print(f"Message size: {len(message.encode())} / Total size: {len(header) + len(message.encode())} bytes")
+    if len(header) + len(message.encode()) > 242:
+        return
+    return header + message.encode()
+
+
+def old_pack_bytes(addr_dest, msg_type, msg_id, data, relay_flag=0, part=0, frag=False):
+    """pack_bytes anterior, para comparar."""
+    offset_freq = FREQ - 410
+    header = bytes([
+        (addr_dest >> 8) & 0xFF, addr_dest & 0xFF,
+        (ADDR >> 8) & 0xFF, ADDR & 0xFF,
+        (0x01 if part == 0 else 0x03) | (0x04 if frag else 0x00),
+        (relay_flag << 7) | (msg_type & 0x7F),
+        msg_id & 0xFF
+    ])
+    print(f"Bytes size: {len(data)} / Total size: {len(header) + len(data)} bytes")
+    if len(header) + len(data) > 242:
+        return
+    return header + data
+
+
+def old_unpack_message(r_buff):
+    """unpack_message anterior, para comparar."""
+    addr_dest = (r_buff[0] << 8) + r_buff[1]
+    addr_sender = (r_buff[2] << 8) + r_buff[3]
+    part = r_buff[4] & 0x02
+    is_b = r_buff[4] & 0x01
+    frag = r_buff[4] & 0x04
+    msg_type = r_buff[5] & 0x7F
+    relay_flag = r_buff[5] >> 7
+    msg_id = r_buff[6]
+    if is_b == 0:
+        message = r_buff[7:].decode(errors='ignore')
+    else:
+        message = r_buff[7:]
+    if is_b == 0:
+        print(f"Unpacked message: from {addr_sender} to {addr_dest}, type {msg_type}, id {msg_id}, relay {relay_flag}, msg: {message}")
+    else:
+        print(f"Unpacked bytes: from {addr_sender} to {addr_dest}, type {msg_type}, id {msg_id}, relay {relay_flag}, part {part}, is_b {is_b}, bytes length: {len(message)}")
+    return addr_sender, addr_dest, msg_type, msg_id, relay_flag, message, part, is_b, frag
+
+
+def new_unpack_message(r_buff):
+    p = decode(r_buff)
+    return p.src, p.dest, p.msg_type, p.msg_id, p.relay, p.message, p.part, p.is_b, p.frag
+
+
+def new_fragment_header(r_buff):
+    """Lo que mira el receptor de un fragmento antes de pasar los datos (memoryview) al FragmentManager."""
+    p = decode(r_buff)
+    return p.src, p.msg_type, p.msg_id, p.frag, p.payload
+
+
+def bench(fn, items, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for args in items:
+            fn(*args)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    text = '{"packet_id": 12, "saved": [1, 2, 3, 4, 5, 6, 7, 8], "robot_id": 3}'
+    data = bytes(range(200))
+    buf = bytearray(MAX_FRAME)
+    text_frame = bytes(encode(0, ADDR, 4, 1, text.encode()))
+    frag_frame = bytes(encode(0, ADDR, 0, 30, data, make_flags(True, 1, True)))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # Mismos paquetes y mismos campos que las funciones anteriores
+        assert old_pack_message(0, 4, 1, text) == text_frame
+        assert old_pack_bytes(0, 0, 30, data, 0, 1, True) == frag_frame
+        for frame in (text_frame, frag_frame):
+            assert old_unpack_message(frame) == new_unpack_message(frame)
+    cases = (
+        ("texto: empaquetar", (old_pack_message, [(0, 4, 1, text)] * n),
+         (lambda *a: encode(a[0], ADDR, a[1], a[2], a[3].encode()), [(0, 4, 1, text)] * n)),
+        ("binario: empaquetar", (old_pack_bytes, [(0, 0, 30, data, 0, 1, True)] * n),
+         (lambda *a: encode(a[0], ADDR, a[1], a[2], a[3], make_flags(True, a[5], a[6])), [(0, 0, 30, data, 0, 1, True)] * n)),
+        ("binario: pack_into", (old_pack_bytes, [(0, 0, 30, data, 0, 1, True)] * n),
+         (lambda *a: encode_into(buf, 0, a[0], ADDR, a[1], a[2], a[3], make_flags(True, a[5], a[6])), [(0, 0, 30, data, 0, 1, True)] * n)),
+        ("texto: desempaquetar", (old_unpack_message, [(text_frame,)] * n),
+         (new_unpack_message, [(text_frame,)] * n)),
+        ("binario: desempaquetar", (old_unpack_message, [(frag_frame,)] * n),
+         (new_unpack_message, [(frag_frame,)] * n)),
+        ("fragmento: sólo cabecera", (old_unpack_message, [(frag_frame,)] * n),
+         (new_fragment_header, [(frag_frame,)] * n)),
+    )
+    print(f"{n} paquetes por caso ({len(text)} B de texto, {len(data)} B binarios)")
+    print(f"{'caso':>26} | {'anterior':>12} | {'HeaderCodec':>12} | {'mejora':>7}")
+    for name, (old_fn, old_items), (new_fn, new_items) in cases:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            old = bench(old_fn, old_items)
+        new = bench(new_fn, new_items)
+        print(f"{name:>26} | {old * 1e6 / n:8.2f} µs/p | {new * 1e6 / n:8.2f} µs/p | {old / new:6.1f}x")
@@ -0,0 +1,104 @@
+"""
+Banco de pruebas de acceso al canal: transmisión directa (ALOHA) frente a
+escucha antes de transmitir (ListenBeforeTalk) con varios nodos compitiendo.
+
+Cada nodo envía paquetes a la EB con llegadas de Poisson; la carga ofrecida se
+da como fracción de la capacidad del canal (1.0 = el canal ocupado todo el
+tiempo si no hubiera colisiones). Para cada carga se informa de los paquetes
+entregados por segundo, las colisiones y las esperas del LBT.
+
+Uso (desde LoRa/v1):
+  python Pruebas/bench_lbt.py --nodes 8 --duration 20 --load 0.2 0.5 1.0
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NodoLoRa.HeaderCodec import HEADER_SIZE, encode
+from NodoLoRa.ListenBeforeTalk import ListenBeforeTalk
+from NodoLoRa.TxScheduler import PRIO_TELEMETRY, TxScheduler
+from NodoLoRa.VirtualChannel import VirtualChannel
+
+
+def run(nodes, load, duration, size, air_speed, lbt, seed):
+    channel = VirtualChannel(seed=seed)
+    sink = channel.radio(0, air_speed=air_speed)
+    radios = [channel.radio(i + 1, air_speed=air_speed) for i in range(nodes)]
+    schedulers = []
+    for r in radios:
+        r.uart_baud = 115200
+        tx = TxScheduler(r)
+        if lbt:
+            tx.access = ListenBeforeTalk(r)
+        schedulers.append(tx)
+
+    airtime = channel.airtime(size, air_speed)
+    rate = load / (nodes * airtime)         # paquetes/s por nodo
+    rand = random.Random(seed)
+    running = threading.Event()
+    running.set()
+    received = [0]
+
+    def source(i, tx):
+        payload = encode(0, i + 1, 0, 40, bytes(size - HEADER_SIZE))
+        while running.is_set():
+            time.sleep(rand.expovariate(rate))
+            tx.submit(payload, PRIO_TELEMETRY)
+
+    def receive():
+        while running.is_set():
+            received[0] += len(sink.receive_frames())
+
+    threads = [threading.Thread(target=source, args=(i, tx), daemon=True) for i, tx in enumerate(schedulers)]
+    threads.append(threading.Thread(target=receive, daemon=True))
+    for th in threads:
+        th.start()
+    time.sleep(duration)
+    running.clear()
+
+    stats = channel.stats()
+    deferrals = forced = 0
+    for tx in schedulers:
+        if tx.access is not None:
+            s = tx.access.stats()
+            deferrals += sum(s["deferrals"])
+            forced += s["forced"]
+        tx.stop()
+    channel.stop()
+    return {
+        "sent": sum(sum(tx.stats()["sent"]) for tx in schedulers),
+        "delivered_s": received[0] / duration,
+        "collisions": sum(r.collisions for r in radios),
+        "deferrals": deferrals,
+        "forced": forced,
+        "busy": stats["busy"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--nodes", type=int, default=8)
+    ap.add_argument("--load", type=float, nargs="+", default=[0.2, 0.5, 1.0])
+    ap.add_argument("--duration", type=float, default=20.0, help="segundos por caso")
+    ap.add_argument("--size", type=int, default=64, help="bytes por paquete")
+    ap.add_argument("--air-speed", type=int, default=62500)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    print(f"Nodos: {args.nodes}  paquete: {args.size} B  air speed: {args.air_speed} bps  {args.duration:.0f} s por caso")
+    print(f"{'carga':>6} | {'modo':>6} | {'enviados':>8} | {'entregados/s':>12} | {'colisiones':>10} | {'esperas':>8} | {'forzados':>8}")
+    for load in args.load:
+        for lbt in (False, True):
+            r = run(args.nodes, load, args.duration, args.size, args.air_speed, lbt, args.seed)
+            print(f"{load:>6.2f} | {'LBT' if lbt else 'ALOHA':>6} | {r['sent']:>8} | {r['delivered_s']:>12.1f} | "
+                  f"{r['collisions']:>10} | {r['deferrals']:>8} | {r['forced']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+CPU en reposo de la ruta de recepción de una radio: el hilo de recepción de
+LoRaNode (receive_frames en bucle) frente al runtime asyncio (AsyncRuntime,
+que vigila el descriptor de la UART con add_reader).
+
+El módulo LoRa es un sx126x real sobre un pseudo-terminal (os.openpty), así
+que la UART se lee igual que en la Raspberry. Sólo se importan la radio y el
+runtime: el nodo es un receptor mínimo que cuenta los paquetes, y se comprueba
+que ambos modos entregan los que se escriben en el otro extremo del pty. Se
+mide el tiempo de CPU del proceso durante 'duration' segundos sin tráfico.
+
+Uso (desde LoRa/v1):  python Pruebas/bench_runtime_cpu.py --duration 30
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NodoLoRa.AsyncRuntime import AsyncRuntime
+from NodoLoRa.sx126x_bis import sx126x
+
+
+class Receiver:
+    """Lo que AsyncRuntime necesita de LoRaNode para leer las radios."""
+    def __init__(self, radios):
+        self.radios = radios
+        self.running = True
+        self.frames = 0
+
+    def handle_frames(self, radio, frames, wait=True):
+        self.frames += len(frames)
+
+    def receive_loop(self, radio):
+        # Como LoRaNode.receive_loop
+        while self.running:
+            self.handle_frames(radio, radio.receive_frames())
+
+
+def run(use_asyncio, duration, warmup, radios=1):
+    ptys = [os.openpty() for _ in range(radios)]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        node = Receiver([sx126x(os.ttyname(slave), 433, 1, 0) for _, slave in ptys])
+    if use_asyncio:
+        runtime = AsyncRuntime(node)
+        runtime.start()
+    else:
+        for radio in node.radios:
+            threading.Thread(target=node.receive_loop, args=(radio,), daemon=True).start()
+    # Un paquete por radio para comprobar que la ruta entrega lo que llega
+    for master, _ in ptys:
+        os.write(master, b"\x00\x01\x00\x02\x00\x02\x07hola")
+    time.sleep(warmup)
+    delivered = node.frames
+    cpu = time.process_time()
+    time.sleep(duration)
+    cpu = time.process_time() - cpu
+    node.running = False
+    if use_asyncio:
+        runtime.stop()
+    time.sleep(0.1)
+    for radio in node.radios:
+        radio.close()
+    for master, slave in ptys:
+        os.close(master)
+        os.close(slave)
+    return 100 * cpu / duration, delivered
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--duration", type=float, default=30.0, help="segundos medidos por modo")
+    ap.add_argument("--warmup", type=float, default=2.0)
+    ap.add_argument("--radios", type=int, default=1)
+    args = ap.parse_args()
+
+    print(f"{'modo':>8} | {'CPU':>7} | {'paquetes':>8}")
+    for use_asyncio in (False, True):
+        cpu, delivered = run(use_asyncio, args.duration, args.warmup, args.radios)
+        print(f"{'asyncio' if use_asyncio else 'hilos':>8} | {cpu:6.2f}% | {delivered:>8}")
+
+
+if __name__ == "__main__":
+    main()
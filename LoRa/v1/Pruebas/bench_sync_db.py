@@ -0,0 +1,141 @@
+"""
+Coste por ciclo de sincronización de la BBDD del robot frente al número de
+registros pendientes.
+
+Para cada tamaño de la cola pendiente (sensores y movimientos sin sincronizar,
+como tras horas fuera de cobertura) se mide:
+
+  - anterior: la consulta de antes (filter_by(sinc=False).order_by(timestamp)
+    de todos los pendientes, como objetos ORM y luego diccionarios);
+  - ciclo:    un poll() de NodeSyncManager, que llena la ventana de paquetes
+    leyendo por páginas desde el cursor con el índice de pendientes (sinc = 0)
+    y guarda cada paquete en vuelo en la BBDD.
+
+Si el escaneo es proporcional a lo enviado, 'ciclo' se mantiene constante al
+crecer la cola.
+
+Después se mide el proceso de un ACK que confirma 'ack' registros:
+
+  - por fila:  el mark_as_synced anterior (un UPDATE por registro);
+  - IN:        mark_as_synced actual (un UPDATE ... WHERE id IN por tabla),
+               como con un ACK JSON;
+  - rangos:    handle_ack con el ACK binario por rangos (mark_ranges_synced).
+
+Uso (desde LoRa/v1):  python Pruebas/bench_sync_db.py [--ack N] [n1 n2 ...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BBDDv2.db_SQLite import RobotDatabase, SensorData, RobotMovimiento
+from BBDDv2.NodeSyncManager import NodeSyncManager
+from BBDDv2.SyncCodec import encode_ack
+
+
+def fill(db, n):
+    t0 = datetime(2025, 1, 1)
+    sensors = [{"timestamp": t0 + timedelta(seconds=5 * i), "temp": 20 + (i % 50) / 10,
+                "hum": 40 + (i % 30) / 10, "sinc": False} for i in range(n // 2)]
+    movs = [{"timestamp": t0 + timedelta(seconds=5 * i), "L": 0.5, "R": -0.25, "sinc": False}
+            for i in range(n - n // 2)]
+    with db.engine.begin() as conn:
+        conn.execute(SensorData.__table__.insert(), sensors)
+        conn.execute(RobotMovimiento.__table__.insert(), movs)
+
+
+def old_scan(db):
+    """Consulta anterior de get_unsynced_sensors/get_unsynced_movimientos."""
+    out = []
+    for model, fields in ((SensorData, ("temp", "hum")), (RobotMovimiento, ("L", "R"))):
+        s = db.new_session()
+        rows = s.query(model).filter_by(sinc=False).order_by(model.timestamp.asc()).all()
+        s.close()
+        out += [{"table": model.__tablename__, "id": r.id,
+                 "data": dict({"timestamp": r.timestamp.isoformat()}, **{f: getattr(r, f) for f in fields})}
+                for r in rows]
+    return out
+
+
+def old_mark(db, entries):
+    """mark_as_synced anterior: un UPDATE por registro."""
+    s = db.new_session()
+    for entry in entries:
+        model = SensorData if entry["table"] == "sensores" else RobotMovimiento
+        s.query(model).filter(model.id == entry["id"]).update({"sinc": True})
+    s.commit()
+    s.close()
+
+
+def reset(db):
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE sensores SET sinc = 0")
+        conn.exec_driver_sql("UPDATE robot_movimiento SET sinc = 0")
+
+
+def forget_sync_state(db):
+    """Como una BBDD que nunca ha sincronizado: sin cursor ni paquetes en vuelo."""
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM sync_state")
+        conn.exec_driver_sql("DELETE FROM sync_inflight")
+
+
+def best_of(fn, repeat=3, setup=None):
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_ack(n):
+    workdir = tempfile.mkdtemp(prefix="lora_db_")
+    # Como en el robot: WAL con synchronous=NORMAL
+    db = RobotDatabase(os.path.join(workdir, "robot_data.db"), write_behind=True)
+    fill(db, n)
+    entries = [{"table": "sensores", "id": i} for i in range(1, n // 2 + 1)]
+    entries += [{"table": "robot_movimiento", "id": i} for i in range(1, n - n // 2 + 1)]
+    ack = encode_ack(1, entries)
+    sync = NodeSyncManager(db, 1)
+    reset_db = lambda: (reset(db), forget_sync_state(db))
+    t_row, _ = best_of(lambda: old_mark(db, entries), setup=reset_db)
+    t_in, _ = best_of(lambda: db.mark_as_synced(entries), setup=reset_db)
+    t_ranges, _ = best_of(lambda: sync.handle_ack(ack), setup=reset_db)
+    assert not db.get_unsynced_entries(limit=1)
+    print(f"ACK de {n} registros ({len(ack)} bytes): por fila {1000 * t_row:.1f} ms | "
+          f"IN {1000 * t_in:.1f} ms | rangos {1000 * t_ranges:.2f} ms")
+    db.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("sizes", nargs="*", type=int, default=[1000, 10000, 50000], help="registros pendientes")
+    ap.add_argument("--ack", type=int, default=10000, help="registros confirmados por el ACK")
+    args = ap.parse_args()
+
+    print(f"{'pendientes':>10} | {'anterior':>10} | {'ciclo':>9} | {'paquetes':>8} | {'registros':>9}")
+    for n in args.sizes:
+        workdir = tempfile.mkdtemp(prefix="lora_db_")
+        db = RobotDatabase(os.path.join(workdir, "robot_data.db"), write_behind=True)
+        fill(db, n)
+        t_old, _ = best_of(lambda: old_scan(db))
+        # Un gestor nuevo en cada repetición, con el cursor en 0
+        t_new, packets = best_of(lambda: NodeSyncManager(db, 1).poll(), setup=lambda: forget_sync_state(db))
+        sent = sum(len(p.entries) for p in packets)
+        print(f"{n:>10} | {1000 * t_old:>8.1f}ms | {1000 * t_new:>7.2f}ms | {len(packets):>8} | {sent:>9}")
+        db.close()
+    print()
+    bench_ack(args.ack)
+
+
+if __name__ == "__main__":
+    main()
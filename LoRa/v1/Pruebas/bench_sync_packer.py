@@ -0,0 +1,82 @@
+"""
+Micro-benchmark del empaquetado de la sincronización BBDD (NodeSyncManager).
+
+Compara, para un número creciente de registros pendientes, el empaquetador
+anterior (json.dumps de la lista completa tras añadir cada registro) con el
+empaquetador incremental actual, en JSON y en binario. Si el coste es lineal,
+los µs por registro se mantienen constantes al crecer n.
+
+Uso (desde LoRa/v1):  python Pruebas/bench_sync_packer.py [n1 n2 ...]
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BBDDv2.NodeSyncManager import NodeSyncManager, SyncPacket
+
+
+def make_entries(n):
+    t0 = datetime(2025, 1, 1)
+    tables = ("sensores", "sensores", "sensores", "robot_movimiento")
+    entries = []
+    for i in range(n):
+        table = tables[i % len(tables)]
+        ts = (t0 + timedelta(seconds=5 * i)).isoformat()
+        if table == "sensores":
+            data = {"timestamp": ts, "temp": 20 + (i % 50) / 10, "hum": 40 + (i % 30) / 10}
+        else:
+            data = {"timestamp": ts, "L": 0.5, "R": -0.25}
+        entries.append({"table": table, "id": i + 1, "data": data})
+    return entries
+
+
+def old_pack(entries, robot_id=0, max_bytes=240):
+    """Empaquetador anterior, para comparar."""
+    packets = []
+    current_entries = []
+    for entry in entries:
+        entry["data"]["robot_id"] = robot_id
+        current_entries.append(entry)
+        packet_size = len(json.dumps(current_entries).encode('utf-8'))
+        if packet_size > max_bytes:
+            current_entries.pop()
+            if current_entries:
+                packets.append(SyncPacket(current_entries))
+            current_entries = [entry]
+    if current_entries:
+        packets.append(SyncPacket(current_entries))
+    return packets
+
+
+def bench(fn, entries, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        packets = fn(entries)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return best, len(packets)
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 5000, 10000, 20000, 40000]
+    json_sync = NodeSyncManager(db=None, r_id=1, codec="json")
+    bin_sync = NodeSyncManager(db=None, r_id=1, codec="binary")
+    cases = (
+        ("anterior (JSON)", old_pack),
+        ("incremental JSON", json_sync.prepare_packets),
+        ("incremental binario", bin_sync.prepare_packets),
+    )
+    print(f"{'registros':>10} | " + " | ".join(f"{name:>28}" for name, _ in cases))
+    for n in sizes:
+        entries = make_entries(n)
+        cols = []
+        for _, fn in cases:
+            dt, n_packets = bench(fn, entries)
+            cols.append(f"{dt * 1000:8.1f} ms {dt * 1e6 / n:6.1f} µs/r {n_packets:5d} p")
+        print(f"{n:>10} | " + " | ".join(f"{c:>28}" for c in cols))
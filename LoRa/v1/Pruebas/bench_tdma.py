@@ -0,0 +1,133 @@
+"""
+Banco de pruebas de TDMA: transmisión libre (ALOHA) frente a ranuras
+coordinadas por la EB (TdmaScheduler) con varios robots enviando telemetría.
+
+Sobre un VirtualChannel, sin LoRaNode: cada nodo es un TxScheduler con su
+radio virtual y, en el modo TDMA, su TdmaScheduler como 'gate'. La EB difunde
+una baliza cada 'beacon' segundos con el mapa de ranuras de todos los robots, y
+cada robot la procesa al recibirla (como LoRaNode._on_ping). Los robots empiezan a
+enviar tras 'warmup' segundos (ya con la primera baliza, como tras el ping de
+arranque de la EB), con llegadas de Poisson; la carga ofrecida es la fracción de
+la capacidad del canal. Se informa de los paquetes entregados a la EB por
+segundo y de las colisiones.
+
+Uso (desde LoRa/v1):
+  python Pruebas/bench_tdma.py --nodes 5 --duration 60 --load 0.5 1.0
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NodoLoRa.HeaderCodec import HEADER_SIZE, decode, encode
+from NodoLoRa.TdmaScheduler import TdmaScheduler
+from NodoLoRa.TxScheduler import PRIO_CONTROL, PRIO_TELEMETRY, TxScheduler
+from NodoLoRa.VirtualChannel import VirtualChannel
+
+BASE_ADDR = 0
+
+
+class Node:
+    """Lo que TdmaScheduler necesita de LoRaNode."""
+    def __init__(self, radio, addr, is_base, members=()):
+        self.node = radio
+        self.addr = addr
+        self.is_base = is_base
+        self.lock_nodes = threading.Lock()
+        self.connected_nodes = {a: {} for a in members}
+        self.tx = TxScheduler(radio)
+        self.tdma = TdmaScheduler(self)
+
+    def pack_message(self, dest, msg_type, msg_id, message):
+        return encode(dest, self.addr, msg_type, msg_id, message.encode())
+
+
+def run(nodes, load, duration, size, air_speed, tdma, beacon, seed, warmup=2.0):
+    channel = VirtualChannel(seed=seed)
+    robots_addr = list(range(1, nodes + 1))
+    base = Node(channel.radio(BASE_ADDR, air_speed=air_speed), BASE_ADDR, True, robots_addr)
+    robots = [Node(channel.radio(a, air_speed=air_speed), a, False) for a in robots_addr]
+    for n in [base] + robots:
+        n.node.uart_baud = 115200
+        if tdma:
+            n.tx.gate = n.tdma.wait_time
+    base.tdma.enabled = tdma
+
+    airtime = channel.airtime(size, air_speed)
+    rate = load / (nodes * airtime)         # paquetes/s por robot
+    rand = random.Random(seed)
+    running = threading.Event()
+    running.set()
+    received = [0]
+
+    def source(robot):
+        payload = encode(BASE_ADDR, robot.addr, 0, 40, bytes(size - HEADER_SIZE))
+        while running.is_set():
+            time.sleep(rand.expovariate(rate))
+            robot.tx.submit(payload, PRIO_TELEMETRY)
+
+    def beacons():
+        while running.is_set():
+            if tdma:
+                base.tx.submit_stream(base.tdma.beacon_frames(), PRIO_CONTROL)
+            time.sleep(beacon)
+
+    def receive(n):
+        while running.is_set():
+            for frame in n.node.receive_frames():
+                packet = decode(frame)
+                if packet is None:
+                    continue
+                if n.is_base and packet.msg_type == 0:
+                    received[0] += 1
+                elif not n.is_base and packet.msg_type == 5:
+                    n.tdma.on_beacon(packet.text, packet.frame)
+
+    threads = [threading.Thread(target=receive, args=(n,), daemon=True) for n in [base] + robots]
+    threads.append(threading.Thread(target=beacons, daemon=True))
+    for th in threads:
+        th.start()
+    time.sleep(warmup)
+    received[0] = 0
+    for r in robots:
+        threading.Thread(target=source, args=(r,), daemon=True).start()
+    time.sleep(duration)
+    running.clear()
+
+    sent = sum(sum(r.tx.stats()["sent"]) for r in robots)
+    collisions = sum(r.node.collisions for r in robots)
+    for n in [base] + robots:
+        n.tx.stop()
+    channel.stop()
+    return {"sent": sent, "delivered_s": received[0] / duration, "collisions": collisions}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--nodes", type=int, default=5, help="robots")
+    ap.add_argument("--load", type=float, nargs="+", default=[0.5, 1.0])
+    ap.add_argument("--duration", type=float, default=60.0, help="segundos por caso")
+    ap.add_argument("--size", type=int, default=64, help="bytes por paquete")
+    ap.add_argument("--air-speed", type=int, default=19200)
+    ap.add_argument("--beacon", type=float, default=10.0, help="segundos entre balizas")
+    ap.add_argument("--warmup", type=float, default=2.0, help="segundos con balizas antes del tráfico")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    print(f"Robots: {args.nodes}  paquete: {args.size} B  air speed: {args.air_speed} bps  {args.duration:.0f} s por caso")
+    print(f"{'carga':>6} | {'modo':>6} | {'enviados':>8} | {'entregados/s':>12} | {'colisiones':>10}")
+    for load in args.load:
+        for tdma in (False, True):
+            r = run(args.nodes, load, args.duration, args.size, args.air_speed, tdma, args.beacon, args.seed,
+                    args.warmup)
+            print(f"{load:>6.2f} | {'TDMA' if tdma else 'ALOHA':>6} | {r['sent']:>8} | "
+                  f"{r['delivered_s']:>12.1f} | {r['collisions']:>10}")
+
+
+if __name__ == "__main__":
+    main()
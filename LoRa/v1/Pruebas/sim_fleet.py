@@ -0,0 +1,181 @@
+"""
+Simulador de flota: N robots LoRaNode y una estación base en un solo proceso,
+sobre un VirtualChannel (sin módulos LoRa, robots ni ESP32 reales).
+
+Cada robot arranca con 'backlog' lecturas de sensores pendientes en su BBDD
+local, y su puerto de sensores es un loop:// de pyserial que el simulador
+alimenta con lecturas nuevas. La EB guarda en memoria lo que recibe. Al
+terminar se informa de:
+  - throughput: registros/s guardados en la EB y ocupación del canal
+  - tiempo de vaciado del backlog de cada robot
+  - latencia extremo a extremo (timestamp del registro -> guardado en la EB)
+
+Uso (desde LoRa/v1):
+  python Pruebas/sim_fleet.py --nodes 4 --backlog 200 --loss 0.05 --air-speed 2400 [--tdma]
+"""
+
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NodoLoRa.LoRaNode_bis import LoRaNode
+from NodoLoRa.VirtualChannel import VirtualChannel
+
+BASE_ADDR = 0
+
+
+class MemoryBaseDatabase:
+    """BBDD de la EB en memoria: mismas inserciones que BaseStationDatabase, con instante de llegada."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = []      # (tabla, robot_id, timestamp del registro, instante de llegada)
+
+    def _insert(self, table, robot_id, timestamp):
+        with self.lock:
+            self.rows.append((table, robot_id, timestamp or datetime.now(), datetime.now()))
+            return str(len(self.rows))
+
+    def insert_sensor(self, robot_id, temp, hum, timestamp=None, local_id=None):
+        return self._insert("sensores", robot_id, timestamp)
+
+    def insert_movimiento(self, robot_id, L, R, timestamp=None, local_id=None):
+        return self._insert("robot_movimiento", robot_id, timestamp)
+
+    def insert_media(self, robot_id, path, es_video=False, checksum=None, timestamp=None, local_id=None):
+        return self._insert("media", robot_id, timestamp)
+
+
+def feed_sensors(robots, period, running):
+    """Escribe lecturas en el loop:// de sensores de cada robot."""
+    i = 0
+    while running.is_set():
+        for node in robots:
+            if node.sensores is not None:
+                node.sensores.write(f"Humidity:{50 + i % 10}% Temperature:{20 + i % 5}°C\n".encode("utf-8"))
+        i += 1
+        time.sleep(period)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--nodes", type=int, default=4, help="robots simulados")
+    ap.add_argument("--backlog", type=int, default=200, help="lecturas pendientes por robot al arrancar")
+    ap.add_argument("--loss", type=float, default=0.0, help="probabilidad de pérdida por paquete")
+    ap.add_argument("--air-speed", type=int, default=2400)
+    ap.add_argument("--duty", type=float, default=1.0, help="duty-cycle máximo de cada nodo")
+    ap.add_argument("--rssi", type=float, nargs=2, default=(-70, -110), metavar=("MEJOR", "PEOR"),
+                    help="RSSI del robot más cercano y del más lejano (dBm)")
+    ap.add_argument("--sensor-period", type=float, default=30.0, help="segundos entre lecturas nuevas")
+    ap.add_argument("--timeout", type=float, default=600.0, help="duración máxima (s)")
+    ap.add_argument("--tdma", action="store_true", help="la EB coordina ranuras de tiempo con balizas")
+    ap.add_argument("--radios", type=int, default=1, help="radios de la EB (canales 433, 434, ...)")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--verbose", action="store_true", help="mostrar el log de los nodos")
+    args = ap.parse_args()
+
+    channel = VirtualChannel(loss=args.loss, seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix="lora_sim_")
+    db_base = MemoryBaseDatabase()
+    log = sys.stdout if args.verbose else open(os.devnull, "w")
+
+    with contextlib.redirect_stdout(log):
+        base = LoRaNode(None, BASE_ADDR, EB=1, duty_cycle=args.duty, db_base=db_base, tdma=args.tdma,
+                        radio=channel.radio(BASE_ADDR, air_speed=args.air_speed),
+                        extra_radios=[channel.radio(BASE_ADDR, freq=433 + i, air_speed=args.air_speed)
+                                      for i in range(1, args.radios)])
+        if args.radios > 1:
+            base.tx.period = 10.0       # repartir antes que en una EB real
+        base.run()
+        robots = []
+        for i in range(args.nodes):
+            addr = i + 1
+            rssi = args.rssi[0] + (args.rssi[1] - args.rssi[0]) * i / max(1, args.nodes - 1)
+            channel.set_link(BASE_ADDR, addr, rssi=rssi)
+            node = LoRaNode(None, addr, EB=0, duty_cycle=args.duty,
+                            robot_port="loop://", robot_baudrate=115200,
+                            sens_port="loop://", sens_baudrate=115200,
+                            data_dir=os.path.join(workdir, f"robot_{addr}"),
+                            radio=channel.radio(addr, air_speed=args.air_speed))
+            robots.append(node)
+
+    # Backlog inicial: la BBDD del robot se crea en run(), así que se rellena
+    # justo después, se vacía la cola de escritura diferida (write_behind) y se
+    # despierta al bucle de sincronización
+    t0 = time.monotonic()
+    start = datetime.now()
+    with contextlib.redirect_stdout(log):
+        for node in robots:
+            node.run()
+            for k in range(args.backlog):
+                node.db.insert_sensor(temp=20 + k % 10, hum=50, timestamp=start)
+            node.db.flush()
+            with node.sync.cond:
+                node.sync.cond.notify_all()
+
+    running = threading.Event()
+    running.set()
+    threading.Thread(target=feed_sensors, args=(robots, args.sensor_period, running), daemon=True).start()
+
+    drained = {}
+    with contextlib.redirect_stdout(log):
+        while time.monotonic() - t0 < args.timeout and len(drained) < len(robots):
+            for node in robots:
+                # Vaciado: nada pendiente en la BBDD ni en la ventana de sincronización
+                if (node.addr not in drained and node.sync.window_stats()["in_flight"] == 0
+                        and not node.db.get_unsynced_sensors(limit=1)):
+                    drained[node.addr] = time.monotonic() - t0
+            time.sleep(0.5)
+    elapsed = time.monotonic() - t0
+    running.clear()
+
+    with contextlib.redirect_stdout(log):
+        for node in robots + [base]:
+            node.stop()
+        channel.stop()
+
+    with db_base.lock:
+        rows = list(db_base.rows)
+    latencies = [(arrival - ts).total_seconds() for _, _, ts, arrival in rows]
+    ch = channel.stats()
+    print(f"Robots: {args.nodes}  backlog: {args.backlog}/robot  air speed: {args.air_speed} bps  "
+          f"pérdida: {args.loss:.0%}  duty-cycle: {args.duty:.0%}  TDMA: {'sí' if args.tdma else 'no'}  radios EB: {args.radios}")
+    print(f"Duración: {elapsed:.1f} s")
+    print(f"Registros en la EB: {len(rows)}  ({len(rows) / elapsed:.2f} reg/s)")
+    print(f"Canal: {ch['tx']} paquetes, {ch['tx_bytes']} bytes ({ch['tx_bytes'] / elapsed:.0f} B/s), "
+          f"ocupación {ch['busy']:.0%}, entregados {ch['delivered']}, perdidos {ch['lost']}, "
+          f"colisiones {ch['collided']}, bajo sensibilidad {ch['weak']}, partidos {ch['split']}")
+    if args.radios > 1:
+        for s in base.tx.stats()["radios"]:
+            print(f"  radio {s['freq']} MHz: robots {s['robots']}, {sum(s['sent'])} paquetes enviados")
+    links = base.links.snapshot()
+    for node in robots:
+        t = drained.get(node.addr)
+        stats = node.sync.window_stats()
+        link = links.get(node.addr, {})
+        loss = link.get("loss")
+        print(f"  robot {node.addr}: backlog vaciado en {f'{t:.1f} s' if t is not None else 'NO (timeout)'}, "
+              f"ACKs {stats['acked']}, retransmisiones {stats['retransmissions']}, "
+              f"RSSI en la EB {link.get('rssi')} dBm, pérdidas {'-' if loss is None else f'{loss:.0%}'}")
+    if latencies:
+        print(f"Latencia extremo a extremo: media {statistics.mean(latencies):.1f} s, "
+              f"p50 {percentile(latencies, 50):.1f} s, p95 {percentile(latencies, 95):.1f} s, "
+              f"máx {max(latencies):.1f} s")
+
+
+if __name__ == "__main__":
+    main()